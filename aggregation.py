@@ -0,0 +1,87 @@
+from abc import ABC, abstractmethod
+
+
+class TransferAggregator(ABC):
+    """Итоги по транзакциям кошелька за один проход.
+
+    Суммы копятся в целых минимальных единицах (wei для ETH), поэтому не
+    расходятся с балансом в сети. Адрес нормализуется один раз.
+    """
+
+    def __init__(self, wallet, decimals):
+        self.wallet = wallet.lower()
+        self.decimals = decimals
+        self.count_in = 0
+        self.count_out = 0
+        self.total_in = 0
+        self.total_out = 0
+        self.total_fee = 0
+
+    @property
+    def count(self):
+        return self.count_in + self.count_out
+
+    @abstractmethod
+    def add(self, tx):
+        """Учитывает одну транзакцию в итогах"""
+
+    def tap(self, txs):
+        """Пропускает транзакции дальше, попутно учитывая их в итогах"""
+        for tx in txs:
+            self.add(tx)
+            yield tx
+
+    def add_totals(self, count_in=0, count_out=0, total_in=0, total_out=0, total_fee=0):
+        """Учитывает итоги, посчитанные целиком по столбцам"""
+        self.count_in += count_in
+        self.count_out += count_out
+        self.total_in += total_in
+        self.total_out += total_out
+        self.total_fee += total_fee
+
+    def to_units(self, value):
+        return value / 10**self.decimals
+
+    def as_dict(self):
+        """Итоги в целых единицах токена, в формате статистики бота"""
+        return {
+            'total_in': self.to_units(self.total_in),
+            'total_out': self.to_units(self.total_out),
+            'total_fee': self.total_fee / 10**18,
+            'count_in': self.count_in,
+            'count_out': self.count_out
+        }
+
+
+class EthAggregator(TransferAggregator):
+    """Итоги по обычным ETH транзакциям: входящие, исходящие и комиссии"""
+
+    def __init__(self, wallet):
+        super().__init__(wallet, 18)
+
+    def add(self, tx):
+        value = int(tx['value'])
+        succeeded = tx.get('isError', '0') != '1'
+        if tx['from'].lower() == self.wallet:
+            self.count_out += 1
+            self.total_fee += int(tx['gasPrice']) * int(tx['gasUsed'])
+            if succeeded:
+                self.total_out += value
+        # Перевод самому себе учитывается и как исходящий, и как входящий
+        if tx['to'].lower() == self.wallet:
+            self.count_in += 1
+            if succeeded:
+                self.total_in += value
+
+
+class TokenAggregator(TransferAggregator):
+    """Итоги по переводам токена"""
+
+    def add(self, tx):
+        value = int(tx['value'], 16) if tx['value'].startswith('0x') else int(tx['value'])
+        if tx['to'].lower() == self.wallet:
+            self.count_in += 1
+            self.total_in += value
+        else:
+            self.count_out += 1
+            self.total_out += value
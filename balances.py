@@ -0,0 +1,108 @@
+from prices import SECONDS_PER_DAY
+from streams import ETH_SOURCES, merge_by_block, as_eth_transfer
+
+ETH_DECIMALS = 18
+# Сколько блоков истории читается в память за один шаг построения индекса
+INDEX_CHUNK_BLOCKS = 100000
+
+
+def eth_balance_delta(tx, wallet):
+    """Изменение баланса ETH кошелька от обычной транзакции, в wei"""
+    delta = 0
+    succeeded = tx.get('isError', '0') != '1'
+    if tx['from'].lower() == wallet:
+        delta -= int(tx['gasPrice']) * int(tx['gasUsed'])
+        if succeeded:
+            delta -= int(tx['value'])
+    if tx['to'].lower() == wallet and succeeded:
+        delta += int(tx['value'])
+    return delta
+
+
+def token_balance_delta(tx, wallet):
+    """Изменение баланса токена кошелька от перевода, в минимальных единицах"""
+    value = int(tx['value'], 16) if tx['value'].startswith('0x') else int(tx['value'])
+    delta = 0
+    if tx['from'].lower() == wallet:
+        delta -= value
+    if tx['to'].lower() == wallet:
+        delta += value
+    return delta
+
+
+# Остальные token в истории это переводы ERC-20 токенов
+BALANCE_DELTAS = {
+    'eth': eth_balance_delta
+}
+
+# Из каких потоков локальной истории складывается баланс token
+BALANCE_SOURCES = {
+    'eth': ETH_SOURCES
+}
+
+
+def update_balance_index(db, wallet, token, sync_tokens=None):
+    """Дописывает в индекс балансы после новых блоков из локальной истории.
+
+    Индекс строится только по полной истории, загруженной с блока 0:
+    иначе накопленный баланс начинался бы не с нуля. Потоки баланса
+    сливаются по блокам и учитываются до последнего блока, загруженного
+    во всех них. sync_tokens задают диапазоны синхронизации, если они
+    хранятся не под теми же token, что и сами транзакции.
+
+    История читается отрезками по INDEX_CHUNK_BLOCKS блоков: отрезок целиком
+    загружается в память до записи. Запись при открытом курсоре упала бы,
+    если за время чтения другой поток успел сохранить свои данные.
+    """
+    sources = BALANCE_SOURCES.get(token, (token,))
+    states = [db.get_sync_state(wallet, sync_token) for sync_token in sync_tokens or sources]
+    if not all(states) or any(state[0] != 0 for state in states):
+        return
+    synced_block = min(state[1] for state in states)
+    delta_fn = BALANCE_DELTAS.get(token, token_balance_delta)
+
+    wallet = wallet.lower()
+    last = db.get_last_indexed_balance(wallet, token)
+    last_block, balance = last if last else (-1, 0)
+
+    while last_block < synced_block:
+        # Пустые диапазоны пропускаем сразу до следующего блока с транзакциями
+        next_blocks = [
+            block for block in (db.get_next_block(wallet, source, last_block) for source in sources)
+            if block is not None
+        ]
+        if not next_blocks:
+            return
+        chunk_end = min(min(next_blocks) + INDEX_CHUNK_BLOCKS - 1, synced_block)
+
+        rows = []
+        checkpoints = {}
+        timeline = merge_by_block(
+            (source, db.get_transactions_in_blocks(wallet, source, last_block, chunk_end)) for source in sources
+        )
+        for kind, tx in timeline:
+            block_number = int(tx['blockNumber'])
+            timestamp = int(tx['timeStamp'])
+            balance += delta_fn(as_eth_transfer(kind, tx), wallet)
+            if rows and rows[-1][0] == block_number:
+                rows[-1] = (block_number, timestamp, balance)
+            else:
+                rows.append((block_number, timestamp, balance))
+            checkpoints[timestamp // SECONDS_PER_DAY] = balance
+
+        if rows:
+            db.save_balance_index(wallet, token, rows, checkpoints)
+        last_block = chunk_end
+
+
+def get_indexed_balance(db, wallet, token, timestamp):
+    """Баланс кошелька на момент времени по индексу, в минимальных единицах.
+
+    Запрос на конец дня UTC отвечается по дневным точкам, остальные по
+    балансам после блоков. Оба поиска идут по индексу SQLite.
+    """
+    if (timestamp + 1) % SECONDS_PER_DAY == 0:
+        balance = db.get_balance_at_day(wallet, token, timestamp // SECONDS_PER_DAY)
+    else:
+        balance = db.get_balance_at(wallet, token, timestamp)
+    return balance or 0
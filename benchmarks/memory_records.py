@@ -0,0 +1,76 @@
+"""Сравнение памяти на строки отчета: словари против кортежей из records.py.
+
+Запуск из корня репозитория:
+    python benchmarks/memory_records.py [число строк]
+"""
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import EthReportRow, TokenReportRow, ETH_REPORT_FIELDS, TOKEN_REPORT_FIELDS
+
+WALLET = '0x' + 'ab' * 20
+CONTRACT = '0xdac17f958d2ee523a2206206994597c13d831ec7'
+
+
+def synthetic_values(i):
+    """Значения строки, похожие на настоящие: уникальные хэши и адреса"""
+    counterparty = f"0x{i:040x}"
+    return (
+        '01/01/2024', WALLET, counterparty, f"0x{i:064x}",
+        0, i / 7, i / 1e6, i / 1e3, i / 11, -i / 7, -i / 3
+    )
+
+
+def eth_dict(i):
+    return dict(zip(ETH_REPORT_FIELDS, synthetic_values(i)))
+
+
+def eth_record(i):
+    return EthReportRow(*synthetic_values(i))
+
+
+def usdt_values(i):
+    return (
+        str(18000000 + i), 1700000000 + i, '01/01/2024', WALLET, f"0x{i:040x}",
+        f"0x{i:064x}", i / 100, CONTRACT, 'Tether USD', 'USDT'
+    )
+
+
+def usdt_dict(i):
+    return dict(zip(TOKEN_REPORT_FIELDS, usdt_values(i)))
+
+
+def usdt_record(i):
+    return TokenReportRow(*usdt_values(i))
+
+
+def measure(build, count):
+    """Память, занятая материализованным списком строк, в байтах на строку"""
+    tracemalloc.start()
+    rows = [build(i) for i in range(count)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del rows
+    return current / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    print(f"Строк: {count}")
+    for name, as_dict, as_record in (
+        ('ETH', eth_dict, eth_record),
+        ('USDT', usdt_dict, usdt_record)
+    ):
+        dict_bytes = measure(as_dict, count)
+        record_bytes = measure(as_record, count)
+        print(
+            f"{name}: dict {dict_bytes:.0f} Б/строка, record {record_bytes:.0f} Б/строка, "
+            f"экономия {1 - record_bytes / dict_bytes:.0%}"
+        )
+
+
+if __name__ == '__main__':
+    main()
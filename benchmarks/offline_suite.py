@@ -0,0 +1,396 @@
+"""Офлайн замеры бота: поддельные Etherscan, CoinGecko и Telegram на localhost.
+
+Локальный сервер генерирует синтетические txlist, txlistinternal и tokentx
+для кошелька нужного размера: число транзакций зашито в сам адрес, поэтому
+данные не хранятся, а любая страница считается за O(размер страницы).
+Бот работает как обычно, только адреса API подменены на локальный сервер,
+а база лежит во временном каталоге.
+
+Замеряются process_transactions, process_usdt_transactions, сборка CSV,
+get_wallet_stats, get_wallet_balances_at_date и process_eth_request целиком.
+Результаты выводятся JSON; с --baseline сравниваются с прошлым запуском,
+и процесс завершается с кодом 1, если что-то замедлилось больше допуска.
+
+Запуск из корня репозитория:
+    python benchmarks/offline_suite.py [--sizes 1000,10000,100000] [--output results.json]
+                                       [--baseline old.json] [--tolerance 1.25]
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+USDT_CONTRACT = '0xdac17f958d2ee523a2206206994597c13d831ec7'
+COUNTERPARTY = '0x' + 'c0' * 20
+# Синтетическая цепочка: блок каждые 12 секунд начиная с FIRST_BLOCK
+FIRST_BLOCK = 10_000_000
+FIRST_TIMESTAMP = 1_600_000_000
+BLOCK_TIME = 12
+# Две транзакции в блоке, чтобы страницы Etherscan резали блоки
+TXS_PER_BLOCK = 2
+MAX_WINDOW = 10000
+ETH_PRICE = 2000.0
+
+
+def wallet_for_size(size):
+    """Адрес синтетического кошелька с size транзакциями"""
+    return f"0x{size:040x}"
+
+
+def size_of_wallet(address):
+    return int(address, 16)
+
+
+def block_timestamp(block):
+    return FIRST_TIMESTAMP + (block - FIRST_BLOCK) * BLOCK_TIME
+
+
+def make_tx(action, wallet, i):
+    """i-я синтетическая транзакция кошелька в потоке action"""
+    block = FIRST_BLOCK + i // TXS_PER_BLOCK
+    outgoing = i % 2 == 1
+    tx = {
+        'blockNumber': str(block),
+        'timeStamp': str(block_timestamp(block)),
+        'hash': f"0x{action[:2].encode().hex()}{i:060x}",
+        'from': wallet if outgoing else COUNTERPARTY,
+        'to': COUNTERPARTY if outgoing else wallet,
+        'value': str((i % 97 + 1) * 10**16),
+        'gasPrice': str(20 * 10**9 + i % 1000),
+        'gasUsed': '21000',
+        'isError': '1' if i % 113 == 0 else '0',
+        'input': '0x'
+    }
+    if action == 'tokentx':
+        tx.update(
+            value=str((i % 1000 + 1) * 10**6),
+            contractAddress=USDT_CONTRACT,
+            tokenName='Tether USD',
+            tokenSymbol='USDT',
+            tokenDecimal='6'
+        )
+    return tx
+
+
+def stream_size(action, size):
+    # Внутренних транзакций у кошелька обычно заметно меньше обычных
+    return size // 10 if action == 'txlistinternal' else size
+
+
+def synthetic_txs(action, wallet, size):
+    return [make_tx(action, wallet, i) for i in range(stream_size(action, size))]
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class FakeUpstreams:
+    """Один локальный сервер за Etherscan (/api), CoinGecko (/api/v3) и Telegram (/bot...)"""
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.httpd = _HTTPServer(('127.0.0.1', 0), self._make_handler())
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def reset_calls(self):
+        with self.lock:
+            calls = self.calls
+            self.calls = {}
+        return calls
+
+    def etherscan(self, params):
+        action = params.get('action')
+        self.count(f"etherscan.{action}")
+        if action in ('txlist', 'txlistinternal', 'tokentx'):
+            return self._account_txs(action, params)
+        if action == 'balance':
+            return {'status': '1', 'message': 'OK', 'result': str(size_of_wallet(params['address']) * 10**15)}
+        if action == 'balancemulti':
+            return {'status': '1', 'message': 'OK', 'result': [
+                {'account': address, 'balance': str(size_of_wallet(address) * 10**15)}
+                for address in params['address'].split(',')
+            ]}
+        if action == 'tokenbalance':
+            return {'status': '1', 'message': 'OK', 'result': str(size_of_wallet(params['address']) * 10**6)}
+        if action == 'getblocknobytime':
+            offset = int(params['timestamp']) - FIRST_TIMESTAMP
+            blocks = offset // BLOCK_TIME if params.get('closest') == 'before' else -(-offset // BLOCK_TIME)
+            return {'status': '1', 'message': 'OK', 'result': str(max(FIRST_BLOCK, FIRST_BLOCK + blocks))}
+        return {'status': '0', 'message': 'NOTOK', 'result': f"Unknown action {action}"}
+
+    def _account_txs(self, action, params):
+        page = int(params.get('page', 1))
+        offset = int(params.get('offset', 1000))
+        if page * offset > MAX_WINDOW:
+            return {'status': '0', 'message': 'NOTOK', 'result': 'Result window is too large'}
+        wallet = params['address'].lower()
+        total = stream_size(action, size_of_wallet(wallet))
+        # Индексы транзакций в диапазоне блоков считаются арифметически
+        start_block = max(int(params.get('startblock', 0)), FIRST_BLOCK)
+        end_block = int(params.get('endblock', 99999999))
+        first = (start_block - FIRST_BLOCK) * TXS_PER_BLOCK
+        last = min(total, (end_block - FIRST_BLOCK + 1) * TXS_PER_BLOCK)
+        begin = first + (page - 1) * offset
+        result = [make_tx(action, wallet, i) for i in range(begin, min(last, begin + offset))]
+        if not result:
+            return {'status': '0', 'message': 'No transactions found', 'result': []}
+        return {'status': '1', 'message': 'OK', 'result': result}
+
+    def coingecko(self, path, params):
+        self.count(f"coingecko.{path.rsplit('/', 1)[-1]}")
+        if path.endswith('/simple/price'):
+            return {coin: {'usd': ETH_PRICE} for coin in params['ids'].split(',')}
+        start = int(params['from'])
+        end = int(params['to'])
+        return {'prices': [[day * 1000, ETH_PRICE] for day in range(start - start % 86400, end, 86400)]}
+
+    def telegram(self, method, params):
+        self.count(f"telegram.{method}")
+        message = {
+            'message_id': 1,
+            'date': int(time.time()),
+            'chat': {'id': int(params.get('chat_id', 1) or 1), 'type': 'private'}
+        }
+        if method == 'sendDocument':
+            message['document'] = {'file_id': f"file{time.monotonic_ns()}", 'file_unique_id': 'bench'}
+        elif method in ('sendMessage', 'editMessageText'):
+            message['text'] = params.get('text', '')
+        elif method == 'getMe':
+            message = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        return {'ok': True, 'result': message}
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                self._handle()
+
+            def _handle(self):
+                url = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length) if length else b''
+                content_type = self.headers.get('Content-Type', '')
+                if content_type.startswith('application/json'):
+                    params.update(json.loads(body))
+                elif content_type.startswith('application/x-www-form-urlencoded'):
+                    params.update({key: values[0] for key, values in parse_qs(body.decode()).items()})
+
+                if url.path == '/api':
+                    data = fake.etherscan(params)
+                elif url.path.startswith('/api/v3/'):
+                    data = fake.coingecko(url.path, params)
+                elif url.path.startswith('/bot'):
+                    data = fake.telegram(url.path.rsplit('/', 1)[-1], params)
+                else:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                payload = json.dumps(data).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def shutdown(self):
+        self.httpd.shutdown()
+
+
+def load_bot(fake):
+    """Импортирует бота с базой во временном каталоге и API на локальном сервере"""
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    os.chdir(workdir)
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:BENCHMARK')
+    os.environ.setdefault('ETHERSCAN_API_KEY', 'benchmark')
+    os.environ.setdefault('ADMIN_ID', '1')
+    # Замеряем бота, а не ограничитель частоты запросов
+    os.environ.setdefault('ETHERSCAN_RATE_LIMIT', '100000')
+
+    import etherscan_api
+    import prices
+    from telebot import apihelper
+
+    etherscan_api.API_URL = fake.url + '/api'
+    prices.COINGECKO_PRICE_URL = fake.url + '/api/v3/simple/price'
+    prices.COINGECKO_RANGE_URL = fake.url + '/api/v3/coins/{coin_id}/market_chart/range'
+    apihelper.API_URL = fake.url + '/bot{0}/{1}'
+
+    import main
+    return main
+
+
+def measure(name, size, func, fake, repeat=1):
+    """Лучшее время из repeat запусков и запросы к поддельным API за первый"""
+    fake.reset_calls()
+    best = None
+    calls = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+        if calls is None:
+            calls = fake.reset_calls()
+    result = {
+        'name': name,
+        'size': size,
+        'seconds': round(best, 6),
+        'per_second': round(size / best, 1) if best else None,
+        'upstream_calls': calls
+    }
+    print(f"{name:<32} {size:>9} {best:>10.3f} с", file=sys.stderr)
+    return result
+
+
+def run_size(main, fake, size):
+    from handlers.command_handlers import get_wallet_balances_at_date, get_wallet_stats
+    from usdt_handler import process_usdt_transactions
+
+    wallet = wallet_for_size(size)
+    eth_txs = synthetic_txs('txlist', wallet, size)
+    token_txs = synthetic_txs('tokentx', wallet, size)
+    repeat = 3 if size <= 100000 else 1
+    results = []
+
+    results.append(measure(
+        'process_transactions', size,
+        lambda: sum(1 for _ in main.process_transactions(eth_txs, wallet, ETH_PRICE)), fake, repeat
+    ))
+    results.append(measure(
+        'process_usdt_transactions', size,
+        lambda: sum(1 for _ in process_usdt_transactions(token_txs, wallet)), fake, repeat
+    ))
+    rows = list(main.process_transactions(eth_txs, wallet, ETH_PRICE))
+    results.append(measure(
+        'build_eth_report_csv', len(rows),
+        lambda: main.build_eth_report(rows, 'csv').close(), fake, repeat
+    ))
+    del rows, eth_txs, token_txs
+
+    # Первый отчет синхронизирует историю с поддельным Etherscan, второй берется из кэша
+    results.append(measure(
+        'process_eth_request_cold', size,
+        lambda: main.process_eth_request(1, wallet, None, None, 'за все время', 1, 'csv'), fake
+    ))
+    results.append(measure(
+        'process_eth_request_cached', size,
+        lambda: main.process_eth_request(1, wallet, None, None, 'за все время', 1, 'csv'), fake
+    ))
+    results.append(measure(
+        'get_wallet_stats', size,
+        lambda: get_wallet_stats(main.eth_client, main.db, wallet), fake
+    ))
+    last_block = FIRST_BLOCK + (size - 1) // TXS_PER_BLOCK
+    target_date = datetime.fromtimestamp(block_timestamp((FIRST_BLOCK + last_block) // 2))
+    results.append(measure(
+        'get_wallet_balances_at_date', size,
+        lambda: get_wallet_balances_at_date(main.eth_client, main.db, wallet, target_date), fake
+    ))
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Сравнивает с прошлым запуском; возвращает список замедлившихся замеров"""
+    previous = {(item['name'], item['size']): item['seconds'] for item in baseline['results']}
+    regressions = []
+    for item in results:
+        before = previous.get((item['name'], item['size']))
+        if not before:
+            continue
+        item['baseline_seconds'] = before
+        item['ratio'] = round(item['seconds'] / before, 3)
+        if item['ratio'] > tolerance:
+            regressions.append(item)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Офлайн замеры производительности бота')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='размеры кошельков через запятую, до 1000000')
+    parser.add_argument('--output', help='файл для JSON с результатами, по умолчанию stdout')
+    parser.add_argument('--baseline', help='JSON прошлого запуска для сравнения')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='допустимое замедление относительно baseline')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(os.path.abspath(args.baseline)) as file:
+            baseline = json.load(file)
+    output = os.path.abspath(args.output) if args.output else None
+
+    fake = FakeUpstreams()
+    # Сам бот пишет в stdout, а там должен остаться только JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        bot_main = load_bot(fake)
+        results = []
+        for size in (int(size) for size in args.sizes.split(',')):
+            results.extend(run_size(bot_main, fake, size))
+        fake.shutdown()
+        bot_main.db.close()
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'results': results
+    }
+    regressions = compare(results, baseline, args.tolerance) if baseline else []
+    report['regressions'] = [f"{item['name']}@{item['size']}" for item in regressions]
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, 'w') as file:
+            file.write(text)
+    else:
+        print(text)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
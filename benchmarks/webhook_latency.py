@@ -0,0 +1,246 @@
+"""Задержка от обновления до первого ответа бота: polling против webhook.
+
+Бот работает с локальным поддельным сервером Telegram Bot API. В режиме
+polling сервер отдает обновления через getUpdates, в режиме webhook сам
+отправляет их POST запросами на встроенный сервер бота. Обработчик имитирует
+работу, ожидая delay секунд, и отвечает sendMessage.
+
+Запуск из корня репозитория:
+    python benchmarks/webhook_latency.py [пользователей] [сообщений на пользователя] [delay] [потоков обработки]
+"""
+import json
+import os
+import queue
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+import telebot
+from telebot import apihelper
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from webhook import WebhookServer
+
+TOKEN = '123456:BENCHMARK'
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class FakeTelegram:
+    """Поддельный Bot API: getUpdates с long polling, доставка на webhook, учет ответов"""
+
+    def __init__(self):
+        self.updates = queue.Queue()
+        self.sent_at = {}
+        self.replied_at = {}
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.expected = 0
+        self.next_update_id = 1
+        self.httpd = _HTTPServer(('127.0.0.1', 0), self._make_handler())
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def make_update(self, chat_id, text):
+        with self.lock:
+            update_id = self.next_update_id
+            self.next_update_id += 1
+        return {
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': {'id': chat_id, 'is_bot': False, 'first_name': 'user'},
+                'text': text
+            }
+        }
+
+    def mark_sent(self, text):
+        with self.lock:
+            self.sent_at[text] = time.perf_counter()
+
+    def _reply(self, chat_id, text):
+        with self.lock:
+            if text not in self.replied_at:
+                self.replied_at[text] = time.perf_counter()
+            if len(self.replied_at) >= self.expected:
+                self.done.set()
+        return {
+            'message_id': 1,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': text
+        }
+
+    def _get_updates(self, params):
+        timeout = float(params.get('timeout', 0))
+        updates = []
+        try:
+            updates.append(self.updates.get(timeout=timeout))
+            while True:
+                updates.append(self.updates.get_nowait())
+        except queue.Empty:
+            pass
+        return updates
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                self._handle()
+
+            def _handle(self):
+                url = urlparse(self.path)
+                method = url.path.rsplit('/', 1)[-1]
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                length = int(self.headers.get('Content-Length', 0))
+                if length:
+                    body = self.rfile.read(length).decode()
+                    if self.headers.get('Content-Type', '').startswith('application/json'):
+                        params.update(json.loads(body))
+                    else:
+                        params.update({key: values[0] for key, values in parse_qs(body).items()})
+
+                if method == 'getUpdates':
+                    result = fake._get_updates(params)
+                elif method == 'sendMessage':
+                    result = fake._reply(int(params['chat_id']), params['text'])
+                elif method == 'getMe':
+                    result = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+                else:
+                    result = True
+
+                data = json.dumps({'ok': True, 'result': result}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def shutdown(self):
+        self.httpd.shutdown()
+
+
+def make_bot(delay, threaded, num_threads=2):
+    bot = telebot.TeleBot(TOKEN, threaded=threaded, num_threads=num_threads)
+
+    @bot.message_handler(func=lambda message: True)
+    def echo(message):
+        # Имитация запроса к базе или Etherscan перед ответом
+        time.sleep(delay)
+        bot.send_message(message.chat.id, message.text)
+
+    return bot
+
+
+def send_bursts(fake, users, messages, deliver):
+    """Каждый пользователь одновременно с остальными шлет messages сообщений"""
+    def user(chat_id):
+        for i in range(messages):
+            text = f"{chat_id}:{i}"
+            fake.mark_sent(text)
+            deliver(fake.make_update(chat_id, text))
+
+    threads = [threading.Thread(target=user, args=(chat_id,)) for chat_id in range(1, users + 1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def summarize(mode, fake):
+    latencies = sorted(
+        (fake.replied_at[text] - fake.sent_at[text]) * 1000
+        for text in fake.replied_at
+    )
+    return {
+        'mode': mode,
+        'updates': len(latencies),
+        'p50_ms': round(statistics.median(latencies), 1),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1], 1),
+        'max_ms': round(latencies[-1], 1)
+    }
+
+
+def run_polling(users, messages, delay, workers):
+    fake = FakeTelegram()
+    fake.expected = users * messages
+    apihelper.API_URL = fake.url + '/bot{0}/{1}'
+    # Столько же потоков обработки, сколько у webhook: сравниваем доставку, а не параллельность
+    bot = make_bot(delay, threaded=True, num_threads=workers)
+    thread = threading.Thread(
+        target=bot.infinity_polling,
+        kwargs={'timeout': 10, 'long_polling_timeout': 1},
+        daemon=True
+    )
+    thread.start()
+    time.sleep(0.5)
+
+    send_bursts(fake, users, messages, fake.updates.put)
+    fake.done.wait(120)
+    bot.stop_polling()
+    fake.shutdown()
+    return summarize(f'polling ({workers} threads)', fake)
+
+
+def run_webhook(users, messages, delay, workers):
+    fake = FakeTelegram()
+    fake.expected = users * messages
+    apihelper.API_URL = fake.url + '/bot{0}/{1}'
+    bot = make_bot(delay, threaded=False)
+    server = WebhookServer(bot, '127.0.0.1', 0, '/webhook', workers=workers)
+    server.start()
+    webhook_url = f"http://127.0.0.1:{server.port}/webhook"
+
+    def deliver(update):
+        # Как и Telegram, повторяем доставку, пока сервер отвечает ошибкой
+        while True:
+            try:
+                if requests.post(webhook_url, json=update).status_code == 200:
+                    return
+            except requests.ConnectionError:
+                pass
+            time.sleep(0.05)
+
+    send_bursts(fake, users, messages, deliver)
+    fake.done.wait(120)
+    server.shutdown()
+    fake.shutdown()
+    return summarize(f'webhook ({workers} workers)', fake)
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    delay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+    workers = int(sys.argv[4]) if len(sys.argv) > 4 else 8
+    results = [
+        run_polling(users, messages, delay, workers),
+        run_webhook(users, messages, delay, workers)
+    ]
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,50 @@
 import sqlite3
+import json
+import threading
+import time
 from datetime import datetime
+from metrics import metrics
+
+SAVE_BATCH_SIZE = 1000
+# Как часто изменения пользователей из кэша пишутся в базу, в секундах
+USER_FLUSH_INTERVAL = 1.0
 
 class Database:
-    def __init__(self):
+    def __init__(self, path='database.db', flush_interval=USER_FLUSH_INTERVAL):
         """Инициализация подключения к базе данных"""
-        self.conn = sqlite3.connect('database.db', check_same_thread=False)
+        self.path = path
+        self.flush_interval = flush_interval
+        # У каждого потока свое соединение: чтения не ждут друг друга
+        self.local = threading.local()
+        self.connections = []
+        self.connections_lock = threading.Lock()
+        # Записи в SQLite все равно идут по одной, блокировка избавляет от ожидания SQLITE_BUSY
+        self.lock = threading.RLock()
+        # Кэш пользователей: chat_id -> строка таблицы users или None, если ее нет
+        self.users = {}
+        self.dirty_users = set()
+        self.users_lock = threading.Lock()
+        self.closed = threading.Event()
         self.create_tables()
+        self.user_columns = [row[1] for row in self.conn.execute('PRAGMA table_info(users)')]
+        self.flusher = threading.Thread(target=self._flush_loop, name='users-flush', daemon=True)
+        self.flusher.start()
+
+    @property
+    def conn(self):
+        """Соединение текущего потока"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            # Ленивый курсор с историей может дочитываться уже в другом потоке
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            # WAL не блокирует чтения во время записи, а с synchronous=NORMAL
+            # fsync идет только при checkpoint, а не на каждый commit
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+            with self.connections_lock:
+                self.connections.append(conn)
+        return conn
         
     def create_tables(self):
         """Создает необходимые таблицы в базе данных"""
@@ -17,56 +56,578 @@ class Database:
                 state TEXT
             )
         ''')
+        self._add_column('users', 'report_format', 'TEXT')
+        # Время последнего действия пользователя: по нему выбираются кошельки для прогрева
+        self._add_column('users', 'last_used', 'INTEGER')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_wallets (
+                chat_id INTEGER NOT NULL,
+                wallet TEXT NOT NULL,
+                added_at INTEGER NOT NULL,
+                PRIMARY KEY (chat_id, wallet)
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS transactions (
+                wallet TEXT NOT NULL,
+                token TEXT NOT NULL,
+                block_number INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                timestamp INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (wallet, token, block_number, position)
+            )
+        ''')
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_transactions_time
+            ON transactions (wallet, token, timestamp)
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS sync_state (
+                wallet TEXT NOT NULL,
+                token TEXT NOT NULL,
+                first_block INTEGER NOT NULL,
+                last_block INTEGER NOT NULL,
+                PRIMARY KEY (wallet, token)
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS daily_prices (
+                coin_id TEXT NOT NULL,
+                day INTEGER NOT NULL,
+                price REAL NOT NULL,
+                PRIMARY KEY (coin_id, day)
+            )
+        ''')
+        # Баланс храним строкой: в wei он не помещается в INTEGER SQLite
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS balance_index (
+                wallet TEXT NOT NULL,
+                token TEXT NOT NULL,
+                block_number INTEGER NOT NULL,
+                timestamp INTEGER NOT NULL,
+                balance TEXT NOT NULL,
+                PRIMARY KEY (wallet, token, block_number)
+            )
+        ''')
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_balance_index_time
+            ON balance_index (wallet, token, timestamp)
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS balance_checkpoints (
+                wallet TEXT NOT NULL,
+                token TEXT NOT NULL,
+                day INTEGER NOT NULL,
+                balance TEXT NOT NULL,
+                PRIMARY KEY (wallet, token, day)
+            )
+        ''')
+        # Метаданные ERC-20 токенов из полей самих переводов
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS token_metadata (
+                contract TEXT PRIMARY KEY,
+                symbol TEXT NOT NULL,
+                name TEXT NOT NULL,
+                decimals INTEGER NOT NULL
+            )
+        ''')
+        # Уже отправленные в Telegram отчеты: file_id и итоги для подписи
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS report_cache (
+                cache_key TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                totals TEXT NOT NULL,
+                created_at INTEGER NOT NULL
+            )
+        ''')
+        # Кошельки, о новых переводах которых бот сообщает подписчикам
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                chat_id INTEGER NOT NULL,
+                wallet TEXT NOT NULL,
+                created_at INTEGER NOT NULL,
+                PRIMARY KEY (chat_id, wallet)
+            )
+        ''')
+        # Последний блок, просмотренный опросом подписок
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS watch_state (
+                name TEXT PRIMARY KEY,
+                block_number INTEGER NOT NULL
+            )
+        ''')
+        # До версии 1 индекс ETH балансов строился без внутренних транзакций
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] < 1:
+            self.conn.execute("DELETE FROM balance_index WHERE token = 'eth'")
+            self.conn.execute("DELETE FROM balance_checkpoints WHERE token = 'eth'")
+            self.conn.execute('PRAGMA user_version = 1')
         self.conn.commit()
         
+    def _add_column(self, table: str, column: str, definition: str):
+        """Добавляет столбец в уже существующую таблицу старой базы"""
+        columns = [row[1] for row in self.conn.execute(f'PRAGMA table_info({table})')]
+        if column not in columns:
+            self.conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+    def get_user(self, chat_id: int) -> dict:
+        """Строка пользователя одним запросом: {wallet, token_type, state, ...} или None"""
+        with self.users_lock:
+            if chat_id in self.users:
+                user = self.users[chat_id]
+                metrics.inc('cache_requests_total', cache='users', result='hit')
+                return dict(user) if user else None
+
+        metrics.inc('cache_requests_total', cache='users', result='miss')
+        cursor = self.conn.cursor()
+        with metrics.timer('db_query_seconds', function='get_user'):
+            cursor.execute('SELECT * FROM users WHERE chat_id = ?', (chat_id,))
+        row = cursor.fetchone()
+        user = dict(zip([column[0] for column in cursor.description], row)) if row else None
+        with self.users_lock:
+            # Пока шел запрос, пользователя могли изменить: кэш важнее
+            user = self.users.setdefault(chat_id, user)
+            return dict(user) if user else None
+
+    def _update_user(self, chat_id: int, **values):
+        """Меняет поля существующего пользователя в кэше, в базу они попадут при сбросе"""
+        self.get_user(chat_id)
+        with self.users_lock:
+            user = self.users.get(chat_id)
+            if user is None:
+                return
+            user.update(values, last_used=int(time.time()))
+            self.dirty_users.add(chat_id)
+
     def update_user_wallet(self, chat_id: int, wallet: str):
         """Сохраняет адрес кошелька пользователя"""
         wallet = wallet.strip().lower()  # Нормализация адреса
-        self.conn.execute('''
-            INSERT OR REPLACE INTO users (chat_id, wallet)
-            VALUES (?, ?)
-        ''', (chat_id, wallet))
-        self.conn.commit()
+        # Новый кошелек начинает выбор заново, как прежний INSERT OR REPLACE
+        user = {column: None for column in self.user_columns}
+        user.update(chat_id=chat_id, wallet=wallet, last_used=int(time.time()))
+        with self.users_lock:
+            self.users[chat_id] = user
+            self.dirty_users.add(chat_id)
         
     def get_user_wallet(self, chat_id: int) -> str:
         """Получает сохраненный адрес кошелька"""
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT wallet FROM users WHERE chat_id = ?', (chat_id,))
-        result = cursor.fetchone()
-        return result[0] if result else None 
+        user = self.get_user(chat_id)
+        return user['wallet'] if user else None
         
     def update_user_token(self, chat_id: int, token: str):
         """Сохраняет выбранный тип токена"""
-        self.conn.execute('''
-            UPDATE users 
-            SET token_type = ?
-            WHERE chat_id = ?
-        ''', (token, chat_id))
-        self.conn.commit()
+        self._update_user(chat_id, token_type=token)
         
     def get_user_token(self, chat_id: int) -> str:
         """Получает сохраненный тип токена"""
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT token_type FROM users WHERE chat_id = ?', (chat_id,))
-        result = cursor.fetchone()
-        return result[0] if result else None
+        user = self.get_user(chat_id)
+        return user['token_type'] if user else None
         
     def update_user_state(self, chat_id: int, state: str):
         """Сохраняет состояние пользователя"""
-        self.conn.execute('''
-            UPDATE users 
-            SET state = ?
-            WHERE chat_id = ?
-        ''', (state, chat_id))
-        self.conn.commit()
+        self._update_user(chat_id, state=state)
         
     def get_user_state(self, chat_id: int) -> str:
         """Получает состояние пользователя"""
+        user = self.get_user(chat_id)
+        return user['state'] if user else None
+
+    def update_user_format(self, chat_id: int, report_format: str):
+        """Сохраняет формат файла отчета"""
+        self._update_user(chat_id, report_format=report_format)
+        
+    def get_user_format(self, chat_id: int) -> str:
+        """Получает сохраненный формат файла отчета"""
+        user = self.get_user(chat_id)
+        return user['report_format'] if user else None
+
+    @metrics.timed('db_query_seconds')
+    def flush_users(self):
+        """Пишет измененных пользователей в базу одной транзакцией"""
+        with self.users_lock:
+            dirty = self.dirty_users
+            self.dirty_users = set()
+            rows = [[self.users[chat_id].get(column) for column in self.user_columns] for chat_id in dirty]
+        if not rows:
+            return
+
+        columns = ', '.join(self.user_columns)
+        placeholders = ', '.join('?' * len(self.user_columns))
+        try:
+            with self.lock:
+                self.conn.executemany(f'INSERT OR REPLACE INTO users ({columns}) VALUES ({placeholders})', rows)
+                self.conn.commit()
+        except Exception:
+            # Не теряем изменения: попробуем при следующем сбросе
+            with self.users_lock:
+                self.dirty_users |= dirty
+            raise
+
+    def _flush_loop(self):
+        while not self.closed.wait(self.flush_interval):
+            try:
+                self.flush_users()
+            except Exception as e:
+                print(f"Ошибка при сохранении пользователей: {str(e)}")
+
+    @metrics.timed('db_query_seconds')
+    def add_user_wallet(self, chat_id: int, wallet: str) -> bool:
+        """Добавляет кошелек в портфель пользователя; False, если он там уже есть"""
+        with self.lock:
+            cursor = self.conn.execute(
+                'INSERT OR IGNORE INTO user_wallets (chat_id, wallet, added_at) VALUES (?, ?, ?)',
+                (chat_id, wallet.strip().lower(), int(time.time()))
+            )
+            self.conn.commit()
+            return cursor.rowcount > 0
+
+    @metrics.timed('db_query_seconds')
+    def remove_user_wallet(self, chat_id: int, wallet: str) -> bool:
+        """Убирает кошелек из портфеля пользователя; False, если его там не было"""
+        with self.lock:
+            cursor = self.conn.execute(
+                'DELETE FROM user_wallets WHERE chat_id = ? AND wallet = ?',
+                (chat_id, wallet.strip().lower())
+            )
+            self.conn.commit()
+            return cursor.rowcount > 0
+
+    @metrics.timed('db_query_seconds')
+    def get_user_wallets(self, chat_id: int) -> list:
+        """Кошельки портфеля пользователя в порядке добавления"""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            'SELECT wallet FROM user_wallets WHERE chat_id = ? ORDER BY added_at, wallet',
+            (chat_id,)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    @metrics.timed('db_query_seconds')
+    def add_subscription(self, chat_id: int, wallet: str) -> bool:
+        """Подписывает чат на переводы кошелька; False, если подписка уже есть"""
+        with self.lock:
+            cursor = self.conn.execute(
+                'INSERT OR IGNORE INTO subscriptions (chat_id, wallet, created_at) VALUES (?, ?, ?)',
+                (chat_id, wallet.strip().lower(), int(time.time()))
+            )
+            self.conn.commit()
+            return cursor.rowcount > 0
+
+    @metrics.timed('db_query_seconds')
+    def remove_subscription(self, chat_id: int, wallet: str) -> bool:
+        """Отписывает чат от кошелька; False, если подписки не было"""
+        with self.lock:
+            cursor = self.conn.execute(
+                'DELETE FROM subscriptions WHERE chat_id = ? AND wallet = ?',
+                (chat_id, wallet.strip().lower())
+            )
+            self.conn.commit()
+            return cursor.rowcount > 0
+
+    @metrics.timed('db_query_seconds')
+    def get_chat_subscriptions(self, chat_id: int) -> list:
+        """Кошельки, на которые подписан чат, в порядке подписки"""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            'SELECT wallet FROM subscriptions WHERE chat_id = ? ORDER BY created_at, wallet',
+            (chat_id,)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    @metrics.timed('db_query_seconds')
+    def get_subscriptions(self) -> dict:
+        """Все подписки: {кошелек: [chat_id, ...]}"""
+        subscriptions = {}
+        for chat_id, wallet in self.conn.execute('SELECT chat_id, wallet FROM subscriptions ORDER BY wallet, chat_id'):
+            subscriptions.setdefault(wallet, []).append(chat_id)
+        return subscriptions
+
+    @metrics.timed('db_query_seconds')
+    def get_watch_block(self, name: str = 'subscriptions'):
+        """Последний просмотренный опросом блок или None, если опрос еще не запускался"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT block_number FROM watch_state WHERE name = ?', (name,))
+        result = cursor.fetchone()
+        return result[0] if result else None
+
+    @metrics.timed('db_query_seconds')
+    def save_watch_block(self, block_number: int, name: str = 'subscriptions'):
+        """Запоминает последний просмотренный опросом блок"""
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO watch_state (name, block_number) VALUES (?, ?)',
+                (name, block_number)
+            )
+            self.conn.commit()
+
+    @metrics.timed('db_query_seconds')
+    def get_recent_wallets(self, limit: int) -> list:
+        """Кошельки пользователей, начиная с недавно активных"""
+        self.flush_users()
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT wallet FROM users
+            WHERE wallet IS NOT NULL
+            GROUP BY wallet
+            ORDER BY MAX(last_used) IS NULL, MAX(last_used) DESC
+            LIMIT ?
+        ''', (limit,))
+        return [row[0] for row in cursor.fetchall()]
+
+    @metrics.timed('db_query_seconds')
+    def get_sync_state(self, wallet: str, token: str):
+        """Возвращает диапазон загруженных блоков (first_block, last_block)"""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            'SELECT first_block, last_block FROM sync_state WHERE wallet = ? AND token = ?',
+            (wallet.lower(), token)
+        )
+        return cursor.fetchone()
+
+    def save_transactions(self, wallet: str, token: str, transactions, first_block: int, last_block: int = None,
+                          partition=None):
+        """Потоково сохраняет транзакции кошелька и расширяет диапазон синхронизации.
+
+        Если last_block не задан, диапазон заканчивается на блоке последней транзакции.
+        partition(tx) раскладывает общую выборку по своим token, диапазон
+        синхронизации при этом один, под token.
+        """
+        wallet = wallet.lower()
+        last = {'block': None, 'positions': {}}
+
+        def rows():
+            for tx in transactions:
+                block_number = int(tx['blockNumber'])
+                if block_number != last['block']:
+                    last['block'] = block_number
+                    last['positions'] = {}
+                row_token = partition(tx) if partition else token
+                # Позиции считаются внутри своего token, как при отдельной выборке
+                position = last['positions'].get(row_token, 0)
+                last['positions'][row_token] = position + 1
+                # Поле input в отчетах не используется, а места занимает больше всего
+                data = {key: value for key, value in tx.items() if key != 'input'}
+                yield (wallet, row_token, block_number, position, int(tx['timeStamp']), json.dumps(data))
+
+        # Пишем пачками и не держим блокировку, пока идут запросы к API.
+        # Повторная загрузка тех же блоков перезапишет строки по ключу, поэтому
+        # оборванная на середине синхронизация безопасна
+        batch = []
+        for row in rows():
+            batch.append(row)
+            if len(batch) >= SAVE_BATCH_SIZE:
+                self._insert_transactions(batch)
+                batch = []
+        self._insert_transactions(batch)
+
+        if last_block is None:
+            last_block = last['block']
+        if last_block is None:
+            return
+        with self.lock:
+            self.conn.execute('''
+                INSERT INTO sync_state (wallet, token, first_block, last_block)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (wallet, token) DO UPDATE SET
+                    first_block = MIN(first_block, excluded.first_block),
+                    last_block = MAX(last_block, excluded.last_block)
+            ''', (wallet, token, first_block, last_block))
+            self.conn.commit()
+
+    @metrics.timed('db_query_seconds')
+    def _insert_transactions(self, rows: list):
+        if not rows:
+            return
+        with self.lock:
+            self.conn.executemany('''
+                INSERT OR REPLACE INTO transactions
+                (wallet, token, block_number, position, timestamp, data)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows)
+            self.conn.commit()
+
+    def _period_filter(self, wallet: str, token: str, start_timestamp: int = None, end_timestamp: int = None):
+        query = 'WHERE wallet = ? AND token = ?'
+        params = [wallet.lower(), token]
+        if start_timestamp:
+            query += ' AND timestamp >= ?'
+            params.append(start_timestamp)
+        if end_timestamp:
+            query += ' AND timestamp <= ?'
+            params.append(end_timestamp)
+        return query, params
+
+    def get_transactions(self, wallet: str, token: str, start_timestamp: int = None, end_timestamp: int = None):
+        """Построчно отдает сохраненные транзакции кошелька за период в порядке блоков"""
+        where, params = self._period_filter(wallet, token, start_timestamp, end_timestamp)
         cursor = self.conn.cursor()
-        cursor.execute('SELECT state FROM users WHERE chat_id = ?', (chat_id,))
+        with metrics.timer('db_query_seconds', function='get_transactions'):
+            cursor.execute(f'SELECT data FROM transactions {where} ORDER BY block_number, position', params)
+        for row in cursor:
+            yield json.loads(row[0])
+
+    @metrics.timed('db_query_seconds')
+    def get_transactions_in_blocks(self, wallet: str, token: str, after_block: int, last_block: int) -> list:
+        """Транзакции кошелька в блоках (after_block, last_block] списком, курсор закрыт"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT data FROM transactions
+            WHERE wallet = ? AND token = ? AND block_number > ? AND block_number <= ?
+            ORDER BY block_number, position
+        ''', (wallet.lower(), token, after_block, last_block))
+        return [json.loads(row[0]) for row in cursor.fetchall()]
+
+    @metrics.timed('db_query_seconds')
+    def get_next_block(self, wallet: str, token: str, block_number: int):
+        """Первый блок с транзакциями кошелька после указанного или None"""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            'SELECT MIN(block_number) FROM transactions WHERE wallet = ? AND token = ? AND block_number > ?',
+            (wallet.lower(), token, block_number)
+        )
+        return cursor.fetchone()[0]
+
+    @metrics.timed('db_query_seconds')
+    def get_time_bounds(self, wallet: str, token: str, start_timestamp: int = None, end_timestamp: int = None):
+        """Время первой и последней сохраненной транзакции за период"""
+        where, params = self._period_filter(wallet, token, start_timestamp, end_timestamp)
+        cursor = self.conn.cursor()
+        cursor.execute(f'SELECT MIN(timestamp), MAX(timestamp) FROM transactions {where}', params)
+        return cursor.fetchone()
+
+    @metrics.timed('db_query_seconds')
+    def get_period_summary(self, wallet: str, token: str, start_timestamp: int = None, end_timestamp: int = None):
+        """Число сохраненных транзакций за период и их крайние блоки: (count, first_block, last_block)"""
+        where, params = self._period_filter(wallet, token, start_timestamp, end_timestamp)
+        cursor = self.conn.cursor()
+        cursor.execute(f'SELECT COUNT(*), MIN(block_number), MAX(block_number) FROM transactions {where}', params)
+        return cursor.fetchone()
+
+    @metrics.timed('db_query_seconds')
+    def get_cached_report(self, cache_key: str, max_age: int):
+        """Отправленный отчет не старше max_age секунд: (file_id, totals) или None"""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            'SELECT file_id, totals FROM report_cache WHERE cache_key = ? AND created_at >= ?',
+            (cache_key, int(time.time()) - max_age)
+        )
         result = cursor.fetchone()
-        return result[0] if result else None 
+        return (result[0], json.loads(result[1])) if result else None
+
+    @metrics.timed('db_query_seconds')
+    def save_cached_report(self, cache_key: str, file_id: str, totals: dict):
+        """Запоминает file_id отправленного отчета и его итоги"""
+        with self.lock:
+            self.conn.execute('''
+                INSERT OR REPLACE INTO report_cache (cache_key, file_id, totals, created_at)
+                VALUES (?, ?, ?, ?)
+            ''', (cache_key, file_id, json.dumps(totals), int(time.time())))
+            self.conn.commit()
+
+    @metrics.timed('db_query_seconds')
+    def get_token_metadata(self, contract: str):
+        """Метаданные токена (symbol, name, decimals) или None"""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            'SELECT symbol, name, decimals FROM token_metadata WHERE contract = ?',
+            (contract.lower(),)
+        )
+        return cursor.fetchone()
+
+    @metrics.timed('db_query_seconds')
+    def save_token_metadata(self, rows: list):
+        """Сохраняет метаданные токенов: [(contract, symbol, name, decimals)]"""
+        if not rows:
+            return
+        with self.lock:
+            self.conn.executemany('''
+                INSERT OR IGNORE INTO token_metadata (contract, symbol, name, decimals)
+                VALUES (?, ?, ?, ?)
+            ''', rows)
+            self.conn.commit()
+
+    @metrics.timed('db_query_seconds')
+    def get_daily_prices(self, coin_id: str, start_day: int, end_day: int) -> dict:
+        """Дневные курсы монеты: {номер дня от 1970-01-01: курс}"""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            'SELECT day, price FROM daily_prices WHERE coin_id = ? AND day BETWEEN ? AND ?',
+            (coin_id, start_day, end_day)
+        )
+        return dict(cursor.fetchall())
+
+    @metrics.timed('db_query_seconds')
+    def save_daily_prices(self, coin_id: str, prices: dict):
+        """Сохраняет дневные курсы монеты"""
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO daily_prices (coin_id, day, price) VALUES (?, ?, ?)',
+                [(coin_id, day, price) for day, price in prices.items()]
+            )
+            self.conn.commit()
+
+    @metrics.timed('db_query_seconds')
+    def get_last_indexed_balance(self, wallet: str, token: str):
+        """Последняя запись индекса балансов: (block_number, balance) или None"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT block_number, balance FROM balance_index
+            WHERE wallet = ? AND token = ?
+            ORDER BY block_number DESC LIMIT 1
+        ''', (wallet.lower(), token))
+        result = cursor.fetchone()
+        return (result[0], int(result[1])) if result else None
+
+    @metrics.timed('db_query_seconds')
+    def save_balance_index(self, wallet: str, token: str, rows: list, checkpoints: dict):
+        """Дописывает балансы после блоков [(block_number, timestamp, balance)] и дневные точки {day: balance}"""
+        wallet = wallet.lower()
+        with self.lock:
+            self.conn.executemany('''
+                INSERT OR REPLACE INTO balance_index (wallet, token, block_number, timestamp, balance)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(wallet, token, block, timestamp, str(balance)) for block, timestamp, balance in rows])
+            self.conn.executemany('''
+                INSERT OR REPLACE INTO balance_checkpoints (wallet, token, day, balance)
+                VALUES (?, ?, ?, ?)
+            ''', [(wallet, token, day, str(balance)) for day, balance in checkpoints.items()])
+            self.conn.commit()
+
+    @metrics.timed('db_query_seconds')
+    def get_balance_at(self, wallet: str, token: str, timestamp: int):
+        """Баланс после последнего блока не позже timestamp или None"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT balance FROM balance_index
+            WHERE wallet = ? AND token = ? AND timestamp <= ?
+            ORDER BY timestamp DESC, block_number DESC LIMIT 1
+        ''', (wallet.lower(), token, timestamp))
+        result = cursor.fetchone()
+        return int(result[0]) if result else None
+
+    @metrics.timed('db_query_seconds')
+    def get_balance_at_day(self, wallet: str, token: str, day: int):
+        """Баланс на конец дня UTC по дневным точкам или None"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT balance FROM balance_checkpoints
+            WHERE wallet = ? AND token = ? AND day <= ?
+            ORDER BY day DESC LIMIT 1
+        ''', (wallet.lower(), token, day))
+        result = cursor.fetchone()
+        return int(result[0]) if result else None
+
+    def close(self):
+        """Сохраняет отложенные изменения и закрывает соединения"""
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        self.flush_users()
+        with self.connections_lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
 
     def __del__(self):
         """Закрытие соединения при удалении объекта"""
-        self.conn.close() 
\ No newline at end of file
+        self.close()
\ No newline at end of file
@@ -0,0 +1,280 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import metrics
+
+API_URL = 'https://api.etherscan.io/api'
+LATEST_BLOCK = 99999999
+# Etherscan отдает не больше 10 000 строк на окно page * offset
+PAGE_SIZE = 1000
+MAX_WINDOW = 10000
+# balancemulti принимает не больше 20 адресов за запрос
+BALANCE_BATCH_SIZE = 20
+# Шаг, до которого округляются моменты времени при поиске блока: границы
+# периодов вроде "последний месяц" сдвигаются каждую секунду, а с шагом
+# повторные запросы попадают в кэш. Период при этом лишь чуть расширяется
+BLOCK_TIME_GRAIN = 300
+# Сколько номеров блоков по времени держать в кэше
+BLOCK_CACHE_SIZE = 4096
+
+
+class RateLimitError(Exception):
+    """Etherscan ответил, что лимит запросов превышен"""
+
+
+class TokenBucket:
+    """Ограничитель частоты запросов: не больше rate запросов в секунду с запасом capacity"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Ждет, пока освободится токен, и забирает его"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class EtherscanClient:
+    """Общий клиент Etherscan API для всего бота.
+
+    Держит пул keep-alive соединений, ограничивает частоту запросов одним
+    токен-бакетом на процесс и повторяет запросы с экспоненциальной задержкой
+    и джиттером, если Etherscan сообщает о превышении лимита или отвечает 5xx.
+    """
+
+    def __init__(self, api_key, rate_limit=5, max_retries=5, pool_size=10, timeout=(5, 30)):
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.rate_limiter = TokenBucket(rate_limit)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # Номера блоков по времени не меняются: кэш LRU по округленному времени
+        self.block_cache = OrderedDict()
+        self.block_cache_lock = threading.Lock()
+
+    def call(self, params):
+        """Выполняет запрос к API с учетом лимита и повторов, возвращает поле result"""
+        params = {**params, 'apikey': self.api_key}
+        action = params.get('action', '')
+        for attempt in range(self.max_retries + 1):
+            with metrics.timer('etherscan_rate_wait_seconds'):
+                self.rate_limiter.acquire()
+            try:
+                with metrics.timer('etherscan_request_seconds', action=action):
+                    return self._request(params)
+            except (RateLimitError, requests.ConnectionError, requests.Timeout) as e:
+                metrics.inc('etherscan_retries_total', action=action, reason=type(e).__name__)
+                if attempt == self.max_retries:
+                    raise
+                delay = min(30, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.5)
+                print(f"⚠️ Etherscan: {str(e)}, повтор через {delay:.1f} с")
+                time.sleep(delay)
+
+    def _request(self, params):
+        response = self.session.get(API_URL, params=params, timeout=self.timeout)
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RateLimitError(f"HTTP {response.status_code}")
+        data = response.json()
+
+        if data.get('status') == '1':
+            return data['result']
+        if data.get('message') in ('No transactions found', 'No records found'):
+            return []
+        # Методы module=proxy отвечают в формате JSON-RPC, без поля status
+        if 'jsonrpc' in data:
+            if 'error' in data:
+                raise Exception(f"API Error: {data['error'].get('message')}")
+            if 'result' in data and 'rate limit' not in str(data['result']).lower():
+                return data['result']
+        if 'rate limit' in str(data.get('result', '')).lower():
+            raise RateLimitError(data['result'])
+        raise Exception(f"API Error: {data.get('message')} {data.get('result')}")
+
+    def get_eth_balance(self, address):
+        """Баланс ETH в wei"""
+        return self.call({
+            'module': 'account',
+            'action': 'balance',
+            'address': address,
+            'tag': 'latest'
+        })
+
+    def get_eth_balances(self, addresses):
+        """Балансы ETH нескольких адресов в wei: {адрес в нижнем регистре: баланс}"""
+        balances = {}
+        for i in range(0, len(addresses), BALANCE_BATCH_SIZE):
+            result = self.call({
+                'module': 'account',
+                'action': 'balancemulti',
+                'address': ','.join(addresses[i:i + BALANCE_BATCH_SIZE]),
+                'tag': 'latest'
+            })
+            for item in result:
+                balances[item['account'].lower()] = item['balance']
+        return balances
+
+    def get_token_balance(self, contract_address, address):
+        """Баланс токена в минимальных единицах"""
+        return self.call({
+            'module': 'account',
+            'action': 'tokenbalance',
+            'contractaddress': contract_address,
+            'address': address,
+            'tag': 'latest'
+        })
+
+    def get_block_by_timestamp(self, timestamp, closest='before'):
+        """Возвращает номер блока, ближайшего к моменту времени (getblocknobytime).
+
+        Время округляется наружу периода с шагом BLOCK_TIME_GRAIN: начало
+        ('after') вниз, конец ('before') вверх, но не дальше текущего момента.
+        """
+        timestamp = int(timestamp)
+        if closest == 'after':
+            timestamp -= timestamp % BLOCK_TIME_GRAIN
+        else:
+            rounded = timestamp - timestamp % BLOCK_TIME_GRAIN + BLOCK_TIME_GRAIN
+            if rounded < time.time():
+                timestamp = rounded
+        key = (timestamp, closest)
+        with self.block_cache_lock:
+            block = self.block_cache.get(key)
+            if block is not None:
+                self.block_cache.move_to_end(key)
+        metrics.inc('cache_requests_total', cache='blocks', result='miss' if block is None else 'hit')
+        if block is None:
+            block = int(self.call({
+                'module': 'block',
+                'action': 'getblocknobytime',
+                'timestamp': str(timestamp),
+                'closest': closest
+            }))
+            self.cache_blocks([(timestamp, closest, block)])
+        return block
+
+    def cache_blocks(self, entries):
+        """Добавляет в кэш номера блоков [(timestamp, closest, block)]"""
+        with self.block_cache_lock:
+            for timestamp, closest, block in entries:
+                self.block_cache[(timestamp, closest)] = block
+                self.block_cache.move_to_end((timestamp, closest))
+            while len(self.block_cache) > BLOCK_CACHE_SIZE:
+                self.block_cache.popitem(last=False)
+
+    def get_cached_blocks(self):
+        """Содержимое кэша блоков [(timestamp, closest, block)], от давних к недавним"""
+        with self.block_cache_lock:
+            return [(timestamp, closest, block) for (timestamp, closest), block in self.block_cache.items()]
+
+    def get_latest_block(self):
+        """Номер последнего блока сети"""
+        return int(self.call({'module': 'proxy', 'action': 'eth_blockNumber'}), 16)
+
+    def get_block(self, block_number):
+        """Блок с полными транзакциями (eth_getBlockByNumber), поля в hex"""
+        return self.call({
+            'module': 'proxy',
+            'action': 'eth_getBlockByNumber',
+            'tag': hex(block_number),
+            'boolean': 'true'
+        })
+
+    def request_logs(self, address, topic0, start_block, end_block, page):
+        """Запрашивает одну страницу событий контракта"""
+        return self.call({
+            'module': 'logs',
+            'action': 'getLogs',
+            'address': address,
+            'topic0': topic0,
+            'fromBlock': str(start_block),
+            'toBlock': str(end_block),
+            'page': str(page),
+            'offset': str(PAGE_SIZE)
+        })
+
+    def iter_logs(self, address, topic0, start_block, end_block):
+        """Постранично отдает события контракта с topic0 по возрастанию блоков"""
+        return self._iter_windows(
+            lambda start_block, page: self.request_logs(address, topic0, start_block, end_block, page),
+            start_block,
+            lambda log: int(log['blockNumber'], 16)
+        )
+
+    def request_account_txs(self, action, address, start_block, end_block, page, **extra_params):
+        """Запрашивает одну страницу транзакций аккаунта"""
+        return self.call({
+            'module': 'account',
+            'action': action,
+            'address': address,
+            'startblock': str(start_block),
+            'endblock': str(end_block),
+            'page': str(page),
+            'offset': str(PAGE_SIZE),
+            'sort': 'asc',
+            **extra_params
+        })
+
+    def iter_account_txs(self, action, address, start_block=0, end_block=LATEST_BLOCK, **extra_params):
+        """Постранично отдает транзакции аккаунта по возрастанию блоков"""
+        return self._iter_windows(
+            lambda start_block, page: self.request_account_txs(
+                action, address, start_block, end_block, page, **extra_params
+            ),
+            start_block,
+            lambda tx: int(tx['blockNumber'])
+        )
+
+    def _iter_windows(self, request_page, start_block, block_of):
+        """Обходит страницы выборки request_page(start_block, page) по возрастанию блоков.
+
+        Когда окно в 10 000 строк исчерпано, запрос начинается заново с последнего
+        блока окна. Строки этого блока придерживаются до следующего окна, чтобы
+        блок не оказался разрезан между запросами.
+        """
+        while True:
+            held = []
+            held_block = None
+            window_full = False
+
+            for page in range(1, MAX_WINDOW // PAGE_SIZE + 1):
+                txs = request_page(start_block, page)
+                for tx in txs:
+                    block = block_of(tx)
+                    if block != held_block:
+                        yield from held
+                        held = []
+                        held_block = block
+                    held.append(tx)
+
+                if len(txs) < PAGE_SIZE:
+                    break
+            else:
+                window_full = True
+
+            if not window_full:
+                yield from held
+                return
+
+            if held_block == start_block:
+                # Один блок не помещается в окно целиком: отдаем то, что есть
+                yield from held
+                held_block += 1
+            start_block = held_block
@@ -0,0 +1,105 @@
+import csv
+import gzip
+import itertools
+
+# Формат: (подпись на кнопке, расширение файла)
+REPORT_FORMATS = {
+    'csv': ('CSV', '.csv'),
+    'csvgz': ('CSV.GZ', '.csv.gz'),
+    'parquet': ('Parquet', '.parquet'),
+    'xlsx': ('XLSX', '.xlsx')
+}
+DEFAULT_FORMAT = 'csv'
+# Сколько строк отчета держим в памяти при записи Parquet
+CHUNK_SIZE = 10000
+
+
+def get_report_extension(report_format):
+    """Расширение файла отчета для формата"""
+    return REPORT_FORMATS.get(report_format, REPORT_FORMATS[DEFAULT_FORMAT])[1]
+
+
+def write_report(rows, fieldnames, out, report_format=DEFAULT_FORMAT, float_columns=()):
+    """Построчно записывает отчет в бинарный файловый объект out в выбранном формате.
+
+    Строки отчета это кортежи значений в порядке fieldnames.
+
+    float_columns задают столбцы, которые в Parquet всегда хранятся как float64,
+    даже если в части строк там целый 0.
+    """
+    writer = REPORT_WRITERS.get(report_format, write_csv)
+    writer(rows, fieldnames, out, float_columns)
+
+
+class _Utf8Writer:
+    """Текстовый вход для csv поверх бинарного буфера любого типа"""
+
+    def __init__(self, binary):
+        self.binary = binary
+
+    def write(self, text):
+        return self.binary.write(text.encode('utf-8'))
+
+
+def _write_csv_rows(rows, fieldnames, binary):
+    writer = csv.writer(_Utf8Writer(binary))
+    writer.writerow(fieldnames)
+    writer.writerows(rows)
+
+
+def write_csv(rows, fieldnames, out, float_columns=()):
+    _write_csv_rows(rows, fieldnames, out)
+
+
+def write_csv_gz(rows, fieldnames, out, float_columns=()):
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=6) as archive:
+        _write_csv_rows(rows, fieldnames, archive)
+
+
+def write_parquet(rows, fieldnames, out, float_columns=()):
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    rows = iter(rows)
+    try:
+        while True:
+            chunk = list(itertools.islice(rows, CHUNK_SIZE))
+            if not chunk and writer is not None:
+                break
+            frame = pd.DataFrame(chunk, columns=fieldnames)
+            for column in float_columns:
+                frame[column] = frame[column].astype('float64')
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(out, table.schema, compression='zstd')
+            else:
+                # Схема задается первой пачкой, остальные к ней приводятся
+                table = table.cast(writer.schema)
+            writer.write_table(table)
+            if len(chunk) < CHUNK_SIZE:
+                break
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def write_xlsx(rows, fieldnames, out, float_columns=()):
+    from openpyxl import Workbook
+
+    # В режиме write_only строки сразу уходят во временный XML, а не копятся в памяти
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Report')
+    sheet.append(fieldnames)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(out)
+
+
+REPORT_WRITERS = {
+    'csv': write_csv,
+    'csvgz': write_csv_gz,
+    'parquet': write_parquet,
+    'xlsx': write_xlsx
+}
@@ -0,0 +1,40 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+from metrics import metrics
+import profiling
+
+# Общий пул для параллельных запросов внутри отчетов
+_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix='fanout')
+
+
+def fan_out(calls, deadline, required=(), pool=None):
+    """Запускает независимые вызовы параллельно и собирает результаты по именам.
+
+    Обязательные вызовы (required) дожидаются полностью, их ошибки
+    пробрасываются. Остальные должны уложиться в deadline секунд от старта:
+    если не успели или упали, их результат равен None. pool задает свой
+    пул для долгих вызовов, чтобы они не занимали общий.
+    """
+    started = time.monotonic()
+    pool = pool or _pool
+    futures = {name: pool.submit(profiling.wrap(call)) for name, call in calls.items()}
+
+    results = {}
+    for name in required:
+        results[name] = futures[name].result()
+
+    for name, future in futures.items():
+        if name in results:
+            continue
+        remaining = max(0, deadline - (time.monotonic() - started))
+        try:
+            results[name] = future.result(timeout=remaining)
+        except FuturesTimeout:
+            print(f"⚠️ {name}: нет ответа за {deadline} с, продолжаем без него")
+            metrics.inc('fanout_timeouts_total')
+            results[name] = None
+        except Exception as e:
+            print(f"⚠️ {name}: {str(e)}")
+            metrics.inc('fanout_errors_total')
+            results[name] = None
+    return results
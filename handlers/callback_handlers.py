@@ -1,6 +1,7 @@
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 from datetime import datetime, timezone, timedelta
 import logging
+from exports import REPORT_FORMATS, DEFAULT_FORMAT
 
 def get_period_keyboard():
     """Клавиатура выбора токена"""
@@ -9,26 +10,62 @@ def get_period_keyboard():
         InlineKeyboardButton("💎 ETH", callback_data="type_eth"),
         InlineKeyboardButton("💵 USDT", callback_data="type_usdt")
     )
+    markup.row(
+        InlineKeyboardButton("💵 USDC", callback_data="type_usdc"),
+        InlineKeyboardButton("🟡 DAI", callback_data="type_dai"),
+        InlineKeyboardButton("🔶 WETH", callback_data="type_weth")
+    )
     return markup
 
-def get_time_period_keyboard(token_type):
-    """Клавиатура выбора периода"""
+def get_time_period_keyboard(token_type, report_format=DEFAULT_FORMAT):
+    """Клавиатура выбора периода и формата файла"""
     markup = InlineKeyboardMarkup()
     markup.row(
         InlineKeyboardButton("🕒 Последний месяц", callback_data=f"period_{token_type}_month"),
         InlineKeyboardButton("♾ Все время", callback_data=f"period_{token_type}_all")
     )
     markup.row(InlineKeyboardButton("📋 Выбрать период", callback_data=f"period_{token_type}_custom"))
+    markup.row(*[
+        InlineKeyboardButton(
+            f"✅ {label}" if fmt == report_format else label,
+            callback_data=f"format_{token_type}_{fmt}"
+        )
+        for fmt, (label, _) in REPORT_FORMATS.items()
+    ])
     markup.row(InlineKeyboardButton("◀️ Назад", callback_data="back_to_tokens"))
     return markup
 
+def get_portfolio_keyboard():
+    """Клавиатура сводного отчета по кошелькам портфеля"""
+    markup = InlineKeyboardMarkup()
+    markup.row(
+        InlineKeyboardButton("🔷 ETH за месяц", callback_data="portfolio_eth_month"),
+        InlineKeyboardButton("🔷 ETH за все время", callback_data="portfolio_eth_all")
+    )
+    markup.row(
+        InlineKeyboardButton("💵 USDT за месяц", callback_data="portfolio_usdt_month"),
+        InlineKeyboardButton("💵 USDT за все время", callback_data="portfolio_usdt_all")
+    )
+    return markup
+
 def get_custom_period_keyboard():
     """Клавиатура для пользовательского периода"""
     markup = InlineKeyboardMarkup()
     markup.row(InlineKeyboardButton("◀️ Назад", callback_data="back_to_periods"))
     return markup
 
-def process_custom_period(bot, message, db):
+def format_job_status(scheduler, job, is_new):
+    """Текст статуса для поставленной в очередь задачи"""
+    if job is None:
+        return "❌ Слишком много отчетов в очереди, попробуйте через пару минут"
+    if not is_new:
+        return f"⏳ Отчет {job.period_str} уже формируется (задача #{job.id})"
+    position = scheduler.queue_position(job)
+    if position > 1:
+        return f"⏳ Отчет поставлен в очередь: задача #{job.id}, позиция {position}"
+    return f"⏳ Отчет формируется: задача #{job.id}"
+
+def process_custom_period(bot, message, db, scheduler):
     """Обработка пользовательского периода"""
     try:
         chat_id = message.chat.id
@@ -48,28 +85,30 @@ def process_custom_period(bot, message, db):
                 bot.reply_to(message, "❌ Начальная дата не может быть позже конечной")
                 return
                 
-            wallet = db.get_user_wallet(chat_id)
-            token_type = db.get_user_token(chat_id)
+            user = db.get_user(chat_id) or {}
+            wallet = user.get('wallet')
+            token_type = user.get('token_type')
+            report_format = user.get('report_format') or DEFAULT_FORMAT
             
             if not wallet:
                 bot.reply_to(message, "❌ Сначала отправьте адрес кошелька")
                 return
                 
+            start_timestamp = int(start_date.timestamp())
+            end_timestamp = int(end_date.timestamp())
+            period_str = f"за {start_date_str} - {end_date_str}"
+            
             status_message = bot.reply_to(
                 message,
                 f"⏳ Формирую отчет за период {start_date_str} - {end_date_str}..."
             )
             
-            start_timestamp = int(start_date.timestamp())
-            end_timestamp = int(end_date.timestamp())
-            period_str = f"за {start_date_str} - {end_date_str}"
-            
-            if token_type == 'eth':
-                from main import process_eth_request
-                process_eth_request(chat_id, wallet, start_timestamp, end_timestamp, period_str, status_message.message_id)
-            else:
-                from main import process_usdt_request
-                process_usdt_request(chat_id, wallet, start_timestamp, end_timestamp, period_str, status_message.message_id)
+            job, is_new = scheduler.submit(
+                chat_id, token_type or 'eth', wallet,
+                start_timestamp, end_timestamp, period_str, status_message.message_id, report_format
+            )
+            if job is None or not is_new:
+                bot.edit_message_text(format_job_status(scheduler, job, is_new), chat_id, status_message.message_id)
             
             db.update_user_state(chat_id, None)
             
@@ -85,10 +124,12 @@ def process_custom_period(bot, message, db):
         logging.error(f"Error in process_custom_period: {str(e)}")
         bot.reply_to(message, f"❌ Ошибка при обработке периода: {str(e)}")
 
-def handle_callback(bot, call, db):
+def handle_callback(bot, call, db, scheduler):
     try:
         chat_id = call.message.chat.id
-        wallet = db.get_user_wallet(chat_id)
+        user = db.get_user(chat_id) or {}
+        wallet = user.get('wallet')
+        report_format = user.get('report_format') or DEFAULT_FORMAT
         
         if call.data == "back_to_tokens":
             db.update_user_state(chat_id, None)
@@ -103,10 +144,10 @@ def handle_callback(bot, call, db):
             
         if call.data == "back_to_periods":
             db.update_user_state(chat_id, None)
-            token_type = db.get_user_token(chat_id)
+            token_type = user.get('token_type')
             if not token_type:
                 token_type = 'eth'
-            markup = get_time_period_keyboard(token_type)
+            markup = get_time_period_keyboard(token_type, report_format)
             emoji = "🔷" if token_type == 'eth' else "💎"
             
             bot.edit_message_text(
@@ -120,7 +161,7 @@ def handle_callback(bot, call, db):
         if call.data.startswith('type_'):
             token_type = call.data.split('_')[1]
             db.update_user_token(chat_id, token_type)
-            markup = get_time_period_keyboard(token_type)
+            markup = get_time_period_keyboard(token_type, report_format)
             emoji = "🔷" if token_type == 'eth' else "💎"
             
             bot.edit_message_text(
@@ -131,6 +172,54 @@ def handle_callback(bot, call, db):
             )
             return
 
+        if call.data.startswith('format_'):
+            _, token_type, selected_format = call.data.split('_')
+            if selected_format == report_format:
+                bot.answer_callback_query(call.id)
+                return
+            db.update_user_format(chat_id, selected_format)
+            bot.edit_message_reply_markup(
+                chat_id,
+                call.message.message_id,
+                reply_markup=get_time_period_keyboard(token_type, selected_format)
+            )
+            bot.answer_callback_query(call.id, f"Формат отчета: {REPORT_FORMATS[selected_format][0]}")
+            return
+
+        if call.data.startswith('portfolio_'):
+            _, token_type, period = call.data.split('_')
+            wallets = db.get_user_wallets(chat_id)
+            if not wallets:
+                bot.answer_callback_query(call.id, "Портфель пуст, добавьте кошельки через /add_wallet")
+                return
+
+            now = datetime.now(timezone.utc)
+            end_timestamp = int(now.timestamp())
+            if period == 'all':
+                start_timestamp = None
+                period_str = "за все время"
+            else:
+                start_timestamp = int((now - timedelta(days=30)).timestamp())
+                period_str = "за последний месяц"
+
+            # Сообщение с балансами оставляем, статус отчета шлем отдельно
+            status_message = bot.send_message(
+                chat_id,
+                f"⏳ Формирование сводного отчета {token_type.upper()} по {len(wallets)} кошелькам..."
+            )
+            job, is_new = scheduler.submit(
+                chat_id, f"portfolio_{token_type}", ','.join(wallets),
+                start_timestamp, end_timestamp, period_str, status_message.message_id, report_format
+            )
+            if job is None or not is_new:
+                bot.edit_message_text(
+                    format_job_status(scheduler, job, is_new),
+                    chat_id,
+                    status_message.message_id
+                )
+            bot.answer_callback_query(call.id, format_job_status(scheduler, job, is_new))
+            return
+
         if call.data.startswith('period_'):
             parts = call.data.split('_')
             token_type = parts[1]
@@ -159,26 +248,24 @@ def handle_callback(bot, call, db):
                 start_timestamp = int((now - timedelta(days=30)).timestamp())
                 period_str = "за последний месяц"
 
-            try:
-                bot.edit_message_text(
-                    "⏳ Формирование отчета...",
-                    chat_id,
-                    call.message.message_id
-                )
-                
-                if token_type == 'eth':
-                    from main import process_eth_request
-                    process_eth_request(chat_id, wallet, start_timestamp, end_timestamp, period_str, call.message.message_id)
-                else:
-                    from main import process_usdt_request
-                    process_usdt_request(chat_id, wallet, start_timestamp, end_timestamp, period_str, call.message.message_id)
-                    
-            except Exception as e:
+            # Статус выставляем до постановки в очередь, чтобы не затереть ответ рабочего потока
+            bot.edit_message_text(
+                "⏳ Формирование отчета...",
+                chat_id,
+                call.message.message_id
+            )
+            job, is_new = scheduler.submit(
+                chat_id, token_type, wallet,
+                start_timestamp, end_timestamp, period_str, call.message.message_id, report_format
+            )
+            if job is None or not is_new:
                 bot.edit_message_text(
-                    f"❌ Ошибка при формировании отчета: {str(e)}",
+                    format_job_status(scheduler, job, is_new),
                     chat_id,
                     call.message.message_id
                 )
+            bot.answer_callback_query(call.id, format_job_status(scheduler, job, is_new))
+            return
 
         bot.answer_callback_query(call.id)
             
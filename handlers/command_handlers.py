@@ -1,61 +1,42 @@
-import requests
 from datetime import datetime
-from etherscan import Etherscan
-from usdt_handler import get_usdt_balance, process_usdt_transactions, get_usdt_price
+from usdt_handler import get_usdt_balance
+from tokens import TRANSFERS_TOKEN, get_token_info
+from timeline import get_timeline
+from streams import ETH_SOURCES, as_eth_transfer
+from prices import get_eth_price
+from balances import update_balance_index, get_indexed_balance, ETH_DECIMALS
+from aggregation import EthAggregator, TokenAggregator
+from portfolio import get_portfolio_balances, sum_balances, get_missing_wallets, format_missing_wallets, MAX_PORTFOLIO_WALLETS
+from handlers.callback_handlers import get_portfolio_keyboard
+from watch import MAX_SUBSCRIPTIONS
+from metrics import metrics
 from telebot import types
+import io
 
-def get_wallet_balances(eth_client, wallet_address):
+def get_wallet_balances(eth_client, db, wallet_address):
     try:
         eth_balance = float(eth_client.get_eth_balance(wallet_address)) / 10**18
-        usdt_balance = get_usdt_balance(eth_client, wallet_address)
+        usdt_balance = get_usdt_balance(eth_client, db, wallet_address)
         return eth_balance, usdt_balance
     except Exception as e:
         print(f"Ошибка при получении балансов: {str(e)}")
         return None, None
 
-def get_wallet_balances_at_date(eth_client, wallet_address, target_date):
+def get_wallet_balances_at_date(eth_client, db, wallet_address, target_date):
     """Получает балансы ETH и USDT на указанную дату"""
     try:
-        eth_txs = eth_client.get_normal_txs_by_address(
-            address=wallet_address,
-            startblock=0,
-            endblock=99999999,
-            sort='asc'
-        )
-        
-        usdt_txs = process_usdt_transactions(eth_client, wallet_address)
-        
-        if not eth_txs and not usdt_txs:
-            return float(eth_client.get_eth_balance(wallet_address)) / 10**18, get_usdt_balance(eth_client, wallet_address)
-        
         target_timestamp = int(target_date.timestamp())
-        past_eth_txs = [tx for tx in eth_txs if int(tx['timeStamp']) <= target_timestamp]
-        past_usdt_txs = [tx for tx in usdt_txs if tx['timestamp'] <= target_timestamp]
+        # Догружаем все потоки истории до даты; сами транзакции не перебираем, баланс берется из индекса
+        get_timeline(eth_client, db, wallet_address, end_timestamp=target_timestamp, tokens=('usdt',))
         
-        eth_balance = 0
-        for tx in past_eth_txs:
-            try:
-                if tx['from'].lower() == wallet_address.lower():
-                    value = float(tx['value']) / 10**18
-                    gas_price = float(tx['gasPrice'])
-                    gas_used = float(tx['gasUsed'])
-                    fee = (gas_price * gas_used) / 10**18
-                    eth_balance -= (value + fee)
-                if tx['to'].lower() == wallet_address.lower():
-                    value = float(tx['value']) / 10**18
-                    eth_balance += value
-            except Exception:
-                continue
-                
-        usdt_balance = 0
-        for tx in past_usdt_txs:
-            try:
-                if tx['from'].lower() == wallet_address.lower():
-                    usdt_balance -= tx['amount']
-                if tx['to'].lower() == wallet_address.lower():
-                    usdt_balance += tx['amount']
-            except Exception:
-                continue
+        if not db.get_sync_state(wallet_address, 'eth') and not db.get_sync_state(wallet_address, TRANSFERS_TOKEN):
+            return float(eth_client.get_eth_balance(wallet_address)) / 10**18, get_usdt_balance(eth_client, db, wallet_address)
+        
+        update_balance_index(db, wallet_address, 'eth')
+        update_balance_index(db, wallet_address, 'usdt', (TRANSFERS_TOKEN,))
+        eth_balance = get_indexed_balance(db, wallet_address, 'eth', target_timestamp) / 10**ETH_DECIMALS
+        usdt_decimals = get_token_info(db, 'usdt').decimals
+        usdt_balance = get_indexed_balance(db, wallet_address, 'usdt', target_timestamp) / 10**usdt_decimals
         
         return eth_balance, usdt_balance
         
@@ -63,66 +44,19 @@ def get_wallet_balances_at_date(eth_client, wallet_address, target_date):
         print(f"Ошибка при получении балансов: {str(e)}")
         return None, None
 
-def get_wallet_stats(eth_client, wallet_address):
+def get_wallet_stats(eth_client, db, wallet_address):
     """Получает статистику транзакций кошелька"""
     try:
-        # Получаем ETH транзакции
-        eth_txs = eth_client.get_normal_txs_by_address(
-            address=wallet_address,
-            startblock=0,
-            endblock=99999999,
-            sort='asc'
-        )
-        
-        # Получаем USDT транзакции
-        usdt_txs = process_usdt_transactions(eth_client, wallet_address)
-        
-        # Статистика ETH
-        eth_stats = {
-            'total_in': 0,
-            'total_out': 0,
-            'total_fee': 0,
-            'count_in': 0,
-            'count_out': 0
-        }
-        
-        for tx in eth_txs:
-            try:
-                value = float(tx['value']) / 10**18
-                gas_price = float(tx['gasPrice'])
-                gas_used = float(tx['gasUsed'])
-                fee = (gas_price * gas_used) / 10**18
-                
-                if tx['from'].lower() == wallet_address.lower():
-                    eth_stats['total_out'] += value
-                    eth_stats['total_fee'] += fee
-                    eth_stats['count_out'] += 1
-                if tx['to'].lower() == wallet_address.lower():
-                    eth_stats['total_in'] += value
-                    eth_stats['count_in'] += 1
-            except Exception:
-                continue
-                
-        # Статистика USDT
-        usdt_stats = {
-            'total_in': 0,
-            'total_out': 0,
-            'count_in': 0,
-            'count_out': 0
-        }
-        
-        for tx in usdt_txs:
-            try:
-                if tx['type'] == 'out':
-                    usdt_stats['total_out'] += tx['amount']
-                    usdt_stats['count_out'] += 1
-                else:
-                    usdt_stats['total_in'] += tx['amount']
-                    usdt_stats['count_in'] += 1
-            except Exception:
-                continue
+        eth_stats = EthAggregator(wallet_address)
+        usdt_stats = TokenAggregator(wallet_address, get_token_info(db, 'usdt').decimals)
+        # Один проход по общей хронологии: ETH из обычных и внутренних транзакций, USDT
+        for kind, tx in get_timeline(eth_client, db, wallet_address, tokens=('usdt',)):
+            if kind in ETH_SOURCES:
+                eth_stats.add(as_eth_transfer(kind, tx))
+            else:
+                usdt_stats.add(tx)
                 
-        return eth_stats, usdt_stats
+        return eth_stats.as_dict(), usdt_stats.as_dict()
         
     except Exception as e:
         print(f"Ошибка при получении статистики: {str(e)}")
@@ -135,11 +69,40 @@ def setup_bot_commands(bot):
         ('balance', 'Текущий баланс кошелька'),
         ('balance_at', 'Баланс кошелька на дату'),
         ('stats', 'Статистика транзакций'),
-        ('price', 'Текущий курс ETH и USDT')
+        ('price', 'Текущий курс ETH и USDT'),
+        ('jobs', 'Статус отчетов в очереди'),
+        ('portfolio', 'Балансы и отчеты по всем кошелькам'),
+        ('add_wallet', 'Добавить кошелек в портфель'),
+        ('remove_wallet', 'Убрать кошелек из портфеля'),
+        ('watch', 'Уведомлять о новых переводах кошелька'),
+        ('unwatch', 'Отключить уведомления по кошельку'),
+        ('subscriptions', 'Кошельки с уведомлениями')
     ])
 
-def register_command_handlers(bot, api_key, db):
-    eth_client = Etherscan(api_key)
+def is_wallet_address(text):
+    return text.startswith('0x') and len(text) == 42
+
+def format_portfolio(balances):
+    """Текст с балансами кошельков портфеля и итогом"""
+    def amount(value, digits):
+        return f"{value:.{digits}f}" if value is not None else "н/д"
+
+    lines = [f"💼 Портфель: {len(balances)} кошельков\n"]
+    for wallet, (eth_balance, usdt_balance) in balances.items():
+        lines.append(
+            f"{wallet[:6]}…{wallet[-4:]}: "
+            f"🔷 {amount(eth_balance, 4)} ETH, 💵 {amount(usdt_balance, 2)} USDT"
+        )
+    eth_total, usdt_total = sum_balances(balances)
+    lines.append(
+        f"\n💰 Итого:\n"
+        f"🔷 ETH: {amount(eth_total, 4)}\n"
+        f"💵 USDT: {amount(usdt_total, 2)}"
+        f"{format_missing_wallets(get_missing_wallets(balances))}"
+    )
+    return "\n".join(lines)
+
+def register_command_handlers(bot, eth_client, db, scheduler, deadline=10, admin_id=None):
     setup_bot_commands(bot)
     
     @bot.message_handler(commands=['start'])
@@ -168,7 +131,14 @@ def register_command_handlers(bot, api_key, db):
             "/balance - Текущий баланс кошелька\n"
             "/balance_at - Баланс кошелька на определенную дату\n"
             "/stats - Статистика транзакций\n"
-            "/price - Текущий курс ETH и USDT"
+            "/price - Текущий курс ETH и USDT\n"
+            "/jobs - Статус отчетов в очереди\n"
+            "/portfolio - Балансы и отчеты по всем кошелькам\n"
+            "/add_wallet - Добавить кошелек в портфель\n"
+            "/remove_wallet - Убрать кошелек из портфеля\n"
+            "/watch - Уведомлять о новых переводах ETH и USDT кошелька\n"
+            "/unwatch - Отключить уведомления по кошельку\n"
+            "/subscriptions - Кошельки с уведомлениями"
         )
 
     @bot.message_handler(commands=['balance'])
@@ -189,14 +159,14 @@ def register_command_handlers(bot, api_key, db):
                 f"⏳ Получаю баланс для кошелька\n{wallet}..."
             )
             
-            eth_balance, usdt_balance = get_wallet_balances(eth_client, wallet)
+            eth_balance, usdt_balance = get_wallet_balances(eth_client, db, wallet)
             
-            if eth_balance is not None and usdt_balance is not None:
+            if eth_balance is not None:
                 response = (
                     f"💰 Текущий баланс кошелька\n"
                     f"{wallet}:\n\n"
                     f"🔷 ETH: {eth_balance:.4f}\n"
-                    f"💵 USDT: {usdt_balance:.2f}"
+                    f"💵 USDT: {f'{usdt_balance:.2f}' if usdt_balance is not None else 'н/д'}"
                 )
             else:
                 response = "❌ Ошибка при получении баланса"
@@ -261,6 +231,179 @@ def register_command_handlers(bot, api_key, db):
                 f"❌ Ошибка при получении курса: {str(e)}"
             )
 
+    @bot.message_handler(commands=['jobs'])
+    def jobs(message):
+        chat_jobs = scheduler.get_chat_jobs(message.chat.id)[:10]
+        if not chat_jobs:
+            bot.reply_to(message, "📭 Отчетов в очереди нет")
+            return
+            
+        statuses = {
+            'queued': '🕒 в очереди',
+            'running': '⏳ формируется',
+            'done': '✅ готов',
+            'failed': '❌ ошибка'
+        }
+        lines = [
+            f"#{job.id} {job.token_type.upper()} {job.period_str}: {statuses[job.status]}"
+            for job in chat_jobs
+        ]
+        bot.reply_to(message, "📋 Ваши отчеты:\n\n" + "\n".join(lines))
+
+    def is_admin(message):
+        # Команды администратора остальным бот не показывает
+        if not admin_id or str(message.chat.id) != str(admin_id):
+            bot.reply_to(message, "❌ Команда доступна только администратору")
+            return False
+        return True
+
+    @bot.message_handler(commands=['metrics'])
+    def show_metrics(message):
+        if not is_admin(message):
+            return
+            
+        summary = metrics.summary()
+        # Сообщение Telegram ограничено 4096 символами, полная выгрузка уходит файлом
+        bot.reply_to(message, "📈 Метрики бота\n\n" + summary[:3900])
+        bot.send_document(
+            message.chat.id,
+            io.BytesIO(metrics.render().encode()),
+            visible_file_name='metrics.txt'
+        )
+
+    @bot.message_handler(commands=['profile'])
+    def toggle_profile(message):
+        if not is_admin(message):
+            return
+            
+        # Профилируются задачи, поставленные из чата администратора, пока флаг включен
+        chat_id = message.chat.id
+        if scheduler.profile_all:
+            bot.reply_to(message, "🔬 Профилирование включено для всех отчетов через PROFILE_REPORTS")
+        elif chat_id in scheduler.profiled_chats:
+            scheduler.profiled_chats.discard(chat_id)
+            bot.reply_to(message, "🔬 Профилирование ваших отчетов выключено")
+        else:
+            scheduler.profiled_chats.add(chat_id)
+            bot.reply_to(message,
+                "🔬 Профилирование ваших отчетов включено\n"
+                "Сводка по времени функций и пику памяти придет после каждого отчета. "
+                "Отчеты при этом формируются медленнее; /profile выключает"
+            )
+
+    @bot.message_handler(commands=['add_wallet'])
+    def add_wallet(message):
+        chat_id = message.chat.id
+        args = message.text.split()[1:]
+        # Без адреса добавляем текущий кошелек
+        wallet = args[0] if args else db.get_user_wallet(chat_id)
+        if not wallet or not is_wallet_address(wallet):
+            bot.reply_to(message,
+                "❌ Укажите адрес кошелька: /add_wallet 0x...\n"
+                "Без адреса добавляется последний отправленный кошелек"
+            )
+            return
+            
+        if len(db.get_user_wallets(chat_id)) >= MAX_PORTFOLIO_WALLETS:
+            bot.reply_to(message, f"❌ В портфеле может быть не больше {MAX_PORTFOLIO_WALLETS} кошельков")
+            return
+            
+        if db.add_user_wallet(chat_id, wallet):
+            bot.reply_to(message, f"✅ Кошелек добавлен в портфель\n{wallet.lower()}")
+        else:
+            bot.reply_to(message, "ℹ️ Этот кошелек уже есть в портфеле")
+
+    @bot.message_handler(commands=['remove_wallet'])
+    def remove_wallet(message):
+        args = message.text.split()[1:]
+        if not args:
+            bot.reply_to(message, "❌ Укажите адрес кошелька: /remove_wallet 0x...")
+            return
+            
+        if db.remove_user_wallet(message.chat.id, args[0]):
+            bot.reply_to(message, f"✅ Кошелек убран из портфеля\n{args[0].lower()}")
+        else:
+            bot.reply_to(message, "❌ Такого кошелька нет в портфеле")
+
+    @bot.message_handler(commands=['watch'])
+    def watch(message):
+        chat_id = message.chat.id
+        args = message.text.split()[1:]
+        # Без адреса подписываемся на текущий кошелек
+        wallet = args[0] if args else db.get_user_wallet(chat_id)
+        if not wallet or not is_wallet_address(wallet):
+            bot.reply_to(message,
+                "❌ Укажите адрес кошелька: /watch 0x...\n"
+                "Без адреса подписка оформляется на последний отправленный кошелек"
+            )
+            return
+            
+        if len(db.get_chat_subscriptions(chat_id)) >= MAX_SUBSCRIPTIONS:
+            bot.reply_to(message, f"❌ Можно следить не больше чем за {MAX_SUBSCRIPTIONS} кошельками")
+            return
+            
+        if db.add_subscription(chat_id, wallet):
+            bot.reply_to(message,
+                f"🔔 Буду сообщать о новых переводах ETH и USDT\n{wallet.lower()}\n\n"
+                f"Отключить: /unwatch {wallet.lower()}"
+            )
+        else:
+            bot.reply_to(message, "ℹ️ Вы уже следите за этим кошельком")
+
+    @bot.message_handler(commands=['unwatch'])
+    def unwatch(message):
+        args = message.text.split()[1:]
+        if not args:
+            bot.reply_to(message, "❌ Укажите адрес кошелька: /unwatch 0x...")
+            return
+            
+        if db.remove_subscription(message.chat.id, args[0]):
+            bot.reply_to(message, f"🔕 Уведомления отключены\n{args[0].lower()}")
+        else:
+            bot.reply_to(message, "❌ Вы не следите за этим кошельком")
+
+    @bot.message_handler(commands=['subscriptions'])
+    def subscriptions(message):
+        wallets = db.get_chat_subscriptions(message.chat.id)
+        if not wallets:
+            bot.reply_to(message,
+                "📭 Нет кошельков с уведомлениями\n"
+                "Подписаться: /watch 0x..."
+            )
+            return
+            
+        bot.reply_to(message, "🔔 Уведомления о переводах:\n\n" + "\n".join(wallets))
+
+    @bot.message_handler(commands=['portfolio'])
+    def portfolio(message):
+        chat_id = message.chat.id
+        wallets = db.get_user_wallets(chat_id)
+        if not wallets:
+            bot.reply_to(message,
+                "📭 Портфель пуст\n"
+                "Добавьте кошельки командой /add_wallet 0x..."
+            )
+            return
+            
+        status_message = bot.reply_to(
+            message,
+            f"⏳ Получаю балансы {len(wallets)} кошельков..."
+        )
+        try:
+            balances = get_portfolio_balances(eth_client, db, wallets, deadline)
+            bot.edit_message_text(
+                text=format_portfolio(balances),
+                chat_id=chat_id,
+                message_id=status_message.message_id,
+                reply_markup=get_portfolio_keyboard()
+            )
+        except Exception as e:
+            bot.edit_message_text(
+                text=f"❌ Ошибка при получении балансов: {str(e)}",
+                chat_id=chat_id,
+                message_id=status_message.message_id
+            )
+
     @bot.message_handler(commands=['stats'])
     def stats(message):
         chat_id = message.chat.id
@@ -277,7 +420,7 @@ def register_command_handlers(bot, api_key, db):
                 f"⏳ Получаю статистику для кошелька\n{wallet}..."
             )
             
-            eth_stats, usdt_stats = get_wallet_stats(eth_client, wallet)
+            eth_stats, usdt_stats = get_wallet_stats(eth_client, db, wallet)
             
             if eth_stats is not None and usdt_stats is not None:
                 response = (
@@ -305,12 +448,4 @@ def register_command_handlers(bot, api_key, db):
                 text=f"❌ Ошибка при получении статистики: {str(e)}",
                 chat_id=chat_id,
                 message_id=status_message.message_id
-            ) 
-
-def get_eth_price():
-    """Получает текущий курс ETH в USD"""
-    try:
-        response = requests.get('https://api.coingecko.com/api/v3/simple/price?ids=ethereum&vs_currencies=usd')
-        return response.json()['ethereum']['usd']
-    except Exception:
-        return None 
\ No newline at end of file
+            )
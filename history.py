@@ -0,0 +1,89 @@
+import time
+from etherscan_api import LATEST_BLOCK
+from balances import update_balance_index
+from streams import INTERNAL_TOKEN
+
+# Конец периода ближе этого к текущему моменту считаем "до последнего блока"
+HEAD_TOLERANCE = 60
+
+
+def fetch_eth_transactions(eth, address, start_block, end_block=None):
+    """Постранично запрашивает обычные ETH транзакции в диапазоне блоков"""
+    return eth.iter_account_txs('txlist', address, start_block, LATEST_BLOCK if end_block is None else end_block)
+
+
+def fetch_internal_transactions(eth, address, start_block, end_block=None):
+    """Постранично запрашивает внутренние транзакции в диапазоне блоков"""
+    return eth.iter_account_txs('txlistinternal', address, start_block, LATEST_BLOCK if end_block is None else end_block)
+
+
+def resolve_block_range(eth, start_timestamp=None, end_timestamp=None):
+    """Переводит границы периода в номера блоков; None в конце означает последний блок"""
+    start_block = eth.get_block_by_timestamp(start_timestamp, 'after') if start_timestamp else 0
+    end_block = None
+    if end_timestamp and end_timestamp < time.time() - HEAD_TOLERANCE:
+        end_block = eth.get_block_by_timestamp(end_timestamp, 'before')
+    return start_block, end_block
+
+
+def sync_history(db, wallet, token, fetch, start_block=0, end_block=None, partition=None, indexed=None):
+    """Догружает только те блоки периода, которых еще нет в локальной истории.
+
+    partition раскладывает выборку по нескольким token (см. Database.save_transactions),
+    indexed перечисляет token, для которых после загрузки обновляется индекс
+    балансов, по умолчанию сам token. Индекс обновляется, только если что-то
+    действительно загружалось.
+    """
+    if end_block is not None and end_block < start_block:
+        return
+
+    state = db.get_sync_state(wallet, token)
+    if not state:
+        ranges = [(start_block, end_block)]
+    else:
+        first_block, last_block = state
+        ranges = []
+        if start_block < first_block:
+            ranges.append((start_block, first_block - 1))
+        if end_block is None or end_block > last_block:
+            ranges.append((last_block + 1, end_block))
+
+    for range_start, range_end in ranges:
+        db.save_transactions(wallet, token, fetch(range_start, range_end), range_start, range_end, partition)
+    if ranges:
+        # Разложенные по partition транзакции синхронизируются под самим token
+        sync_tokens = (token,) if partition else None
+        for indexed_token in (token,) if indexed is None else indexed:
+            update_balance_index(db, wallet, indexed_token, sync_tokens)
+
+
+def get_history(eth, db, wallet, token, fetch, start_timestamp=None, end_timestamp=None, indexed=None, blocks=None):
+    """Возвращает итератор по истории кошелька за период, запрашивая у API только недостающие блоки.
+
+    blocks - уже найденные границы периода (start_block, end_block), чтобы
+    параллельные потоки одного периода не искали их каждый заново.
+    """
+    start_block, end_block = blocks or resolve_block_range(eth, start_timestamp, end_timestamp)
+    sync_history(db, wallet, token, fetch, start_block, end_block, indexed=indexed)
+    return db.get_transactions(wallet, token, start_timestamp, end_timestamp)
+
+
+def get_eth_history(eth, db, wallet, start_timestamp=None, end_timestamp=None, blocks=None):
+    """Возвращает обычные ETH транзакции кошелька за период"""
+    return get_history(
+        eth, db, wallet, 'eth',
+        lambda start_block, end_block: fetch_eth_transactions(eth, wallet, start_block, end_block),
+        start_timestamp, end_timestamp, blocks=blocks
+    )
+
+
+def get_internal_history(eth, db, wallet, start_timestamp=None, end_timestamp=None, blocks=None):
+    """Возвращает внутренние транзакции кошелька за период.
+
+    Они меняют ETH баланс, поэтому после загрузки обновляется индекс 'eth'.
+    """
+    return get_history(
+        eth, db, wallet, INTERNAL_TOKEN,
+        lambda start_block, end_block: fetch_internal_transactions(eth, wallet, start_block, end_block),
+        start_timestamp, end_timestamp, indexed=('eth',), blocks=blocks
+    )
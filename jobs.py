@@ -0,0 +1,120 @@
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+from metrics import metrics
+from profiling import Profiler
+import contextlib
+
+
+class Job:
+    """Задача на формирование отчета"""
+
+    def __init__(self, job_id, key, handler, args):
+        self.id = job_id
+        self.key = key
+        self.chat_id = key[0]
+        self.token_type = key[1]
+        self.period_str = key[3]
+        self.handler = handler
+        self.args = args
+        self.status = 'queued'
+        self.profile = False
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+
+class ReportScheduler:
+    """Очередь отчетов с ограниченным пулом рабочих потоков.
+
+    Одинаковые задачи одного чата, которые еще не завершились, не ставятся
+    в очередь повторно, а при переполнении очереди новые задачи отклоняются.
+    """
+
+    def __init__(self, handlers, workers=4, max_queue=100, history_size=200, profile_all=False, on_profile=None):
+        self.handlers = handlers
+        # Профилирование отчетов: всех или только чатов из profiled_chats.
+        # on_profile(job, profiler) получает профиль после завершения задачи
+        self.profile_all = profile_all
+        self.profiled_chats = set()
+        self.on_profile = on_profile
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.history = deque(maxlen=history_size)
+        self.ids = itertools.count(1)
+        self.running = 0
+        metrics.gauge('report_queue_depth', self.queue.qsize)
+        metrics.gauge('report_jobs_running', lambda: self.running)
+        self.workers = [
+            threading.Thread(target=self._worker, name=f"report-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, chat_id, token_type, wallet, start_timestamp, end_timestamp, period_str,
+               message_id=None, report_format='csv'):
+        """Ставит отчет в очередь. Возвращает (job, is_new); job равен None, если очередь заполнена"""
+        key = (chat_id, token_type, wallet, period_str, report_format)
+        with self.lock:
+            if key in self.in_flight:
+                metrics.inc('report_jobs_total', result='duplicate')
+                return self.in_flight[key], False
+
+            job = Job(
+                next(self.ids), key, self.handlers[token_type],
+                (chat_id, wallet, start_timestamp, end_timestamp, period_str, message_id, report_format)
+            )
+            job.profile = self.profile_all or chat_id in self.profiled_chats
+            try:
+                self.queue.put_nowait(job)
+            except queue.Full:
+                metrics.inc('report_jobs_total', result='rejected')
+                return None, False
+            self.in_flight[key] = job
+            self.history.append(job)
+            return job, True
+
+    def queue_position(self, job):
+        """Примерная позиция задачи в очереди"""
+        return self.queue.qsize() if job.status == 'queued' else 0
+
+    def get_chat_jobs(self, chat_id):
+        """Последние задачи чата, от новых к старым"""
+        with self.lock:
+            return [job for job in reversed(self.history) if job.chat_id == chat_id]
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            job.status = 'running'
+            job.started_at = time.time()
+            metrics.observe('report_queue_wait_seconds', job.started_at - job.created_at)
+            with self.lock:
+                self.running += 1
+            profiler = Profiler() if job.profile else None
+            try:
+                with metrics.timer('report_job_seconds', token=job.token_type), \
+                        profiler or contextlib.nullcontext():
+                    job.handler(*job.args)
+                job.status = 'done'
+            except Exception as e:
+                job.status = 'failed'
+                job.error = str(e)
+                print(f"Ошибка в задаче #{job.id}: {str(e)}")
+            finally:
+                if profiler and self.on_profile:
+                    try:
+                        self.on_profile(job, profiler)
+                    except Exception as e:
+                        print(f"Не удалось отправить профиль задачи #{job.id}: {str(e)}")
+                job.finished_at = time.time()
+                metrics.inc('report_jobs_total', result=job.status)
+                with self.lock:
+                    self.in_flight.pop(job.key, None)
+                    self.running -= 1
+                self.queue.task_done()
@@ -1,11 +1,9 @@
-__all__ = ['process_eth_request', 'process_usdt_request']
+__all__ = ['process_eth_request', 'process_token_request', 'process_usdt_request']
 
 from datetime import datetime, timezone, timedelta
 import os
 from telebot import TeleBot, types
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
-from etherscan import Etherscan
-import requests
 from dotenv import load_dotenv
 from handlers.callback_handlers import (
     handle_callback, 
@@ -13,70 +11,111 @@ from handlers.callback_handlers import (
     get_custom_period_keyboard,
     process_custom_period
 )
-from usdt_handler import (
-    process_usdt_transactions, 
-    get_usdt_balance, 
-    get_usdt_price, 
-    USDT_CONTRACT, 
-    USDT_DECIMALS
+from tokens import (
+    KNOWN_TOKENS,
+    get_token_info,
+    get_token_history,
+    get_token_balance,
+    process_token_transactions
 )
+from prices import get_eth_price, get_usdt_price, get_daily_prices, SECONDS_PER_DAY
 from handlers.command_handlers import register_command_handlers, get_wallet_balances_at_date
 from database import Database
+from etherscan_api import EtherscanClient
+from timeline import get_timeline_calls, merge_timeline
+from streams import ETH_SOURCES, eth_transfers
+from jobs import ReportScheduler
+from aggregation import EthAggregator, TokenAggregator
+from fanout import fan_out
+from metrics import metrics, start_metrics_server
+from webhook import run_webhook
+from warmup import save_snapshot, load_snapshot, start_prewarm
+from watch import WalletWatcher, POLL_INTERVAL
+from portfolio import get_portfolio_balances, sum_balances, get_missing_wallets, format_missing_wallets, history_pool
+from vectorized import split_large, chunked_rows
+import vectorized
+from exports import write_report, get_report_extension, DEFAULT_FORMAT
+from records import (
+    EthReportRow,
+    TokenReportRow,
+    ETH_REPORT_FIELDS,
+    ETH_FLOAT_FIELDS,
+    TOKEN_REPORT_FIELDS,
+    TOKEN_FLOAT_FIELDS
+)
+import functools
+import io
+import itertools
 import signal
 import sys
-import csv
+import tempfile
 
 load_dotenv()
 API_KEY = os.getenv('ETHERSCAN_API_KEY')
 BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 ADMIN_ID = os.getenv('ADMIN_ID')
+# polling или webhook; в режиме webhook обновления принимает встроенный HTTP сервер
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
 
-bot = TeleBot(BOT_TOKEN)
+# В режиме webhook обработчики выполняются в пуле сервера, а не в пуле telebot
+bot = TeleBot(BOT_TOKEN, threaded=BOT_MODE != 'webhook')
 db = Database()
-eth_client = Etherscan(API_KEY)
+# Один клиент на весь процесс: общий пул соединений и общий лимит запросов
+eth_client = EtherscanClient(API_KEY, rate_limit=float(os.getenv('ETHERSCAN_RATE_LIMIT', '5')))
+# Сколько секунд отчет ждет курс и балансы, прежде чем обойтись без них
+REPORT_DEADLINE = float(os.getenv('REPORT_DEADLINE', '10'))
+# Готовый отчет переотправляется по file_id не дольше этого срока: в нем есть колонка по текущему курсу
+REPORT_CACHE_TTL = int(os.getenv('REPORT_CACHE_TTL', '3600'))
+# До этого размера файл отчета собирается в памяти, крупнее уходит во временный файл
+REPORT_SPOOL_SIZE = int(os.getenv('REPORT_SPOOL_SIZE', str(16 * 1024 * 1024)))
+# Снимок кэшей в памяти, который переживает перезапуск процесса
+CACHE_SNAPSHOT = os.getenv('CACHE_SNAPSHOT', 'cache_snapshot.json')
+# Сколько недавно активных кошельков догружать при старте, 0 отключает прогрев
+PREWARM_WALLETS = int(os.getenv('PREWARM_WALLETS', '20'))
+# Период опроса новых блоков для подписок, 0 отключает уведомления
+WATCH_INTERVAL = float(os.getenv('WATCH_INTERVAL', str(POLL_INTERVAL)))
 
-def get_eth_usd_price():
+def build_report(transactions, fieldnames, report_format, float_columns=()):
+    """Собирает отчет в буфере: небольшой в памяти, крупный во временном файле"""
+    buffer = tempfile.SpooledTemporaryFile(max_size=REPORT_SPOOL_SIZE)
     try:
-        response = requests.get('https://api.coingecko.com/api/v3/simple/price?ids=ethereum&vs_currencies=usd')
-        data = response.json()
-        if 'ethereum' in data and 'usd' in data['ethereum']:
-            return float(data['ethereum']['usd'])
-        return None
+        # Строки считаются лениво, поэтому сюда входит и их расчет, и запись файла
+        with metrics.timer('report_stage_seconds', stage='build', format=report_format):
+            write_report(transactions, fieldnames, buffer, report_format, float_columns)
     except Exception:
-        return None
+        buffer.close()
+        raise
+    metrics.inc('report_bytes_total', buffer.tell(), format=report_format)
+    buffer.seek(0)
+    return buffer
+
+def build_eth_report(transactions, report_format=DEFAULT_FORMAT):
+    """Собирает файл отчета по ETH транзакциям"""
+    return build_report(transactions, ETH_REPORT_FIELDS, report_format, ETH_FLOAT_FIELDS)
+
+def build_token_report(transactions, report_format=DEFAULT_FORMAT):
+    """Собирает файл отчета по переводам токена"""
+    return build_report(transactions, TOKEN_REPORT_FIELDS, report_format, TOKEN_FLOAT_FIELDS)
+
+def get_report_filename(wallet_address, token, period_str, report_format):
+    """Имя файла отчета для Telegram, со временем формирования"""
+    created_at = datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')
+    return (
+        f"{wallet_address}_{token.upper()}_{period_str.replace(' ', '_')}_{created_at}"
+        f"{get_report_extension(report_format)}"
+    )
 
-def save_to_csv(transactions, filename):
-    """Сохраняет транзакции в CSV файл"""
-    os.makedirs("reports", exist_ok=True)
-    file_path = f"reports/{filename}"
-
-    with open(file_path, mode='w', newline='', encoding='utf-8') as file:
-        writer = csv.DictWriter(file, fieldnames=[
-            'Date', 'From', 'To', 'Transaction Hash', 'Amount In (ETH)',
-            'Amount Out (ETH)', 'Fee (ETH)', 'Fee (USD)', 'CurrentValue', 
-            'General amount', 'General amount USD'
-        ])
-        writer.writeheader()
-        writer.writerows(transactions)
-    return file_path
-
-def save_usdt_to_csv(transactions, filename):
-    """Сохраняет USDT транзакции в CSV файл"""
-    os.makedirs("reports", exist_ok=True)
-    file_path = f"reports/{filename}"
-
-    with open(file_path, mode='w', newline='', encoding='utf-8') as file:
-        writer = csv.DictWriter(file, fieldnames=[
-            'Blockno', 'UnixTimestamp', 'DateTime', 'From', 'To', 
-            'Transaction Hash', 'TokenValue', 
-            'ContractAddress', 'TokenName', 'TokenSymbol'
-        ])
-        writer.writeheader()
-        writer.writerows(transactions)
-    return file_path
-
-def process_transactions(transactions, wallet_address, eth_usd_price):
-    processed = []
+def process_transactions(transactions, wallet_address, eth_usd_price, daily_prices=None):
+    """Построчно превращает ETH транзакции в строки отчета.
+
+    Суммы в USD считаются по курсу дня транзакции из daily_prices, а если
+    его нет, по текущему курсу. CurrentValue всегда считается по текущему.
+    Суммы строк совпадают с итогами EthAggregator: у неуспешной транзакции
+    сумма 0 (списывается только комиссия), перевод самому себе попадает и
+    во входящие, и в исходящие.
+    """
+    daily_prices = daily_prices or {}
+    wallet_address = wallet_address.lower()
     for tx in transactions:
         tx_hash = tx['hash']
         timestamp = int(tx['timeStamp'])
@@ -85,124 +124,257 @@ def process_transactions(transactions, wallet_address, eth_usd_price):
         from_address = tx['from']
         to_address = tx['to']
         
-        value_wei = int(tx['value'])
+        value_wei = int(tx['value']) if tx.get('isError', '0') != '1' else 0
         value_eth = value_wei / 10**18
         
         gas_price_wei = int(tx['gasPrice'])
         gas_used = int(tx['gasUsed'])
         fee_wei = gas_price_wei * gas_used
         fee_eth = fee_wei / 10**18
-        fee_usd = fee_eth * eth_usd_price if eth_usd_price else 0
+        tx_price = daily_prices.get(timestamp // SECONDS_PER_DAY, eth_usd_price)
+        fee_usd = fee_eth * tx_price if tx_price else 0
         
-        is_outgoing = from_address.lower() == wallet_address.lower()
+        is_outgoing = from_address.lower() == wallet_address
+        is_incoming = not is_outgoing or to_address.lower() == wallet_address
+        amount_in_eth = value_eth if is_incoming else 0
         amount_out_eth = value_eth if is_outgoing else 0
         
         current_value = value_eth * eth_usd_price if eth_usd_price else 0
         
-        general_amount = value_eth if not is_outgoing else amount_out_eth
-        if is_outgoing and amount_out_eth > 0:  # Меняем знак только для исходящих транзакций с amount_out
-            general_amount = -amount_out_eth
-        elif is_outgoing:
+        general_amount = amount_in_eth - amount_out_eth
+        if is_outgoing and amount_out_eth == 0:  # Комиссия без перевода идет в эту же строку
             general_amount -= fee_eth
             
-        general_amount_usd = general_amount * eth_usd_price
+        general_amount_usd = general_amount * tx_price
 
         # Оригинальная строка транзакции
-        processed.append({
-            'Transaction Hash': tx_hash,
-            'Date': date,
-            'From': from_address,
-            'To': to_address,
-            'Amount In (ETH)': value_eth if not is_outgoing else 0,
-            'Amount Out (ETH)': amount_out_eth,
-            'Fee (ETH)': fee_eth,
-            'Fee (USD)': fee_usd,
-            'CurrentValue': current_value,
-            'General amount': general_amount,
-            'General amount USD': general_amount_usd
-        })
+        yield EthReportRow(
+            date=date,
+            sender=from_address,
+            recipient=to_address,
+            tx_hash=tx_hash,
+            amount_in=amount_in_eth,
+            amount_out=amount_out_eth,
+            fee=fee_eth,
+            fee_usd=fee_usd,
+            current_value=current_value,
+            general_amount=general_amount,
+            general_amount_usd=general_amount_usd
+        )
 
         # Дополнительная строка для комиссии
         if amount_out_eth > 0 and fee_eth > 0:  # Только для исходящих транзакций
-            processed.append({
-                'Transaction Hash': tx_hash,
-                'Date': date,
-                'From': from_address,
-                'To': to_address,
-                'Amount In (ETH)': 0,
-                'Amount Out (ETH)': fee_eth,  # Комиссия как расход
-                'Fee (ETH)': fee_eth,  # Добавляем значение комиссии
-                'Fee (USD)': fee_usd,  # Добавляем значение комиссии в USD
-                'CurrentValue': 0,  # Для строки комиссии CurrentValue всегда 0
-                'General amount': -fee_eth,  # Отрицательное значение комиссии
-                'General amount USD': -fee_usd  # Отрицательное значение комиссии в USD
-            })
-        
-    return processed
+            yield EthReportRow(
+                date=date,
+                sender=from_address,
+                recipient=to_address,
+                tx_hash=tx_hash,
+                amount_in=0,
+                amount_out=fee_eth,  # Комиссия как расход
+                fee=fee_eth,  # Добавляем значение комиссии
+                fee_usd=fee_usd,  # Добавляем значение комиссии в USD
+                current_value=0,  # Для строки комиссии CurrentValue всегда 0
+                general_amount=-fee_eth,  # Отрицательное значение комиссии
+                general_amount_usd=-fee_usd  # Отрицательное значение комиссии в USD
+            )
+
+def token_report_rows(transfers, wallet_address, token_info):
+    """Построчно превращает переводы токена в строки отчета"""
+    wallet = wallet_address.lower()
+    for tx in transfers:
+        yield TokenReportRow(
+            block_number=tx.block_number,
+            timestamp=tx.timestamp,
+            date=tx.date,
+            sender=tx.sender,
+            recipient=tx.recipient,
+            tx_hash=tx.tx_hash,
+            token_value=-tx.amount if tx.sender.lower() == wallet else tx.amount,
+            contract_address=token_info.contract,
+            token_name=token_info.name,
+            token_symbol=token_info.symbol
+        )
+
+def get_eth_report_rows(txs, stats, wallet_address, eth_price, daily_prices):
+    """Строки ETH отчета с подсчетом итогов в stats; крупные кошельки считаются по столбцам"""
+    def row_path(txs):
+        return process_transactions(stats.tap(txs), wallet_address, eth_price, daily_prices)
+
+    txs, large = split_large(txs)
+    if large:
+        return chunked_rows(
+            txs, lambda chunk: vectorized.eth_report_rows(chunk, stats, eth_price, daily_prices), row_path
+        )
+    return row_path(txs)
+
+def get_token_report_rows(txs, stats, wallet_address, token_info):
+    """Строки отчета по токену с подсчетом итогов в stats; крупные кошельки считаются по столбцам"""
+    def row_path(txs):
+        return token_report_rows(
+            process_token_transactions(stats.tap(txs), wallet_address, token_info.decimals),
+            wallet_address, token_info
+        )
+
+    txs, large = split_large(txs)
+    if large:
+        return chunked_rows(
+            txs,
+            lambda chunk: vectorized.token_report_rows(
+                chunk, stats, token_info.contract, token_info.name, token_info.symbol
+            ),
+            row_path
+        )
+    return row_path(txs)
+
+def read_balances(upstream):
+    """Балансы ETH и USDT из результатов параллельных запросов; None, если не успели"""
+    eth_balance = upstream['eth_balance']
+    if eth_balance is not None:
+        eth_balance = float(eth_balance) / 10**18
+    return eth_balance, upstream['usdt_balance']
+
+def format_balance(value, digits):
+    """Форматирует баланс для подписи отчета"""
+    return f"{value:.{digits}f}" if value is not None else "н/д"
+
+def format_eth_caption(period_str, totals, eth_balance, usdt_balance):
+    """Подпись к ETH отчету"""
+    return (
+        f"📊 Отчет по ETH транзакциям\n"
+        f"📅 Период: {period_str}\n\n"
+        f"📥 Входящие: {totals['count_in']}\n"
+        f"📤 Исходящие: {totals['count_out']}\n"
+        f"💵 Получено: {totals['total_in']:.4f} ETH\n"
+        f"💸 Отправлено: {totals['total_out']:.4f} ETH\n"
+        f"🏷 Комиссии: {totals['total_fee']:.4f} ETH\n\n"
+        f"💰 Текущий баланс:\n"
+        f"🔷 ETH: {format_balance(eth_balance, 4)}\n"
+        f"💵 USDT: {format_balance(usdt_balance, 2)}"
+    )
 
+def get_token_digits(token_info):
+    """Знаков после запятой в подписи: стейблкоины с 6 decimals до центов"""
+    return 2 if token_info.decimals <= 6 else 4
 
+def format_token_caption(token_info, period_str, totals, eth_balance, token_balance):
+    """Подпись к отчету по токену"""
+    symbol = token_info.symbol
+    digits = get_token_digits(token_info)
+    return (
+        f"📊 Отчет по {symbol} транзакциям\n"
+        f"📅 Период: {period_str}\n\n"
+        f"📥 Входящие: {totals['count_in']}\n"
+        f"📤 Исходящие: {totals['count_out']}\n"
+        f"💵 Получено: {totals['total_in']:.{digits}f} {symbol}\n"
+        f"💸 Отправлено: {totals['total_out']:.{digits}f} {symbol}\n\n"
+        f"💰 Текущий баланс:\n"
+        f"🔷 ETH: {format_balance(eth_balance, 4)}\n"
+        f"💵 {symbol}: {format_balance(token_balance, digits)}"
+    )
 
-def process_eth_request(chat_id, wallet_address, start_timestamp, end_timestamp, period_str, message_id=None):
+def get_report_cache_key(wallet_address, token, start_timestamp, end_timestamp, period_str, report_format,
+                         sources=None):
+    """Ключ готового отчета: период и набор попавших в него транзакций.
+
+    Пока у кошелька не появилось новых транзакций в периоде, ключ не меняется
+    и отчет можно переотправить по file_id. sources перечисляет потоки
+    истории отчета, по умолчанию сам token. None, если транзакций нет.
+    """
+    summaries = [
+        db.get_period_summary(wallet_address, source, start_timestamp, end_timestamp)
+        for source in sources or (token,)
+    ]
+    if not any(count for count, _, _ in summaries):
+        return None
+    summary = ':'.join(f"{first_block}:{last_block}:{count}" for count, first_block, last_block in summaries)
+    return f"{wallet_address.lower()}:{token}:{report_format}:{period_str}:{summary}"
+
+def get_time_bounds(wallets, sources, start_timestamp, end_timestamp):
+    """Время первой и последней транзакции периода по всем кошелькам и потокам; (None, None), если их нет"""
+    bounds = [
+        db.get_time_bounds(wallet, source, start_timestamp, end_timestamp)
+        for wallet in wallets
+        for source in sources
+    ]
+    bounds = [(first, last) for first, last in bounds if first]
+    if not bounds:
+        return None, None
+    return min(first for first, _ in bounds), max(last for _, last in bounds)
+
+def send_report(chat_id, message_id, ready_text, document, caption, filename=None):
+    """Отправляет файл отчета и возвращает его file_id в Telegram"""
+    if message_id:
+        bot.edit_message_text(ready_text, chat_id, message_id)
+    with metrics.timer('report_stage_seconds', stage='upload', cached=str(filename is None).lower()):
+        message = bot.send_document(chat_id, document, caption=caption, visible_file_name=filename)
+    return message.document.file_id
+
+def fetch_upstream(calls, required, pool=None):
+    """Параллельные запросы отчета (fan_out) с замером времени"""
+    with metrics.timer('report_stage_seconds', stage='upstream'):
+        return fan_out(calls, REPORT_DEADLINE, required=required, pool=pool)
+
+def get_cached_report(cache_key):
+    """Готовый отчет из кэша или None, с учетом попаданий в метриках"""
+    cached = db.get_cached_report(cache_key, REPORT_CACHE_TTL) if cache_key else None
+    metrics.inc('cache_requests_total', cache='reports', result='hit' if cached else 'miss')
+    return cached
+
+def process_eth_request(chat_id, wallet_address, start_timestamp, end_timestamp, period_str, message_id=None, report_format=DEFAULT_FORMAT):
     try:
-        eth = Etherscan(API_KEY)
-        txs = eth.get_normal_txs_by_address(
-            address=wallet_address,
-            startblock=0,
-            endblock=99999999,
-            sort='asc'
+        eth = eth_client
+        # Обычные и внутренние транзакции, курс и балансы друг от друга не зависят: запрашиваем их одновременно
+        upstream = fetch_upstream({
+            **get_timeline_calls(eth, db, wallet_address, start_timestamp, end_timestamp),
+            'eth_price': get_eth_price,
+            'eth_balance': lambda: eth.get_eth_balance(wallet_address),
+            'usdt_balance': lambda: get_token_balance(eth, db, 'usdt', wallet_address)
+        }, required=ETH_SOURCES)
+        txs = eth_transfers(merge_timeline(upstream))
+        eth_balance, usdt_balance = read_balances(upstream)
+        
+        cache_key = get_report_cache_key(
+            wallet_address, 'eth', start_timestamp, end_timestamp, period_str, report_format, ETH_SOURCES
         )
+        cached = get_cached_report(cache_key)
+        if cached:
+            file_id, totals = cached
+            send_report(
+                chat_id, message_id, "✅ Отчет по ETH транзакциям готов",
+                file_id, format_eth_caption(period_str, totals, eth_balance, usdt_balance)
+            )
+            bot.send_message(
+                ADMIN_ID,
+                f"✅ Отчет ETH успешно отправлен из кэша\n"
+                f"📅 Период: {period_str}"
+            )
+            return
         
-        if start_timestamp or end_timestamp:
-            txs = [
-                tx for tx in txs 
-                if (not start_timestamp or int(tx['timeStamp']) >= start_timestamp) and
-                   (not end_timestamp or int(tx['timeStamp']) <= end_timestamp)
-            ]
-            
-        if txs:
-            eth_price = get_eth_usd_price()
-            if eth_price is None:
-                eth_price = 0  # Значение по умолчанию для ETH отчета
-                
-            processed_txs = process_transactions(txs, wallet_address, eth_price)
-            
-            filename = f"{wallet_address}_ETH_{period_str.replace(' ', '_')}.csv"
-            file_path = save_to_csv(processed_txs, filename)
+        eth_price = upstream['eth_price']
+        if eth_price is None:
+            eth_price = 0  # Значение по умолчанию для ETH отчета
             
-            eth_balance = float(eth.get_eth_balance(wallet_address)) / 10**18
-            usdt_balance = get_usdt_balance(eth, wallet_address)
+        first_timestamp, last_timestamp = get_time_bounds([wallet_address], ETH_SOURCES, start_timestamp, end_timestamp)
+        daily_prices = {}
+        if first_timestamp:
+            daily_prices = get_daily_prices(db, 'ethereum', first_timestamp, last_timestamp)
             
-            incoming_txs = sum(1 for tx in processed_txs if tx['Amount In (ETH)'] > 0)
-            outgoing_txs = sum(1 for tx in processed_txs if tx['Amount Out (ETH)'] > 0)
-            total_in = sum(tx['Amount In (ETH)'] for tx in processed_txs)
-            total_out = sum(tx['Amount Out (ETH)'] for tx in processed_txs)
-            total_fees = sum(tx['Fee (ETH)'] for tx in processed_txs)
+        stats = EthAggregator(wallet_address)
+        processed_txs = get_eth_report_rows(txs, stats, wallet_address, eth_price, daily_prices)
+        
+        report = build_eth_report(processed_txs, report_format)
             
-            with open(file_path, 'rb') as file:
-                if message_id:
-                    bot.edit_message_text(
-                        f"✅ Отчет по ETH транзакциям готов",
-                        chat_id,
-                        message_id
-                    )
-                bot.send_document(
-                    chat_id,
-                    file,
-                    caption=(
-                        f"📊 Отчет по ETH транзакциям\n"
-                        f"📅 Период: {period_str}\n\n"
-                        f"📥 Входящие: {incoming_txs}\n"
-                        f"📤 Исходящие: {outgoing_txs}\n"
-                        f"💵 Получено: {total_in:.4f} ETH\n"
-                        f"💸 Отправлено: {total_out:.4f} ETH\n"
-                        f"🏷 Комиссии: {total_fees:.4f} ETH\n\n"
-                        f"💰 Текущий баланс:\n"
-                        f"🔷 ETH: {eth_balance:.4f}\n"
-                        f"💵 USDT: {usdt_balance:.2f}"
-                    )
+        if stats.count:
+            totals = stats.as_dict()
+            with report:
+                file_id = send_report(
+                    chat_id, message_id, "✅ Отчет по ETH транзакциям готов",
+                    report, format_eth_caption(period_str, totals, eth_balance, usdt_balance),
+                    get_report_filename(wallet_address, 'eth', period_str, report_format)
                 )
                 
-            os.remove(file_path)
+            if cache_key:
+                db.save_cached_report(cache_key, file_id, totals)
             
             bot.send_message(
                 ADMIN_ID,
@@ -211,6 +383,7 @@ def process_eth_request(chat_id, wallet_address, start_timestamp, end_timestamp,
             )
             
         else:
+            report.close()
             if message_id:
                 bot.edit_message_text("❌ ETH транзакции не найдены", chat_id, message_id)
             else:
@@ -230,72 +403,65 @@ def process_eth_request(chat_id, wallet_address, start_timestamp, end_timestamp,
             f"⚠️ Ошибка: {str(e)}"
         )
 
-def process_usdt_request(chat_id, wallet_address, start_timestamp, end_timestamp, period_str, message_id=None):
+def process_token_request(token, chat_id, wallet_address, start_timestamp, end_timestamp, period_str, message_id=None, report_format=DEFAULT_FORMAT):
     try:
-        eth = Etherscan(API_KEY)
-        print(f"\n🔍 Запрашиваем USDT транзакции для адреса: {wallet_address}")
+        eth = eth_client
+        token_info = get_token_info(db, token)
+        symbol = token_info.symbol
+        print(f"\n🔍 Запрашиваем {symbol} транзакции для адреса: {wallet_address}")
         print(f"📅 Период: с {start_timestamp if start_timestamp else 'начала'} по {end_timestamp if end_timestamp else 'сейчас'}")
         
-        processed_txs = process_usdt_transactions(eth, wallet_address, start_timestamp, end_timestamp)
-        print(f"📝 Получено транзакций: {len(processed_txs)}")
+        calls = {
+            'txs': lambda: get_token_history(eth, db, wallet_address, token, start_timestamp, end_timestamp),
+            'eth_balance': lambda: eth.get_eth_balance(wallet_address),
+            'token_balance': lambda: get_token_balance(eth, db, token, wallet_address)
+        }
+        if token == 'usdt':
+            calls['usdt_price'] = get_usdt_price
+        upstream = fetch_upstream(calls, required=('txs',))
+        txs = upstream['txs']
+        eth_balance = upstream['eth_balance']
+        if eth_balance is not None:
+            eth_balance = float(eth_balance) / 10**18
+        token_balance = upstream['token_balance']
         
-        if processed_txs:
-            usdt_price = get_usdt_price()
-            print(f"💵 Текущий курс USDT: ${usdt_price}")
-            
-            csv_transactions = [{
-                'Blockno': tx.get('blockNumber', ''),
-                'UnixTimestamp': tx['timestamp'],
-                'DateTime': tx['date'],
-                'From': tx['from'],
-                'To': tx['to'],
-                'Transaction Hash': tx['hash'],
-                'TokenValue': -tx['amount'] if tx['from'].lower() == wallet_address.lower() else tx['amount'],
-                'ContractAddress': USDT_CONTRACT,
-                'TokenName': 'Tether USD',
-                'TokenSymbol': 'USDT'
-            } for tx in processed_txs]
-            
-            filename = f"{wallet_address}_USDT_{period_str.replace(' ', '_')}.csv"
-            file_path = save_usdt_to_csv(csv_transactions, filename)
-            
-            eth_balance = float(eth.get_eth_balance(wallet_address)) / 10**18
-            usdt_balance = get_usdt_balance(eth, wallet_address)
-            
-            incoming_txs = sum(1 for tx in processed_txs if tx['type'] == 'in')
-            outgoing_txs = sum(1 for tx in processed_txs if tx['type'] == 'out')
-            total_received = sum(tx['amount'] for tx in processed_txs if tx['type'] == 'in')
-            total_sent = sum(tx['amount'] for tx in processed_txs if tx['type'] == 'out')
+        cache_key = get_report_cache_key(wallet_address, token, start_timestamp, end_timestamp, period_str, report_format)
+        cached = get_cached_report(cache_key)
+        if cached:
+            print("📦 Отчет найден в кэше, отправляем по file_id")
+            file_id, totals = cached
+            send_report(
+                chat_id, message_id, f"✅ Отчет по {symbol} транзакциям готов",
+                file_id, format_token_caption(token_info, period_str, totals, eth_balance, token_balance)
+            )
+            return
+        
+        stats = TokenAggregator(wallet_address, token_info.decimals)
+        report_rows = get_token_report_rows(txs, stats, wallet_address, token_info)
+        
+        report = build_token_report(report_rows, report_format)
+        print(f"📝 Получено транзакций: {stats.count}")
+        
+        if stats.count:
+            if token == 'usdt':
+                print(f"💵 Текущий курс USDT: ${upstream['usdt_price']}")
             
-            with open(file_path, 'rb') as file:
-                if message_id:
-                    bot.edit_message_text(
-                        f"✅ Отчет по USDT транзакциям готов",
-                        chat_id,
-                        message_id
-                    )
-                bot.send_document(
-                    chat_id,
-                    file,
-                    caption=(
-                        f"📊 Отчет по USDT транзакциям\n"
-                        f"📅 Период: {period_str}\n\n"
-                        f"📥 Входящие: {incoming_txs}\n"
-                        f"📤 Исходящие: {outgoing_txs}\n"
-                        f"💵 Получено: {total_received:.2f} USDT\n"
-                        f"💸 Отправлено: {total_sent:.2f} USDT\n\n"
-                        f"💰 Текущий баланс:\n"
-                        f"🔷 ETH: {eth_balance:.4f}\n"
-                        f"💵 USDT: {usdt_balance:.2f}"
-                    )
+            totals = stats.as_dict()
+            with report:
+                file_id = send_report(
+                    chat_id, message_id, f"✅ Отчет по {symbol} транзакциям готов",
+                    report, format_token_caption(token_info, period_str, totals, eth_balance, token_balance),
+                    get_report_filename(wallet_address, token, period_str, report_format)
                 )
                 
-            os.remove(file_path)
+            if cache_key:
+                db.save_cached_report(cache_key, file_id, totals)
         else:
+            report.close()
             if message_id:
-                bot.edit_message_text("❌ USDT транзакции не найдены", chat_id, message_id)
+                bot.edit_message_text(f"❌ {symbol} транзакции не найдены", chat_id, message_id)
             else:
-                bot.send_message(chat_id, "❌ USDT транзакции не найдены")
+                bot.send_message(chat_id, f"❌ {symbol} транзакции не найдены")
         
     except Exception as e:
         error_msg = f"❌ Ошибка при формировании отчета: {str(e)}"
@@ -304,19 +470,182 @@ def process_usdt_request(chat_id, wallet_address, start_timestamp, end_timestamp
         else:
             bot.send_message(chat_id, error_msg)
 
+process_usdt_request = functools.partial(process_token_request, 'usdt')
+
+def format_portfolio_caption(token_type, period_str, wallets_count, totals, eth_balance, usdt_balance, missing=()):
+    """Подпись к сводному отчету по кошелькам портфеля; missing - кошельки без баланса"""
+    if token_type == 'eth':
+        unit, digits = 'ETH', 4
+    else:
+        unit, digits = 'USDT', 2
+    caption = (
+        f"📊 Сводный отчет по {unit} транзакциям\n"
+        f"💼 Кошельков: {wallets_count}\n"
+        f"📅 Период: {period_str}\n\n"
+        f"📥 Входящие: {totals['count_in']}\n"
+        f"📤 Исходящие: {totals['count_out']}\n"
+        f"💵 Получено: {totals['total_in']:.{digits}f} {unit}\n"
+        f"💸 Отправлено: {totals['total_out']:.{digits}f} {unit}\n"
+    )
+    if token_type == 'eth':
+        caption += f"🏷 Комиссии: {totals['total_fee']:.4f} ETH\n"
+    return caption + (
+        f"\n💰 Текущий баланс портфеля:\n"
+        f"🔷 ETH: {format_balance(eth_balance, 4)}\n"
+        f"💵 USDT: {format_balance(usdt_balance, 2)}"
+    ) + format_missing_wallets(missing)
+
+def sum_totals(aggregators):
+    """Итоги портфеля: сумма итогов по кошелькам"""
+    totals = dict.fromkeys(('total_in', 'total_out', 'total_fee', 'count_in', 'count_out'), 0)
+    for stats in aggregators:
+        for name, value in stats.as_dict().items():
+            totals[name] += value
+    return totals
+
+def process_portfolio_request(token_type, chat_id, wallets, start_timestamp, end_timestamp, period_str, message_id=None, report_format=DEFAULT_FORMAT):
+    """Сводный отчет по всем кошелькам портфеля: один файл с колонкой Wallet.
+
+    wallets приходит из очереди строкой адресов через запятую.
+    """
+    try:
+        eth = eth_client
+        wallets = wallets.split(',')
+        # Истории кошельков грузятся в пуле портфеля, не больше HISTORY_WORKERS одновременно
+        if token_type == 'eth':
+            calls = {
+                (wallet, kind): call
+                for wallet in wallets
+                for kind, call in get_timeline_calls(eth, db, wallet, start_timestamp, end_timestamp).items()
+            }
+        else:
+            calls = {
+                wallet: (lambda wallet=wallet: get_token_history(eth, db, wallet, token_type, start_timestamp, end_timestamp))
+                for wallet in wallets
+            }
+        upstream = fetch_upstream(calls, required=tuple(calls), pool=history_pool)
+        # Балансы отдельным проходом: вложенный fan_out из задачи пула мог бы занять все его потоки
+        balances = get_portfolio_balances(eth, db, wallets, REPORT_DEADLINE)
+        eth_balance, usdt_balance = sum_balances(balances)
+        missing = get_missing_wallets(balances)
+
+        if token_type == 'eth':
+            eth_price = get_eth_price() or 0
+            first_timestamp, last_timestamp = get_time_bounds(wallets, ETH_SOURCES, start_timestamp, end_timestamp)
+            daily_prices = {}
+            if first_timestamp:
+                daily_prices = get_daily_prices(db, 'ethereum', first_timestamp, last_timestamp)
+            aggregators = [EthAggregator(wallet) for wallet in wallets]
+
+            def wallet_rows(wallet, stats):
+                return get_eth_report_rows(
+                    eth_transfers(merge_timeline({kind: upstream[(wallet, kind)] for kind in ETH_SOURCES})),
+                    stats, wallet, eth_price, daily_prices
+                )
+            fieldnames, float_columns = ETH_REPORT_FIELDS, ETH_FLOAT_FIELDS
+        else:
+            token_info = get_token_info(db, token_type)
+            aggregators = [TokenAggregator(wallet, token_info.decimals) for wallet in wallets]
+
+            def wallet_rows(wallet, stats):
+                return get_token_report_rows(upstream[wallet], stats, wallet, token_info)
+            fieldnames, float_columns = TOKEN_REPORT_FIELDS, TOKEN_FLOAT_FIELDS
+
+        # Строки кошелька начинают строиться, только когда до него доходит запись
+        # отчета: иначе split_large держал бы начало истории всех кошельков сразу
+        report_rows = itertools.chain.from_iterable(
+            ((wallet,) + row for row in wallet_rows(wallet, stats)) for wallet, stats in zip(wallets, aggregators)
+        )
+        report = build_report(report_rows, ['Wallet'] + list(fieldnames), report_format, float_columns)
+
+        totals = sum_totals(aggregators)
+        if totals['count_in'] + totals['count_out']:
+            with report:
+                send_report(
+                    chat_id, message_id, f"✅ Сводный отчет по {token_type.upper()} транзакциям готов",
+                    report,
+                    format_portfolio_caption(
+                        token_type, period_str, len(wallets), totals, eth_balance, usdt_balance, missing
+                    ),
+                    get_report_filename('portfolio', token_type, period_str, report_format)
+                )
+        else:
+            report.close()
+            if message_id:
+                bot.edit_message_text(f"❌ {token_type.upper()} транзакции не найдены", chat_id, message_id)
+            else:
+                bot.send_message(chat_id, f"❌ {token_type.upper()} транзакции не найдены")
+
+    except Exception as e:
+        error_msg = f"❌ Ошибка при формировании сводного отчета: {str(e)}"
+        if message_id:
+            bot.edit_message_text(error_msg, chat_id, message_id)
+        else:
+            bot.send_message(chat_id, error_msg)
+
+def send_profile(job, profiler):
+    """Отправляет администратору профиль выполненной задачи"""
+    title = f"задача #{job.id} {job.token_type.upper()} {job.period_str} ({job.status})"
+    # Сообщение Telegram ограничено 4096 символами, полный отчет pstats уходит файлом
+    bot.send_message(ADMIN_ID, profiler.summary(title)[:3900])
+    bot.send_document(
+        ADMIN_ID,
+        io.BytesIO(profiler.details().encode()),
+        visible_file_name=f"profile_{job.id}.txt"
+    )
+
 def signal_handler(signal, frame):
-    """Обработчик сигнала Ctrl+C"""
-    print('\n⚠️ Получен сигнал Ctrl+C, завершаю работу...')
+    """Обработчик сигналов Ctrl+C и SIGTERM (перезапуск при деплое)"""
+    print('\n⚠️ Получен сигнал завершения, завершаю работу...')
     bot.stop_polling()
+    try:
+        save_snapshot(CACHE_SNAPSHOT, eth_client)
+    except Exception as e:
+        print(f"Ошибка при сохранении снимка кэшей: {str(e)}")
+    db.close()
     sys.exit(0)
 
 def main():
+    # Без публичного адреса Telegram некуда слать обновления: проверяем до запуска фоновых задач
+    if BOT_MODE == 'webhook' and not os.getenv('WEBHOOK_URL'):
+        print("❌ BOT_MODE=webhook требует WEBHOOK_URL: публичный https-адрес бота")
+        sys.exit(1)
+        
     try:
-        # Регистрируем обработчик Ctrl+C
+        # Регистрируем обработчик Ctrl+C и остановки процесса
         signal.signal(signal.SIGINT, signal_handler)
+        signal.signal(signal.SIGTERM, signal_handler)
+        
+        # Теплый старт: кэши из снимка прошлого запуска, затем фоновая догрузка кошельков
+        load_snapshot(CACHE_SNAPSHOT, eth_client)
+        if PREWARM_WALLETS > 0:
+            start_prewarm(eth_client, db, PREWARM_WALLETS)
+        
+        # Отчеты формируются в фоновых потоках, чтобы не блокировать обработку обновлений
+        scheduler = ReportScheduler(
+            {
+                'eth': process_eth_request,
+                **{token: functools.partial(process_token_request, token) for token in KNOWN_TOKENS},
+                'portfolio_eth': functools.partial(process_portfolio_request, 'eth'),
+                'portfolio_usdt': functools.partial(process_portfolio_request, 'usdt')
+            },
+            workers=int(os.getenv('REPORT_WORKERS', '4')),
+            max_queue=int(os.getenv('REPORT_QUEUE_SIZE', '100')),
+            # PROFILE_REPORTS=1 профилирует все отчеты, /profile - только отчеты администратора
+            profile_all=os.getenv('PROFILE_REPORTS', '') == '1',
+            on_profile=send_profile if ADMIN_ID else None
+        )
         
         # Регистрируем обработчики команд
-        register_command_handlers(bot, API_KEY, db)
+        register_command_handlers(bot, eth_client, db, scheduler, REPORT_DEADLINE, ADMIN_ID)
+        
+        # Уведомления подписчикам о новых переводах их кошельков
+        if WATCH_INTERVAL > 0:
+            WalletWatcher(eth_client, db, bot.send_message, interval=WATCH_INTERVAL).start()
+        
+        # Метрики в формате Prometheus, если задан порт
+        if os.getenv('METRICS_PORT'):
+            start_metrics_server(os.getenv('METRICS_HOST', '127.0.0.1'), int(os.getenv('METRICS_PORT')))
         
         # Затем регистрируем обработчик текстовых сообщений
         @bot.message_handler(func=lambda message: True)
@@ -328,7 +657,7 @@ def main():
             user_state = db.get_user_state(chat_id)
             
             if user_state == 'waiting_period':
-                process_custom_period(bot, message, db)
+                process_custom_period(bot, message, db, scheduler)
                 return
                 
             text = message.text.strip() if message.text else ""
@@ -355,14 +684,14 @@ def main():
                     )
                     
                     try:
-                        eth_balance, usdt_balance = get_wallet_balances_at_date(eth_client, wallet, target_date)
+                        eth_balance, usdt_balance = get_wallet_balances_at_date(eth_client, db, wallet, target_date)
                         
-                        if eth_balance is not None and usdt_balance is not None:
+                        if eth_balance is not None:
                             response = (
                                 f"💰 Баланс кошелька на {text}\n"
                                 f"{wallet}:\n\n"
                                 f"🔷 ETH: {eth_balance:.4f}\n"
-                                f"💵 USDT: {usdt_balance:.2f}"
+                                f"💵 USDT: {format_balance(usdt_balance, 2)}"
                             )
                         else:
                             response = "❌ Ошибка при получении баланса"
@@ -401,9 +730,23 @@ def main():
         # И в конце регистрируем обработчик callback'ов
         @bot.callback_query_handler(func=lambda call: True)
         def callback_handler(call):
-            handle_callback(bot, call, db)
+            handle_callback(bot, call, db, scheduler)
             
-        bot.infinity_polling(skip_pending=True)
+        if BOT_MODE == 'webhook':
+            run_webhook(
+                bot,
+                os.getenv('WEBHOOK_URL'),
+                host=os.getenv('WEBHOOK_HOST', '0.0.0.0'),
+                port=int(os.getenv('WEBHOOK_PORT', os.getenv('PORT', '8443'))),
+                path=os.getenv('WEBHOOK_PATH', '/webhook'),
+                secret_token=os.getenv('WEBHOOK_SECRET'),
+                workers=int(os.getenv('WEBHOOK_WORKERS', '8')),
+                max_pending=int(os.getenv('WEBHOOK_QUEUE_SIZE', '256'))
+            )
+        else:
+            # Webhook, оставшийся от запуска в другом режиме, не дает получать обновления
+            bot.remove_webhook()
+            bot.infinity_polling(skip_pending=True)
         
     except Exception as e:
         print(f"Ошибка при запуске бота: {str(e)}")
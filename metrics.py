@@ -0,0 +1,191 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Границы корзин гистограмм времени, в секундах
+TIMER_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in items) + '}'
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(TIMER_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(TIMER_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+
+    def quantile(self, q):
+        """Оценка квантиля по корзинам: верхняя граница корзины, куда он попал"""
+        rank = q * self.count
+        for bound, count in zip(TIMER_BUCKETS, self.buckets):
+            if count >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    """Счетчики, таймеры и показатели процесса в текстовом формате Prometheus.
+
+    Метрика задается именем и метками. Таймеры хранятся гистограммами,
+    показатели (gauge) считаются функциями в момент выгрузки.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+        self.gauges = {}
+        self.started_at = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.timers.get(key)
+            if histogram is None:
+                histogram = self.timers[key] = _Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Замеряет время блока; при исключении добавляет метку error"""
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(name, time.perf_counter() - started, **labels, error='1')
+            raise
+        self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name, **labels):
+        """Декоратор: замеряет время вызова, по умолчанию с меткой function"""
+        def decorator(func):
+            func_labels = labels or {'function': func.__name__}
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, **func_labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def gauge(self, name, read, **labels):
+        """Регистрирует показатель, значение которого вернет read() при выгрузке"""
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = read
+
+    def _read_gauges(self):
+        with self.lock:
+            gauges = list(self.gauges.items())
+        values = []
+        for key, read in gauges:
+            try:
+                values.append((key, float(read())))
+            except Exception:
+                continue
+        return values
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            timers = sorted(
+                ((key, (list(h.buckets), h.count, h.sum)) for key, h in self.timers.items()),
+                key=lambda item: item[0]
+            )
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            declare(name, 'counter')
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+        for (name, labels), (buckets, count, total) in timers:
+            declare(name, 'histogram')
+            for bound, bucket in zip(TIMER_BUCKETS, buckets):
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {bucket}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        for (name, labels), value in sorted(self._read_gauges()):
+            declare(name, 'gauge')
+            lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        declare('process_uptime_seconds', 'gauge')
+        lines.append(f"process_uptime_seconds {time.time() - self.started_at:.0f}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Краткая сводка для администратора в Telegram"""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            timers = sorted(
+                ((key, h.count, h.sum, h.quantile(0.95), h.max) for key, h in self.timers.items()),
+                key=lambda item: item[0]
+            )
+        lines = [f"⏱ Аптайм: {(time.time() - self.started_at) / 3600:.1f} ч", "", "⏳ Время (число, среднее, p95, максимум):"]
+        for (name, labels), count, total, p95, peak in timers:
+            lines.append(
+                f"{name}{_format_labels(labels)}: {count}, "
+                f"{total / count * 1000:.0f} мс, {p95 * 1000:.0f} мс, {peak * 1000:.0f} мс"
+            )
+        lines += ["", "🔢 Счетчики:"]
+        lines += [f"{name}{_format_labels(labels)}: {value}" for (name, labels), value in counters]
+        lines += ["", "📈 Показатели:"]
+        lines += [f"{name}{_format_labels(labels)}: {value:g}" for (name, labels), value in sorted(self._read_gauges())]
+        return '\n'.join(lines)
+
+
+metrics = Metrics()
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+def start_metrics_server(host='127.0.0.1', port=9100, registry=metrics):
+    """Отдает метрики по GET /metrics в фоновом потоке"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = _HTTPServer((host, port), Handler)
+    threading.Thread(target=httpd.serve_forever, name='metrics-http', daemon=True).start()
+    print(f"📈 Метрики доступны на http://{host}:{httpd.server_address[1]}/metrics")
+    return httpd
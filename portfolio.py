@@ -0,0 +1,72 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+from etherscan_api import BALANCE_BATCH_SIZE
+from fanout import fan_out
+from usdt_handler import get_usdt_balance
+
+# Сколько кошельков можно держать в портфеле одного чата
+MAX_PORTFOLIO_WALLETS = 50
+# Истории кошельков портфеля синхронизируются в своем небольшом пуле: иначе
+# полные загрузки заняли бы общий пул fan_out, и курсы и балансы других
+# отчетов не укладывались бы в срок
+HISTORY_WORKERS = 4
+history_pool = ThreadPoolExecutor(max_workers=HISTORY_WORKERS, thread_name_prefix='portfolio')
+# Запас на задержку сети и чужие запросы под тем же лимитом частоты
+BALANCE_DEADLINE_MARGIN = 1.5
+# Сколько кошельков без баланса перечислять в подписи
+MISSING_WALLETS_SHOWN = 5
+
+
+def get_balances_deadline(eth_client, wallets_count, deadline):
+    """Срок на балансы портфеля: не меньше, чем займут все запросы под лимитом частоты клиента.
+
+    USDT запрашивается по одному кошельку, поэтому при 5 запросах в секунду
+    50 кошельков заняли бы почти весь обычный срок отчета.
+    """
+    requests = wallets_count + math.ceil(wallets_count / BALANCE_BATCH_SIZE)
+    return max(deadline, requests / eth_client.rate_limiter.rate * BALANCE_DEADLINE_MARGIN)
+
+
+def get_portfolio_balances(eth_client, db, wallets, deadline):
+    """Балансы кошельков портфеля: {кошелек: (eth, usdt)}, None, если не получен.
+
+    ETH запрашивается через balancemulti по 20 адресов за вызов, USDT
+    параллельно по кошелькам под общим лимитом запросов клиента. Срок
+    растягивается под число кошельков (см. get_balances_deadline).
+    """
+    calls = {('usdt', wallet): (lambda wallet=wallet: get_usdt_balance(eth_client, db, wallet)) for wallet in wallets}
+    calls['eth'] = lambda: eth_client.get_eth_balances(wallets)
+    results = fan_out(calls, get_balances_deadline(eth_client, len(wallets), deadline))
+
+    eth_balances = results['eth'] or {}
+    return {
+        wallet: (
+            float(eth_balances[wallet]) / 10**18 if wallet in eth_balances else None,
+            results[('usdt', wallet)]
+        )
+        for wallet in wallets
+    }
+
+
+def sum_balances(balances):
+    """Итоговые балансы портфеля (eth, usdt) по полученным; None, если не получен ни один"""
+    totals = []
+    for index in (0, 1):
+        values = [balance[index] for balance in balances.values() if balance[index] is not None]
+        totals.append(sum(values) if values else None)
+    return tuple(totals)
+
+
+def get_missing_wallets(balances):
+    """Кошельки, у которых не получен хотя бы один баланс"""
+    return [wallet for wallet, balance in balances.items() if None in balance]
+
+
+def format_missing_wallets(missing):
+    """Строка о кошельках, не вошедших в итог; пустая, если получены все"""
+    if not missing:
+        return ''
+    shown = ', '.join(f"{wallet[:6]}…{wallet[-4:]}" for wallet in missing[:MISSING_WALLETS_SHOWN])
+    if len(missing) > MISSING_WALLETS_SHOWN:
+        shown += f" и еще {len(missing) - MISSING_WALLETS_SHOWN}"
+    return f"\n⚠️ Нет баланса, в итог не вошли: {shown}"
@@ -0,0 +1,151 @@
+import threading
+import time
+from concurrent.futures import Future
+import requests
+from metrics import metrics
+
+COINGECKO_PRICE_URL = 'https://api.coingecko.com/api/v3/simple/price'
+COINGECKO_RANGE_URL = 'https://api.coingecko.com/api/v3/coins/{coin_id}/market_chart/range'
+SECONDS_PER_DAY = 86400
+
+
+class PriceService:
+    """Текущие курсы CoinGecko с кэшем в памяти процесса.
+
+    Свежий курс (моложе ttl) отдается из кэша. Устаревший, но не старше
+    stale_ttl, тоже отдается сразу, а обновление запускается в фоне.
+    Одновременные запросы одной монеты ждут один общий запрос к CoinGecko.
+    """
+
+    def __init__(self, ttl=60, stale_ttl=900, timeout=5):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.cache = {}
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def get_price(self, coin_id):
+        """Курс монеты в USD или None, если его не удалось получить"""
+        entry = self.cache.get(coin_id)
+        if entry:
+            price, fetched_at = entry
+            age = time.time() - fetched_at
+            if age < self.ttl:
+                metrics.inc('cache_requests_total', cache='prices', result='hit')
+                return price
+            if age < self.stale_ttl:
+                metrics.inc('cache_requests_total', cache='prices', result='stale')
+                self._refresh(coin_id, wait=False)
+                return price
+
+        metrics.inc('cache_requests_total', cache='prices', result='miss')
+        try:
+            return self._refresh(coin_id, wait=True)
+        except Exception as e:
+            print(f"Ошибка при получении курса {coin_id}: {str(e)}")
+            return entry[0] if entry else None
+
+    def _refresh(self, coin_id, wait):
+        with self.lock:
+            future = self.in_flight.get(coin_id)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.in_flight[coin_id] = future
+
+        if leader:
+            if wait:
+                self._fetch(coin_id, future)
+            else:
+                threading.Thread(target=self._fetch, args=(coin_id, future), daemon=True).start()
+        if wait:
+            return future.result(timeout=self.timeout * 2)
+
+    def get_daily_prices(self, db, coin_id, start_timestamp, end_timestamp):
+        """Дневные курсы монеты за период: {номер дня UTC: курс}.
+
+        Недостающие дни запрашиваются у CoinGecko одним запросом на весь
+        диапазон и сохраняются в базе, где их переиспользуют все пользователи.
+        Текущий день не сохраняется: для него берется текущий курс.
+        """
+        start_day = int(start_timestamp) // SECONDS_PER_DAY
+        end_day = int(end_timestamp) // SECONDS_PER_DAY
+        last_closed_day = int(time.time()) // SECONDS_PER_DAY - 1
+
+        prices = db.get_daily_prices(coin_id, start_day, end_day)
+        missing = [day for day in range(start_day, min(end_day, last_closed_day) + 1) if day not in prices]
+        metrics.inc('cache_requests_total', cache='daily_prices', result='miss' if missing else 'hit')
+        if missing:
+            try:
+                fetched = self._fetch_daily_range(coin_id, missing[0], missing[-1])
+                fetched = {day: price for day, price in fetched.items() if day <= last_closed_day}
+                db.save_daily_prices(coin_id, fetched)
+                prices.update(fetched)
+            except Exception as e:
+                print(f"Ошибка при получении истории курса {coin_id}: {str(e)}")
+        return prices
+
+    @metrics.timed('coingecko_request_seconds', endpoint='market_chart_range')
+    def _fetch_daily_range(self, coin_id, first_day, last_day):
+        response = self.session.get(
+            COINGECKO_RANGE_URL.format(coin_id=coin_id),
+            params={
+                'vs_currency': 'usd',
+                'from': first_day * SECONDS_PER_DAY,
+                'to': (last_day + 1) * SECONDS_PER_DAY
+            },
+            timeout=self.timeout * 3
+        )
+        points = response.json()['prices']
+
+        # На коротких диапазонах CoinGecko отдает почасовые точки: берем первую за день
+        daily = {}
+        for timestamp_ms, price in points:
+            daily.setdefault(int(timestamp_ms) // 1000 // SECONDS_PER_DAY, float(price))
+
+        # Дни без точки заполняем курсом предыдущего дня
+        filled = {}
+        previous = None
+        for day in range(first_day, last_day + 1):
+            previous = daily.get(day, previous)
+            if previous is not None:
+                filled[day] = previous
+        return filled
+
+    def _fetch(self, coin_id, future):
+        try:
+            with metrics.timer('coingecko_request_seconds', endpoint='simple_price'):
+                response = self.session.get(
+                    COINGECKO_PRICE_URL,
+                    params={'ids': coin_id, 'vs_currencies': 'usd'},
+                    timeout=self.timeout
+                )
+                price = float(response.json()[coin_id]['usd'])
+            self.cache[coin_id] = (price, time.time())
+            future.set_result(price)
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                self.in_flight.pop(coin_id, None)
+
+
+price_service = PriceService()
+
+
+def get_eth_price():
+    """Текущий курс ETH в USD или None"""
+    return price_service.get_price('ethereum')
+
+
+def get_daily_prices(db, coin_id, start_timestamp, end_timestamp):
+    """Дневные курсы монеты за период: {номер дня UTC: курс}"""
+    return price_service.get_daily_prices(db, coin_id, start_timestamp, end_timestamp)
+
+
+def get_usdt_price():
+    """Текущий курс USDT в USD, при ошибке считаем его равным 1"""
+    price = price_service.get_price('tether')
+    return price if price is not None else 1
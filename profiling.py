@@ -0,0 +1,118 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+# Сколько функций показывать в сводке для администратора
+TOP_FUNCTIONS = 10
+# Сколько функций выводить в полном отчете
+DETAILED_FUNCTIONS = 40
+
+_local = threading.local()
+# tracemalloc общий на процесс: включен, пока идет хоть одна профилируемая задача
+_tracing = 0
+_tracing_lock = threading.Lock()
+
+
+def wrap(call):
+    """Профилирует вызов в чужом потоке, если текущий поток сейчас профилируется.
+
+    Так в профиль задачи попадает работа, которую она отдает пулу fan_out.
+    """
+    profiles = getattr(_local, 'profiles', None)
+    if profiles is None:
+        return call
+
+    def profiled(*args, **kwargs):
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(call, *args, **kwargs)
+        finally:
+            profiles.append(profile)
+    return profiled
+
+
+def _start_tracing():
+    global _tracing
+    with _tracing_lock:
+        if _tracing == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracing += 1
+        tracemalloc.reset_peak()
+
+
+def _stop_tracing():
+    global _tracing
+    with _tracing_lock:
+        peak = tracemalloc.get_traced_memory()[1]
+        _tracing -= 1
+        if _tracing == 0:
+            tracemalloc.stop()
+    return peak
+
+
+def _function_name(key):
+    filename, line, name = key
+    if filename == '~':
+        return name
+    return f"{os.path.basename(filename)}:{line}({name})"
+
+
+class Profiler:
+    """Профиль одной задачи: время по функциям (cProfile) и пик памяти (tracemalloc).
+
+    Пик памяти общий для процесса: если параллельно шли другие отчеты,
+    их выделения в него тоже попадут.
+    """
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.profiles = []
+        self.seconds = None
+        self.peak_bytes = None
+
+    def __enter__(self):
+        _start_tracing()
+        _local.profiles = self.profiles
+        self.started = time.perf_counter()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.disable()
+        self.seconds = time.perf_counter() - self.started
+        _local.profiles = None
+        self.peak_bytes = _stop_tracing()
+        return False
+
+    def stats(self, stream=None):
+        stats = pstats.Stats(self.profile, stream=stream)
+        for profile in self.profiles:
+            stats.add(profile)
+        return stats
+
+    def summary(self, title, limit=TOP_FUNCTIONS):
+        """Короткая сводка: время, пик памяти и функции с наибольшим собственным временем"""
+        stats = self.stats().stats
+        top = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+        lines = [
+            f"🔬 Профиль: {title}",
+            f"⏱ {self.seconds:.2f} с, пик памяти {self.peak_bytes / 2**20:.1f} МБ",
+            f"🧵 Потоков fan_out в профиле: {len(self.profiles)}",
+            "",
+            "Собственное время, всего с вложенными, вызовы:"
+        ]
+        for key, (_, calls, own, total, _) in top:
+            lines.append(f"{own:.3f} с / {total:.3f} с / {calls} — {_function_name(key)}")
+        return "\n".join(lines)
+
+    def details(self, limit=DETAILED_FUNCTIONS):
+        """Полный текстовый отчет pstats: по суммарному и по собственному времени"""
+        out = io.StringIO()
+        stats = self.stats(out)
+        stats.sort_stats('cumulative').print_stats(limit)
+        stats.sort_stats('tottime').print_stats(limit)
+        return out.getvalue()
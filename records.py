@@ -0,0 +1,62 @@
+from typing import NamedTuple
+
+# Строки отчетов храним кортежами: у них нет словаря атрибутов и повторяющихся
+# строковых ключей, а порядок полей совпадает с порядком столбцов файла
+
+
+class EthReportRow(NamedTuple):
+    """Строка ETH отчета"""
+    date: str
+    sender: str
+    recipient: str
+    tx_hash: str
+    amount_in: float
+    amount_out: float
+    fee: float
+    fee_usd: float
+    current_value: float
+    general_amount: float
+    general_amount_usd: float
+
+
+ETH_REPORT_FIELDS = [
+    'Date', 'From', 'To', 'Transaction Hash', 'Amount In (ETH)',
+    'Amount Out (ETH)', 'Fee (ETH)', 'Fee (USD)', 'CurrentValue',
+    'General amount', 'General amount USD'
+]
+ETH_FLOAT_FIELDS = ETH_REPORT_FIELDS[4:]
+
+
+class TokenTransfer(NamedTuple):
+    """Перевод ERC-20 токена кошелька в единицах токена"""
+    block_number: str
+    timestamp: int
+    date: str
+    tx_hash: str
+    sender: str
+    recipient: str
+    amount: float
+    direction: str
+    fee: float
+
+
+class TokenReportRow(NamedTuple):
+    """Строка отчета по ERC-20 токену"""
+    block_number: str
+    timestamp: int
+    date: str
+    sender: str
+    recipient: str
+    tx_hash: str
+    token_value: float
+    contract_address: str
+    token_name: str
+    token_symbol: str
+
+
+TOKEN_REPORT_FIELDS = [
+    'Blockno', 'UnixTimestamp', 'DateTime', 'From', 'To',
+    'Transaction Hash', 'TokenValue',
+    'ContractAddress', 'TokenName', 'TokenSymbol'
+]
+TOKEN_FLOAT_FIELDS = ['TokenValue']
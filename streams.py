@@ -0,0 +1,43 @@
+import heapq
+
+# Внутренние транзакции (txlistinternal): ETH, пришедший или ушедший через вызовы контрактов
+INTERNAL_TOKEN = 'internal'
+# Потоки, из которых складывается ETH баланс кошелька
+ETH_SOURCES = ('eth', INTERNAL_TOKEN)
+
+
+def _block_number(item):
+    return int(item[1]['blockNumber'])
+
+
+def _tagged(kind, txs):
+    for tx in txs:
+        yield kind, tx
+
+
+def merge_by_block(streams):
+    """Лениво сливает отсортированные по блокам потоки в один: пары (вид, транзакция).
+
+    streams перечисляет пары (вид, итератор). Слияние идет через кучу, в памяти
+    держится по одной транзакции на поток. Внутри блока потоки идут в порядке
+    перечисления: внутренние транзакции следуют за вызвавшей их обычной.
+    """
+    return heapq.merge(*(_tagged(kind, txs) for kind, txs in streams), key=_block_number)
+
+
+def as_eth_transfer(kind, tx):
+    """Приводит транзакцию к виду обычной ETH транзакции.
+
+    Комиссию за внутреннюю транзакцию платит отправитель внешней, поэтому
+    gasUsed вызова в ней к кошельку не относится.
+    """
+    if kind == INTERNAL_TOKEN:
+        return {**tx, 'gasPrice': '0', 'gasUsed': '0'}
+    return tx
+
+
+def eth_transfers(timeline):
+    """ETH транзакции хронологии, обычные и внутренние, в виде обычных"""
+    for kind, tx in timeline:
+        if kind in ETH_SOURCES:
+            yield as_eth_transfer(kind, tx)
@@ -0,0 +1,50 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.offline_suite import FakeUpstreams
+from database import Database
+import etherscan_api
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Пустая база во временном каталоге"""
+    database = Database(str(tmp_path / 'test.db'))
+    yield database
+    database.close()
+
+
+@pytest.fixture(scope='session')
+def fake():
+    """Поддельные Etherscan, CoinGecko и Telegram из офлайн замеров"""
+    upstreams = FakeUpstreams()
+    yield upstreams
+    upstreams.shutdown()
+
+
+@pytest.fixture
+def eth(fake, monkeypatch):
+    """Клиент Etherscan, который ходит в поддельный сервер без ограничения частоты"""
+    monkeypatch.setattr(etherscan_api, 'API_URL', fake.url + '/api')
+    return etherscan_api.EtherscanClient('test', rate_limit=100000)
+
+
+@pytest.fixture(scope='session')
+def main(tmp_path_factory):
+    """Модуль бота с базой во временном каталоге"""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('bot'))
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:TEST')
+    os.environ.setdefault('ETHERSCAN_API_KEY', 'test')
+    try:
+        module = importlib.import_module('main')
+        yield module
+        module.db.close()
+    finally:
+        os.chdir(cwd)
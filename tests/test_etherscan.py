@@ -0,0 +1,40 @@
+from benchmarks import offline_suite
+from benchmarks.offline_suite import FIRST_BLOCK, synthetic_txs, wallet_for_size
+import etherscan_api
+
+
+def fetch_all(eth, wallet, start_block=0):
+    return list(eth.iter_account_txs('txlist', wallet, start_block))
+
+
+def test_windows_keep_a_split_block_whole(eth, fake, monkeypatch):
+    # По 3 транзакции в блоке: окно в 10 000 строк кончается посреди блока
+    monkeypatch.setattr(offline_suite, 'TXS_PER_BLOCK', 3)
+    wallet = wallet_for_size(25000)
+    fake.reset_calls()
+
+    txs = fetch_all(eth, wallet)
+
+    assert [tx['hash'] for tx in txs] == [tx['hash'] for tx in synthetic_txs('txlist', wallet, 25000)]
+    # Три окна: 10 000, 9 999 и 5 002 строки, последние заново с отложенного блока
+    assert fake.reset_calls()['etherscan.txlist'] == 10 + 10 + 6
+
+
+def test_windows_resume_from_start_block(eth, monkeypatch):
+    monkeypatch.setattr(offline_suite, 'TXS_PER_BLOCK', 3)
+    wallet = wallet_for_size(12000)
+    start_block = FIRST_BLOCK + 1000
+
+    txs = fetch_all(eth, wallet, start_block)
+
+    assert [tx['hash'] for tx in txs] == [tx['hash'] for tx in synthetic_txs('txlist', wallet, 12000)[3000:]]
+
+
+def test_block_larger_than_window_does_not_loop(eth, monkeypatch):
+    # Блок целиком не помещается в окно: отдается то, что есть, и обход идет дальше
+    monkeypatch.setattr(offline_suite, 'TXS_PER_BLOCK', etherscan_api.MAX_WINDOW + 500)
+    wallet = wallet_for_size(2 * (etherscan_api.MAX_WINDOW + 500))
+
+    blocks = [int(tx['blockNumber']) for tx in fetch_all(eth, wallet)]
+
+    assert blocks == [FIRST_BLOCK] * etherscan_api.MAX_WINDOW + [FIRST_BLOCK + 1] * etherscan_api.MAX_WINDOW
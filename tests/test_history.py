@@ -0,0 +1,157 @@
+import pytest
+
+from benchmarks.offline_suite import FIRST_BLOCK, TXS_PER_BLOCK, block_timestamp, synthetic_txs, wallet_for_size
+from etherscan_api import LATEST_BLOCK
+from prices import SECONDS_PER_DAY
+import balances
+from balances import get_indexed_balance
+import history
+from history import get_eth_history, get_internal_history, sync_history
+from tokens import TRANSFERS_TOKEN, get_tokens_history
+
+SIZE = 2000
+LAST_BLOCK = FIRST_BLOCK + (SIZE - 1) // TXS_PER_BLOCK
+
+
+def recording_fetch(eth, wallet, ranges):
+    """Загрузка txlist, которая запоминает запрошенные диапазоны"""
+    def fetch(start_block, end_block):
+        ranges.append((start_block, end_block))
+        return eth.iter_account_txs('txlist', wallet, start_block, LATEST_BLOCK if end_block is None else end_block)
+    return fetch
+
+
+def hashes(txs):
+    return [tx['hash'] for tx in txs]
+
+
+def test_sync_fetches_only_missing_ranges(eth, db):
+    wallet = wallet_for_size(SIZE)
+    ranges = []
+    fetch = recording_fetch(eth, wallet, ranges)
+
+    sync_history(db, wallet, 'eth', fetch, FIRST_BLOCK + 100, FIRST_BLOCK + 199)
+    assert ranges == [(FIRST_BLOCK + 100, FIRST_BLOCK + 199)]
+
+    # Период внутри загруженного: запросов нет
+    ranges.clear()
+    sync_history(db, wallet, 'eth', fetch, FIRST_BLOCK + 120, FIRST_BLOCK + 180)
+    assert ranges == []
+
+    # Период шире загруженного: догружаются оба края
+    sync_history(db, wallet, 'eth', fetch, FIRST_BLOCK + 50, FIRST_BLOCK + 300)
+    assert ranges == [(FIRST_BLOCK + 50, FIRST_BLOCK + 99), (FIRST_BLOCK + 200, FIRST_BLOCK + 300)]
+    assert db.get_sync_state(wallet, 'eth') == (FIRST_BLOCK + 50, FIRST_BLOCK + 300)
+
+    # До последнего блока догружается от конца загруженного, без разрыва
+    ranges.clear()
+    sync_history(db, wallet, 'eth', fetch, FIRST_BLOCK + 400, None)
+    assert ranges == [(FIRST_BLOCK + 301, None)]
+    assert db.get_sync_state(wallet, 'eth') == (FIRST_BLOCK + 50, LAST_BLOCK)
+
+    ranges.clear()
+    sync_history(db, wallet, 'eth', fetch, FIRST_BLOCK + 10, FIRST_BLOCK + 5)
+    assert ranges == []
+
+    expected = synthetic_txs('txlist', wallet, SIZE)[50 * TXS_PER_BLOCK:]
+    assert hashes(db.get_transactions(wallet, 'eth')) == hashes(expected)
+
+
+def test_sync_indexes_balances_only_after_fetch(eth, db, monkeypatch):
+    wallet = wallet_for_size(SIZE)
+    indexed = []
+    monkeypatch.setattr(history, 'update_balance_index', lambda db, wallet, token, sync_tokens=None: indexed.append(
+        (token, sync_tokens)
+    ))
+
+    get_tokens_history(eth, db, wallet, ('usdt',), blocks=(0, FIRST_BLOCK + 499))
+    # Только запрошенный токен, синхронизация под общим token переводов
+    assert indexed == [('usdt', (TRANSFERS_TOKEN,))]
+
+    indexed.clear()
+    get_tokens_history(eth, db, wallet, ('usdt', 'dai'), blocks=(0, FIRST_BLOCK + 499))
+    assert indexed == []
+
+    get_internal_history(eth, db, wallet, blocks=(0, FIRST_BLOCK + 499))
+    assert indexed == [('eth', None)]
+
+
+def running_balances(txs, wallet, delta):
+    """Баланс после каждого блока: {блок: баланс}"""
+    balance = 0
+    result = {}
+    for tx in txs:
+        balance += delta(tx, wallet)
+        result[int(tx['blockNumber'])] = balance
+    return result
+
+
+def token_delta(tx, wallet):
+    value = int(tx['value'])
+    return value if tx['to'] == wallet else -value
+
+
+def assert_index_matches(db, wallet, token, expected):
+    for block, balance in expected.items():
+        assert get_indexed_balance(db, wallet, token, block_timestamp(block)) == balance, block
+    # Конец дня UTC отвечается по дневным точкам
+    last_block = max(expected)
+    day_end = block_timestamp(last_block) // SECONDS_PER_DAY * SECONDS_PER_DAY + SECONDS_PER_DAY - 1
+    assert get_indexed_balance(db, wallet, token, day_end) == expected[last_block]
+
+
+def test_balance_index_is_built_in_chunks_and_extended(eth, db, monkeypatch):
+    # Отрезки меньше истории, чтобы индекс строился в несколько шагов
+    monkeypatch.setattr(balances, 'INDEX_CHUNK_BLOCKS', 7)
+    wallet = wallet_for_size(SIZE)
+    txs = synthetic_txs('tokentx', wallet, SIZE)
+
+    get_tokens_history(eth, db, wallet, ('usdt',), blocks=(0, FIRST_BLOCK + 499))
+    assert_index_matches(db, wallet, 'usdt', running_balances(txs[:1000], wallet, token_delta))
+
+    get_tokens_history(eth, db, wallet, ('usdt',), blocks=(0, None))
+    assert_index_matches(db, wallet, 'usdt', running_balances(txs, wallet, token_delta))
+
+
+def test_eth_balance_index_merges_internal_transactions(eth, db):
+    wallet = wallet_for_size(SIZE)
+
+    def delta(tx, wallet):
+        value = 0 if tx['isError'] == '1' else int(tx['value'])
+        if tx['to'] == wallet:
+            return value
+        # Комиссию платит только отправитель внешней транзакции
+        fee = 0 if tx['internal'] else int(tx['gasPrice']) * int(tx['gasUsed'])
+        return -value - fee
+
+    # Как в балансе на дату: оба потока до явного блока, иначе диапазон
+    # внутренних кончался бы на их последней транзакции
+    get_eth_history(eth, db, wallet, blocks=(0, LAST_BLOCK))
+    # Пока внутренние транзакции не загружены, баланс по неполной истории не считается
+    assert db.get_last_indexed_balance(wallet, 'eth') is None
+
+    get_internal_history(eth, db, wallet, blocks=(0, LAST_BLOCK))
+    timeline = sorted(
+        [{**tx, 'internal': False} for tx in synthetic_txs('txlist', wallet, SIZE)]
+        + [{**tx, 'internal': True} for tx in synthetic_txs('txlistinternal', wallet, SIZE)],
+        key=lambda tx: int(tx['blockNumber'])
+    )
+    assert_index_matches(db, wallet, 'eth', running_balances(timeline, wallet, delta))
+
+
+def test_balance_index_needs_history_from_block_zero(eth, db):
+    wallet = wallet_for_size(SIZE)
+    get_tokens_history(eth, db, wallet, ('usdt',), blocks=(FIRST_BLOCK + 100, None))
+    assert db.get_last_indexed_balance(wallet, 'usdt') is None
+    assert get_indexed_balance(db, wallet, 'usdt', block_timestamp(LAST_BLOCK)) == 0
+
+
+@pytest.mark.parametrize('blocks', [(0, FIRST_BLOCK + 99), (0, None)])
+def test_history_reads_back_requested_period(eth, db, blocks):
+    wallet = wallet_for_size(SIZE)
+    end_timestamp = block_timestamp(blocks[1]) if blocks[1] else None
+    txs = get_eth_history(eth, db, wallet, end_timestamp=end_timestamp, blocks=blocks)
+    expected = synthetic_txs('txlist', wallet, SIZE)
+    if blocks[1]:
+        expected = expected[:(blocks[1] - FIRST_BLOCK + 1) * TXS_PER_BLOCK]
+    assert hashes(txs) == hashes(expected)
@@ -0,0 +1,59 @@
+from streams import ETH_SOURCES, INTERNAL_TOKEN
+
+WALLET = '0x00000000000000000000000000000000000000ee'
+COUNTERPARTY = '0x00000000000000000000000000000000000000bb'
+FIRST_TIMESTAMP = 1600000000
+START = FIRST_TIMESTAMP
+END = FIRST_TIMESTAMP + 1000
+
+
+def make_tx(block, timestamp, i=0):
+    return {
+        'blockNumber': str(block),
+        'timeStamp': str(timestamp),
+        'hash': f"0x{block:032x}{i:032x}",
+        'from': COUNTERPARTY,
+        'to': WALLET,
+        'value': '1',
+        'gasPrice': '1',
+        'gasUsed': '21000',
+        'isError': '0'
+    }
+
+
+def test_cache_key_follows_transactions_in_period(main):
+    db = main.db
+
+    def key(report_format='csv', sources=None):
+        return main.get_report_cache_key(WALLET, 'eth', START, END, 'период', report_format, sources)
+
+    assert key() is None
+
+    db.save_transactions(WALLET, 'eth', [make_tx(100, START), make_tx(101, START + 12)], 100, 110)
+    first = key()
+    assert first is not None and first == key()
+    assert key('xlsx') != first
+
+    # Новые транзакции вне периода отчет не меняют
+    db.save_transactions(WALLET, 'eth', [make_tx(200, END + 100)], 111, 200)
+    assert key() == first
+
+    # Новая транзакция в периоде, даже в уже известном блоке, меняет ключ
+    db.save_transactions(WALLET, 'eth', [make_tx(101, START + 12), make_tx(101, START + 12, 1)], 101, 101)
+    second = key()
+    assert second != first
+
+    # В ETH отчете ключ зависит и от внутренних транзакций
+    with_internal = key(sources=ETH_SOURCES)
+    db.save_transactions(WALLET, INTERNAL_TOKEN, [make_tx(102, START + 24)], 100, 110)
+    assert key(sources=ETH_SOURCES) != with_internal
+    assert key() == second
+
+
+def test_cached_report_is_found_by_key_until_it_expires(main):
+    db = main.db
+    db.save_cached_report('key', 'file-1', {'count_in': 1})
+
+    assert db.get_cached_report('key', 60) == ('file-1', {'count_in': 1})
+    assert db.get_cached_report('other-key', 60) is None
+    assert db.get_cached_report('key', -1) is None
@@ -0,0 +1,45 @@
+import tokens
+from tokens import KNOWN_TOKENS, get_token_balance, get_token_info, remember_metadata
+
+WALLET = '0x00000000000000000000000000000000000000aa'
+UNKNOWN_CONTRACT = '0x00000000000000000000000000000000000000cc'
+
+
+class BalanceClient:
+    """Клиент Etherscan, который отдает один и тот же баланс любого токена"""
+
+    def __init__(self, balance):
+        self.balance = balance
+        self.contracts = []
+
+    def get_token_balance(self, contract_address, address):
+        self.contracts.append(contract_address)
+        if isinstance(self.balance, Exception):
+            raise self.balance
+        return self.balance
+
+
+def test_registry_learns_tokens_from_transfers(db, monkeypatch):
+    monkeypatch.setattr(tokens, '_metadata', {})
+    assert get_token_info(db, UNKNOWN_CONTRACT) is None
+
+    txs = [{'contractAddress': UNKNOWN_CONTRACT.upper(), 'tokenSymbol': 'TST', 'tokenName': 'Test', 'tokenDecimal': '8'}]
+    assert list(remember_metadata(db, txs)) == txs
+
+    # Из базы, а не из памяти процесса
+    monkeypatch.setattr(tokens, '_metadata', {})
+    info = get_token_info(db, UNKNOWN_CONTRACT)
+    assert (info.contract, info.symbol, info.name, info.decimals) == (UNKNOWN_CONTRACT, 'TST', 'Test', 8)
+    # Известные токены берутся из KNOWN_TOKENS и по адресу контракта
+    assert get_token_info(db, KNOWN_TOKENS['dai'].contract) is KNOWN_TOKENS['dai']
+
+
+def test_token_balance_uses_registry(db, monkeypatch):
+    monkeypatch.setattr(tokens, '_metadata', {})
+    db.save_token_metadata([(UNKNOWN_CONTRACT, 'TST', 'Test', 8)])
+    client = BalanceClient('250000000')
+    assert get_token_balance(client, db, UNKNOWN_CONTRACT, WALLET) == 2.5
+    assert client.contracts == [UNKNOWN_CONTRACT]
+
+    assert get_token_balance(client, db, '0x' + 'dd' * 20, WALLET) is None
+    assert get_token_balance(BalanceClient(Exception('timeout')), db, 'usdt', WALLET) is None
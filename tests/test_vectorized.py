@@ -0,0 +1,105 @@
+import csv
+import io
+
+import pytest
+
+from aggregation import EthAggregator, TokenAggregator
+from tokens import KNOWN_TOKENS, process_token_transactions
+from vectorized import chunked_rows
+import vectorized
+
+WALLET = '0x00000000000000000000000000000000000000aa'
+COUNTERPARTY = '0x00000000000000000000000000000000000000bb'
+SIZE = 25000
+# Меньше SIZE, чтобы строки шли через границы частей
+CHUNK = 7000
+ETH_PRICE = 2000.0
+FIRST_TIMESTAMP = 1600000000
+
+
+def make_tx(i, token=False):
+    outgoing = i % 2 == 1
+    # Изредка перевод самому себе
+    to_self = i % 211 == 0
+    tx = {
+        'blockNumber': str(10000000 + i // 3),
+        'timeStamp': str(FIRST_TIMESTAMP + i * 37),
+        'hash': f"0x{i:064x}",
+        'from': WALLET if outgoing or to_self else COUNTERPARTY,
+        'to': COUNTERPARTY if outgoing and not to_self else WALLET,
+        # Есть нулевые переводы и значения больше 2**53
+        'value': str((i % 97) * 10**16 + (i % 7) * 10**22),
+        'gasPrice': str(20 * 10**9 + i % 1000),
+        'gasUsed': '21000',
+        'isError': '1' if i % 113 == 0 else '0'
+    }
+    if token:
+        tx['value'] = hex((i % 1000 + 1) * 10**6) if i % 5 == 0 else str((i % 1000 + 1) * 10**6)
+    return tx
+
+
+def test_eth_chunks_match_row_path(main):
+    txs = [make_tx(i) for i in range(SIZE)]
+    daily_prices = {(FIRST_TIMESTAMP + i * 86400) // 86400: 1500.0 + i for i in range(0, 12, 2)}
+
+    row_stats = EthAggregator(WALLET)
+    with main.build_eth_report(
+        main.process_transactions(row_stats.tap(txs), WALLET, ETH_PRICE, daily_prices), 'csv'
+    ) as report:
+        expected = report.read()
+
+    stats = EthAggregator(WALLET)
+    rows = chunked_rows(
+        txs, lambda chunk: vectorized.eth_report_rows(chunk, stats, ETH_PRICE, daily_prices), None, CHUNK
+    )
+    with main.build_eth_report(rows, 'csv') as report:
+        assert report.read() == expected
+    assert stats.as_dict() == row_stats.as_dict()
+
+
+@pytest.mark.parametrize('vectorize', [False, True])
+def test_eth_csv_sums_match_caption_totals(main, vectorize):
+    txs = [make_tx(i) for i in range(SIZE)]
+    stats = EthAggregator(WALLET)
+    if vectorize:
+        rows = chunked_rows(txs, lambda chunk: vectorized.eth_report_rows(chunk, stats, ETH_PRICE), None, CHUNK)
+    else:
+        rows = main.process_transactions(stats.tap(txs), WALLET, ETH_PRICE)
+    with main.build_eth_report(rows, 'csv') as report:
+        table = list(csv.DictReader(io.StringIO(report.read().decode('utf-8-sig'))))
+
+    totals = stats.as_dict()
+    # Вторая строка с тем же хэшем это комиссия исходящего перевода, в "Отправлено" она не входит
+    transfer_rows = [
+        row for previous, row in zip([None] + table, table)
+        if previous is None or previous['Transaction Hash'] != row['Transaction Hash']
+    ]
+    tolerance = totals['total_in'] * 1e-12
+    assert sum(float(row['Amount In (ETH)']) for row in table) == pytest.approx(totals['total_in'], abs=tolerance)
+    assert sum(float(row['Amount Out (ETH)']) for row in transfer_rows) == pytest.approx(totals['total_out'], abs=tolerance)
+    assert sum(float(row['General amount']) for row in table) == pytest.approx(
+        totals['total_in'] - totals['total_out'] - totals['total_fee'], abs=tolerance
+    )
+
+
+def test_token_chunks_match_row_path(main):
+    txs = [make_tx(i, token=True) for i in range(SIZE)]
+    token_info = KNOWN_TOKENS['usdt']
+
+    row_stats = TokenAggregator(WALLET, token_info.decimals)
+    with main.build_token_report(main.token_report_rows(
+        process_token_transactions(row_stats.tap(txs), WALLET, token_info.decimals), WALLET, token_info
+    ), 'csv') as report:
+        expected = report.read()
+
+    stats = TokenAggregator(WALLET, token_info.decimals)
+    rows = chunked_rows(
+        txs,
+        lambda chunk: vectorized.token_report_rows(
+            chunk, stats, token_info.contract, token_info.name, token_info.symbol
+        ),
+        None, CHUNK
+    )
+    with main.build_token_report(rows, 'csv') as report:
+        assert report.read() == expected
+    assert stats.as_dict() == row_stats.as_dict()
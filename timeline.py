@@ -0,0 +1,40 @@
+from fanout import fan_out
+from history import get_eth_history, get_internal_history, resolve_block_range
+from streams import INTERNAL_TOKEN, ETH_SOURCES, merge_by_block
+from tokens import get_tokens_history
+
+
+def get_timeline_calls(eth, db, wallet, start_timestamp=None, end_timestamp=None, tokens=()):
+    """Загрузки потоков хронологии кошелька для fan_out: {вид: вызов}.
+
+    Обычные и внутренние транзакции загружаются отдельными вызовами, все
+    токены одним: их переводы приходят одной выборкой tokentx. Границы
+    периода в блоках ищутся один раз на все потоки.
+    """
+    blocks = resolve_block_range(eth, start_timestamp, end_timestamp)
+    calls = {
+        'eth': lambda: get_eth_history(eth, db, wallet, start_timestamp, end_timestamp, blocks),
+        INTERNAL_TOKEN: lambda: get_internal_history(eth, db, wallet, start_timestamp, end_timestamp, blocks)
+    }
+    if tokens:
+        calls['tokens'] = lambda: get_tokens_history(eth, db, wallet, tokens, start_timestamp, end_timestamp, blocks)
+    return calls
+
+
+def merge_timeline(results, tokens=()):
+    """Сливает загруженные потоки из результатов fan_out в одну хронологию (вид, транзакция)"""
+    streams = [(kind, results[kind]) for kind in ETH_SOURCES]
+    if tokens:
+        streams.extend(zip(tokens, results['tokens']))
+    return merge_by_block(streams)
+
+
+def get_timeline(eth, db, wallet, start_timestamp=None, end_timestamp=None, tokens=()):
+    """Хронология кошелька за период: обычные, внутренние транзакции и переводы токенов.
+
+    Потоки загружаются параллельно и сливаются по блокам лениво, без общего
+    списка и сортировки. Вид перевода токена равен ключу токена.
+    """
+    calls = get_timeline_calls(eth, db, wallet, start_timestamp, end_timestamp, tokens)
+    # Все потоки обязательны, поэтому срок ожидания не используется
+    return merge_timeline(fan_out(calls, 0, required=tuple(calls)), tokens)
@@ -0,0 +1,162 @@
+import threading
+from datetime import datetime
+from typing import NamedTuple
+from etherscan_api import LATEST_BLOCK
+from history import resolve_block_range, sync_history
+from records import TokenTransfer
+
+
+class TokenInfo(NamedTuple):
+    """Метаданные ERC-20 токена"""
+    contract: str
+    symbol: str
+    name: str
+    decimals: int
+
+
+# Все ERC-20 переводы кошелька загружаются одной выборкой tokentx и
+# синхронизируются под этим token, а хранятся разложенными по контрактам
+TRANSFERS_TOKEN = 'erc20'
+
+# Токены с отчетами в боте; ключ совпадает с token в локальной истории.
+# Это начальное наполнение реестра: метаданные читаются через get_token_info
+KNOWN_TOKENS = {
+    'usdt': TokenInfo('0xdAC17F958D2ee523a2206206994597C13D831ec7', 'USDT', 'Tether USD', 6),
+    'usdc': TokenInfo('0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48', 'USDC', 'USD Coin', 6),
+    'dai': TokenInfo('0x6B175474E89094C44Da98b954EedeAC495271d0F', 'DAI', 'Dai Stablecoin', 18),
+    'weth': TokenInfo('0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2', 'WETH', 'Wrapped Ether', 18)
+}
+_KEYS_BY_CONTRACT = {info.contract.lower(): key for key, info in KNOWN_TOKENS.items()}
+
+# Метаданные остальных токенов: {контракт: TokenInfo}, поверх таблицы token_metadata
+_metadata = {}
+_metadata_lock = threading.Lock()
+
+
+def get_token_key(contract):
+    """token в локальной истории: ключ известного токена или адрес контракта"""
+    contract = contract.lower()
+    return _KEYS_BY_CONTRACT.get(contract, contract)
+
+
+def get_token_info(db, token):
+    """Метаданные токена по ключу или адресу контракта; None, если токен не встречался.
+
+    Отчеты, подписи и балансы берут decimals и символ только отсюда:
+    известные токены из KNOWN_TOKENS, остальные из реестра token_metadata.
+    """
+    key = get_token_key(token)
+    if key in KNOWN_TOKENS:
+        return KNOWN_TOKENS[key]
+    with _metadata_lock:
+        if key in _metadata:
+            return _metadata[key]
+    row = db.get_token_metadata(key)
+    if row is None:
+        return None
+    info = TokenInfo(key, *row)
+    with _metadata_lock:
+        _metadata[key] = info
+    return info
+
+
+def remember_metadata(db, txs):
+    """Пропускает переводы дальше, запоминая метаданные новых токенов.
+
+    Символ, имя и decimals приходят в каждом переводе tokentx, поэтому
+    реестр пополняется без отдельных запросов к API.
+    """
+    seen = {}
+    try:
+        for tx in txs:
+            contract = tx['contractAddress'].lower()
+            if contract not in seen and contract not in _KEYS_BY_CONTRACT:
+                seen[contract] = (contract, tx.get('tokenSymbol', ''), tx.get('tokenName', ''),
+                                  int(tx.get('tokenDecimal') or 0))
+            yield tx
+    finally:
+        with _metadata_lock:
+            new = [row for contract, row in seen.items() if contract not in _metadata]
+        db.save_token_metadata(new)
+
+
+def get_token_balance(eth, db, token, address):
+    """Текущий баланс кошелька в единицах токена; None, если получить не удалось"""
+    info = get_token_info(db, token)
+    if info is None:
+        print(f"Нет метаданных токена {token}, баланс не запрашиваем")
+        return None
+    try:
+        balance = eth.get_token_balance(
+            contract_address=info.contract,
+            address=address
+        )
+        return float(balance) / (10 ** info.decimals)
+    except Exception as e:
+        print(f"Ошибка при получении баланса {info.symbol}: {str(e)}")
+        return None
+
+
+def fetch_token_transfers(eth, address, start_block, end_block=None):
+    """Постранично запрашивает переводы всех ERC-20 токенов кошелька в диапазоне блоков"""
+    print(f"\n📡 Запрашиваем ERC-20 переводы {address} в блоках {start_block}-{end_block or 'последний'}...")
+    return eth.iter_account_txs('tokentx', address, start_block, LATEST_BLOCK if end_block is None else end_block)
+
+
+def get_tokens_history(eth, db, address, tokens, start_timestamp=None, end_timestamp=None, blocks=None):
+    """Возвращает переводы нескольких токенов кошелька за период: по итератору на токен.
+
+    Недостающие блоки догружаются одной выборкой для всех токенов сразу,
+    поэтому отчет по любому другому токену за тот же период запросов не требует.
+    Индекс балансов после загрузки обновляется только для запрошенных токенов.
+    """
+    keys = [get_token_key(token) for token in tokens]
+    start_block, end_block = blocks or resolve_block_range(eth, start_timestamp, end_timestamp)
+    sync_history(
+        db, address, TRANSFERS_TOKEN,
+        lambda start_block, end_block: remember_metadata(
+            db, fetch_token_transfers(eth, address, start_block, end_block)
+        ),
+        start_block, end_block,
+        partition=lambda tx: get_token_key(tx['contractAddress']),
+        indexed=keys
+    )
+    return [db.get_transactions(address, key, start_timestamp, end_timestamp) for key in keys]
+
+
+def get_token_history(eth, db, address, token, start_timestamp=None, end_timestamp=None):
+    """Возвращает переводы токена кошелька за период из локальной истории"""
+    return get_tokens_history(eth, db, address, (token,), start_timestamp, end_timestamp)[0]
+
+
+def process_token_transactions(txs, address, decimals):
+    """Построчно превращает переводы токена в записи отчета"""
+    address = address.lower()
+    for tx in txs:
+        try:
+            value = int(tx['value'], 16) if tx['value'].startswith('0x') else int(tx['value'])
+            amount = float(value) / (10 ** decimals)
+
+            timestamp = int(tx['timeStamp'])
+            date = datetime.fromtimestamp(timestamp).strftime('%d/%m/%Y')
+
+            # Используем данные из самой транзакции вместо дополнительного запроса
+            gas_price = int(tx['gasPrice'], 16) if tx['gasPrice'].startswith('0x') else int(tx['gasPrice'])
+            gas_used = int(tx['gasUsed'], 16) if tx['gasUsed'].startswith('0x') else int(tx['gasUsed'])
+            fee = float(gas_price * gas_used) / (10 ** 18)
+
+            yield TokenTransfer(
+                block_number=tx['blockNumber'],
+                timestamp=timestamp,
+                date=date,
+                tx_hash=tx['hash'],
+                sender=tx['from'],
+                recipient=tx['to'],
+                amount=amount,
+                direction='in' if tx['to'].lower() == address else 'out',
+                fee=fee
+            )
+
+        except Exception as e:
+            print(f"Error processing tx: {str(e)}")
+            continue
@@ -0,0 +1,251 @@
+import itertools
+import operator
+from datetime import datetime, timezone
+import numpy as np
+from prices import SECONDS_PER_DAY
+from records import EthReportRow, TokenReportRow
+
+# С какого числа транзакций отчет считается по столбцам, а не построчно
+VECTORIZE_THRESHOLD = 20000
+# Сколько транзакций считается по столбцам за один раз: в памяти одновременно
+# держится только одна такая часть истории и ее столбцы
+VECTORIZE_CHUNK = 50000
+# Целые меньше 2**53 переводятся во float64 без потерь. Большие значения делим
+# в Python, чтобы результат совпадал с построчным расчетом до бита
+EXACT_FLOAT_LIMIT = 2 ** 53
+# Смещения часовых поясов и переходы на летнее время кратны 15 минутам,
+# поэтому локальная дата внутри такого интервала одна
+LOCAL_DATE_STEP = 900
+
+ETH_FIELDS = ('hash', 'timeStamp', 'from', 'to', 'value', 'gasPrice', 'gasUsed', 'isError')
+TOKEN_FIELDS = ('blockNumber', 'hash', 'timeStamp', 'from', 'to', 'value')
+
+
+def split_large(txs, threshold=VECTORIZE_THRESHOLD):
+    """Читает начало транзакций и решает, считать ли их по столбцам.
+
+    Возвращает (транзакции, True), если их не меньше threshold. В память
+    читаются только первые threshold транзакций, остальные идут из txs.
+    """
+    txs = iter(txs)
+    head = list(itertools.islice(txs, threshold))
+    if len(head) < threshold:
+        return head, False
+    return itertools.chain(head, txs), True
+
+
+def iter_chunks(txs, size=VECTORIZE_CHUNK):
+    """Разбивает транзакции на списки по size штук"""
+    txs = iter(txs)
+    while True:
+        chunk = list(itertools.islice(txs, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def chunked_rows(txs, vectorized_rows, row_path, size=VECTORIZE_CHUNK):
+    """Строки отчета по столбцам, частями по size транзакций.
+
+    Строки транзакций друг от друга не зависят, а итоги частей складываются
+    в stats через add_totals, поэтому результат тот же, что и за один проход.
+    Часть, которую не удалось посчитать по столбцам, считается построчно
+    через row_path(chunk).
+    """
+    def chunk_rows(chunk):
+        try:
+            return vectorized_rows(chunk)
+        except Exception as e:
+            print(f"⚠️ Не удалось посчитать отчет по столбцам, считаем построчно: {str(e)}")
+            return row_path(chunk)
+    return itertools.chain.from_iterable(map(chunk_rows, iter_chunks(txs, size)))
+
+
+def load_columns(txs, fields):
+    """Раскладывает транзакции Etherscan по столбцам: {поле: список значений}"""
+    values = list(zip(*map(operator.itemgetter(*fields), txs)))
+    if not values:
+        return {field: [] for field in fields}
+    return {field: list(column) for field, column in zip(fields, values)}
+
+
+def _decimal_strings(values):
+    """Приводит hex-значения токенов к десятичной записи"""
+    return [str(int(value, 16)) if value.startswith('0x') else value for value in values]
+
+
+def _floats(values):
+    return np.fromiter(map(float, values), dtype=np.float64, count=len(values))
+
+
+def _ints(values):
+    return np.fromiter(map(int, values), dtype=np.int64, count=len(values))
+
+
+def _exact_units(values, decimals):
+    """Массив int(value) / 10**decimals, совпадающий с делением целых в Python"""
+    raw = _floats(values)
+    units = raw / float(10 ** decimals)
+    for i in np.flatnonzero(np.abs(raw) >= EXACT_FLOAT_LIMIT):
+        units[i] = int(values[i]) / 10 ** decimals
+    return units
+
+
+def _fee_wei(gas_prices, gas_used):
+    """Комиссии gasPrice * gasUsed во float64 и маска строк, где они посчитаны точно"""
+    prices = _floats(gas_prices)
+    used = _floats(gas_used)
+    fees = prices * used
+    exact = (prices < EXACT_FLOAT_LIMIT) & (used < EXACT_FLOAT_LIMIT) & (fees < EXACT_FLOAT_LIMIT)
+    return fees, exact
+
+
+def _lower_equals(addresses, wallet):
+    return np.fromiter(map(wallet.__eq__, map(str.lower, addresses)), dtype=bool, count=len(addresses))
+
+
+def _format_dates(timestamps, step, to_datetime):
+    """Даты строк: strftime считается один раз на интервал step секунд"""
+    buckets, inverse = np.unique(timestamps // step, return_inverse=True)
+    labels = np.array([to_datetime(int(bucket) * step).strftime('%d/%m/%Y') for bucket in buckets], dtype=object)
+    return labels[inverse].tolist()
+
+
+def _with_zeros(values, zero_mask):
+    """Значения, где по маске стоит целый 0, как в построчном расчете"""
+    result = values.astype(object)
+    result[zero_mask] = 0
+    return result
+
+
+def _int_sum(values, mask):
+    return sum(map(int, itertools.compress(values, mask.tolist())))
+
+
+def _succeeded(columns):
+    return np.fromiter(map('1'.__ne__, columns['isError']), dtype=bool, count=len(columns['isError']))
+
+
+def _aggregate_eth(columns, outgoing, stats):
+    incoming = _lower_equals(columns['to'], stats.wallet)
+    succeeded = _succeeded(columns)
+    out_mask = outgoing.tolist()
+    stats.add_totals(
+        count_in=int(incoming.sum()),
+        count_out=int(outgoing.sum()),
+        total_in=_int_sum(columns['value'], incoming & succeeded),
+        total_out=_int_sum(columns['value'], outgoing & succeeded),
+        total_fee=sum(map(
+            operator.mul,
+            map(int, itertools.compress(columns['gasPrice'], out_mask)),
+            map(int, itertools.compress(columns['gasUsed'], out_mask))
+        ))
+    )
+
+
+def eth_report_rows(txs, stats, eth_usd_price, daily_prices=None):
+    """Строки ETH отчета по столбцам, те же, что дает построчный process_transactions.
+
+    Итоги сразу учитываются в stats (EthAggregator).
+    """
+    daily_prices = daily_prices or {}
+    columns = load_columns(txs, ETH_FIELDS)
+    timestamps = _ints(columns['timeStamp'])
+    outgoing = _lower_equals(columns['from'], stats.wallet)
+    # Перевод самому себе и входящий, и исходящий, как в EthAggregator
+    incoming = ~outgoing | _lower_equals(columns['to'], stats.wallet)
+
+    # У неуспешной транзакции сумма 0, списывается только комиссия
+    values = [value if ok else '0' for value, ok in zip(columns['value'], _succeeded(columns).tolist())]
+    value_eth = _exact_units(values, 18)
+    fee_wei, exact = _fee_wei(columns['gasPrice'], columns['gasUsed'])
+    fee_eth = fee_wei / 1e18
+    for i in np.flatnonzero(~exact):
+        fee_eth[i] = int(columns['gasPrice'][i]) * int(columns['gasUsed'][i]) / 10**18
+
+    # Курс дня транзакции, а если его нет, текущий
+    days, inverse = np.unique(timestamps // SECONDS_PER_DAY, return_inverse=True)
+    day_prices = [daily_prices.get(int(day), eth_usd_price) for day in days]
+    tx_price = np.array([price or 0 for price in day_prices], dtype=np.float64)[inverse]
+    no_price = tx_price == 0
+
+    fee_usd = fee_eth * tx_price
+    amount_in = np.where(incoming, value_eth, 0.0)
+    amount_out = np.where(outgoing, value_eth, 0.0)
+    general_amount = np.where(outgoing & (amount_out == 0), amount_in - amount_out - fee_eth, amount_in - amount_out)
+    general_amount_usd = general_amount * tx_price
+    if eth_usd_price:
+        current_value = (value_eth * eth_usd_price).astype(object)
+    else:
+        current_value = 0
+
+    # Строка комиссии идет сразу за своей исходящей транзакцией
+    fee_mask = outgoing & (value_eth > 0) & (fee_eth > 0)
+    shift = np.cumsum(fee_mask) - fee_mask
+    main_positions = np.arange(len(fee_mask)) + shift
+    fee_positions = main_positions[fee_mask] + 1
+    size = len(fee_mask) + int(fee_mask.sum())
+
+    def interleave(main_values, fee_values):
+        column = np.empty(size, dtype=object)
+        column[main_positions] = main_values
+        column[fee_positions] = fee_values if np.isscalar(fee_values) else fee_values[fee_mask]
+        return column.tolist()
+
+    dates = np.array(
+        _format_dates(timestamps, SECONDS_PER_DAY, lambda ts: datetime.fromtimestamp(ts, timezone.utc)),
+        dtype=object
+    )
+    fee_values = fee_eth.astype(object)
+    fee_usd_values = _with_zeros(fee_usd, no_price)
+    senders = np.array(columns['from'], dtype=object)
+    recipients = np.array(columns['to'], dtype=object)
+    hashes = np.array(columns['hash'], dtype=object)
+    report_columns = [
+        interleave(dates, dates),
+        interleave(senders, senders),
+        interleave(recipients, recipients),
+        interleave(hashes, hashes),
+        interleave(_with_zeros(amount_in, ~incoming), 0),
+        interleave(_with_zeros(value_eth, ~outgoing), fee_values),
+        interleave(fee_values, fee_values),
+        interleave(fee_usd_values, fee_usd_values),
+        interleave(current_value, 0),
+        interleave(general_amount.astype(object), (-fee_eth).astype(object)),
+        interleave(general_amount_usd.astype(object), _with_zeros(-fee_usd, no_price))
+    ]
+    # Итоги учитываем последними: если расчет выше упадет, stats останется нетронутым
+    _aggregate_eth(columns, outgoing, stats)
+
+    return map(EthReportRow, *report_columns)
+
+
+def token_report_rows(txs, stats, contract_address, token_name, token_symbol):
+    """Строки отчета по переводам токена по столбцам, те же, что дает построчный расчет.
+
+    Итоги сразу учитываются в stats (TokenAggregator).
+    """
+    columns = load_columns(txs, TOKEN_FIELDS)
+    values = _decimal_strings(columns['value'])
+    timestamps = _ints(columns['timeStamp'])
+    incoming = _lower_equals(columns['to'], stats.wallet)
+    outgoing = _lower_equals(columns['from'], stats.wallet)
+
+    # Как и в построчном расчете: float(value) / 10**decimals, знак минус у исходящих
+    amounts = _floats(values) / float(10 ** stats.decimals)
+    token_values = np.where(outgoing, -amounts, amounts).tolist()
+    # Построчный расчет берет локальную дату сервера
+    dates = _format_dates(timestamps, LOCAL_DATE_STEP, datetime.fromtimestamp)
+    stats.add_totals(
+        count_in=int(incoming.sum()),
+        count_out=int((~incoming).sum()),
+        total_in=_int_sum(values, incoming),
+        total_out=_int_sum(values, ~incoming)
+    )
+
+    return map(
+        TokenReportRow,
+        columns['blockNumber'], timestamps.tolist(), dates, columns['from'],
+        columns['to'], columns['hash'], token_values,
+        itertools.repeat(contract_address), itertools.repeat(token_name), itertools.repeat(token_symbol)
+    )
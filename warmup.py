@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+import time
+from fanout import fan_out
+from history import get_eth_history, get_internal_history
+from metrics import metrics
+from prices import get_eth_price, price_service
+from streams import INTERNAL_TOKEN
+from tokens import TRANSFERS_TOKEN, get_tokens_history
+
+# Формат файла снимка; снимок другой версии при старте пропускается
+SNAPSHOT_VERSION = 1
+
+# Потоки истории, которые догружаются при прогреве: {token синхронизации: загрузка}
+PREWARM_STREAMS = {
+    'eth': get_eth_history,
+    INTERNAL_TOKEN: get_internal_history,
+    TRANSFERS_TOKEN: lambda eth, db, wallet, blocks: get_tokens_history(eth, db, wallet, (), blocks=blocks)
+}
+
+
+def save_snapshot(path, eth, prices=price_service):
+    """Сохраняет кэши курсов и номеров блоков в файл.
+
+    История кошельков, дневные курсы и готовые отчеты и так лежат в базе,
+    в снимок попадает только то, что живет в памяти процесса.
+    """
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'saved_at': int(time.time()),
+        'prices': {coin: list(entry) for coin, entry in list(prices.cache.items())},
+        'blocks': eth.get_cached_blocks()
+    }
+    # Пишем во временный файл, чтобы прерванная запись не испортила прошлый снимок
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(temp_path, path)
+    print(f"💾 Снимок кэшей сохранен: {len(snapshot['prices'])} курсов, {len(snapshot['blocks'])} блоков")
+
+
+def load_snapshot(path, eth, prices=price_service):
+    """Восстанавливает кэши из снимка; False, если снимка нет или он не подходит.
+
+    Курсы восстанавливаются со временем получения, поэтому старый курс
+    отдается и обновляется по обычным правилам PriceService.
+    """
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Не удалось прочитать снимок кэшей: {str(e)}")
+        return False
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        print("⚠️ Снимок кэшей другой версии, начинаем с пустыми кэшами")
+        return False
+
+    for coin, (price, fetched_at) in snapshot['prices'].items():
+        prices.cache.setdefault(coin, (price, fetched_at))
+    eth.cache_blocks(snapshot['blocks'])
+    age = (time.time() - snapshot['saved_at']) / 60
+    print(
+        f"♻️ Кэши восстановлены из снимка {age:.0f} мин назад: "
+        f"{len(snapshot['prices'])} курсов, {len(snapshot['blocks'])} блоков"
+    )
+    return True
+
+
+def get_prewarm_calls(eth, db, wallet):
+    """Догрузка потоков кошелька от последнего загруженного блока до последнего блока сети.
+
+    Потоки, которые еще ни разу не загружались, пропускаются: полную
+    историю при старте не грузим, только то, что появилось после прошлой загрузки.
+    """
+    calls = {}
+    for token, get_stream in PREWARM_STREAMS.items():
+        state = db.get_sync_state(wallet, token)
+        if state:
+            blocks = (state[1] + 1, None)
+            calls[token] = lambda get_stream=get_stream, blocks=blocks: get_stream(eth, db, wallet, blocks=blocks)
+    return calls
+
+
+def prewarm_wallets(eth, db, limit):
+    """Догружает новые блоки истории недавно активных кошельков.
+
+    Кошельки обходятся по одному, чтобы прогрев не занимал весь лимит
+    запросов Etherscan, нужный пользователям после перезапуска.
+    """
+    started = time.perf_counter()
+    get_eth_price()
+    wallets = db.get_recent_wallets(limit)
+    for wallet in wallets:
+        calls = get_prewarm_calls(eth, db, wallet)
+        if not calls:
+            metrics.inc('prewarm_wallets_total', result='skipped')
+            continue
+        try:
+            fan_out(calls, 0, required=tuple(calls))
+            metrics.inc('prewarm_wallets_total', result='ok')
+        except Exception as e:
+            metrics.inc('prewarm_wallets_total', result='error')
+            print(f"⚠️ Не удалось прогреть кошелек {wallet}: {str(e)}")
+    print(f"🔥 Прогрето кошельков: {len(wallets)} за {time.perf_counter() - started:.1f} с")
+
+
+def start_prewarm(eth, db, limit):
+    """Запускает прогрев кошельков в фоновом потоке"""
+    thread = threading.Thread(target=prewarm_wallets, args=(eth, db, limit), name='prewarm', daemon=True)
+    thread.start()
+    return thread
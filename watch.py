@@ -0,0 +1,190 @@
+import threading
+from fanout import fan_out
+from metrics import metrics
+from tokens import KNOWN_TOKENS, get_token_info
+
+# keccak256("Transfer(address,address,uint256)"): topic0 события Transfer ERC-20
+TRANSFER_TOPIC = '0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef'
+# Токены, переводы которых отслеживаются у подписок
+WATCH_TOKENS = ('usdt',)
+# Сколько подписок может быть у одного чата
+MAX_SUBSCRIPTIONS = 10
+# Как часто проверять новые блоки, в секундах (блок Ethereum примерно раз в 12 с)
+POLL_INTERVAL = 15
+# Сколько блоков просматривать за один опрос
+BATCH_BLOCKS = 20
+# При большем отставании (бот долго не работал) старые блоки пропускаются
+MAX_LAG = 300
+# Сколько последних блоков не просматривать: узел может еще не отдавать
+# их, а индекс getLogs Etherscan отстает от вершины
+CONFIRMATIONS = 3
+
+
+def topic_address(topic):
+    """Адрес из 32-байтового topic события"""
+    return '0x' + topic[-40:].lower()
+
+
+def scan_eth_block(block, watched):
+    """ETH переводы блока, где отправитель или получатель есть среди watched.
+
+    Видны только обычные транзакции: внутренние переводы контрактов в
+    блоке не записаны и в уведомления не попадают.
+    """
+    transfers = []
+    timestamp = int(block['timestamp'], 16)
+    for tx in block['transactions']:
+        value = int(tx['value'], 16)
+        if not value:
+            continue
+        sender = tx['from'].lower()
+        recipient = (tx.get('to') or '').lower()
+        if sender in watched or recipient in watched:
+            transfers.append({
+                'token': 'eth',
+                'block_number': int(tx['blockNumber'], 16),
+                'timestamp': timestamp,
+                'hash': tx['hash'],
+                'from': sender,
+                'to': recipient,
+                'amount': value / 10**18,
+                'symbol': 'ETH'
+            })
+    return transfers
+
+
+def scan_token_logs(token, token_info, logs, watched):
+    """Переводы токена из событий Transfer, где участвует кошелек из watched"""
+    transfers = []
+    for log in logs:
+        topics = log['topics']
+        if len(topics) < 3:
+            continue
+        sender = topic_address(topics[1])
+        recipient = topic_address(topics[2])
+        if sender in watched or recipient in watched:
+            transfers.append({
+                'token': token,
+                'block_number': int(log['blockNumber'], 16),
+                'timestamp': int(log['timeStamp'], 16),
+                'hash': log['transactionHash'],
+                'from': sender,
+                'to': recipient,
+                'amount': int(log['data'], 16) / 10**token_info.decimals,
+                'symbol': token_info.symbol
+            })
+    return transfers
+
+
+def format_transfer(wallet, transfer):
+    """Текст уведомления о переводе для подписчика кошелька"""
+    incoming = transfer['to'] == wallet
+    digits = 4 if transfer['token'] == 'eth' else 2
+    counterparty = transfer['from'] if incoming else transfer['to']
+    return (
+        f"{'📥 Входящий' if incoming else '📤 Исходящий'} перевод {transfer['amount']:.{digits}f} {transfer['symbol']}\n"
+        f"👛 {wallet}\n"
+        f"{'От' if incoming else 'Кому'}: {counterparty}\n"
+        f"🧱 Блок {transfer['block_number']}\n"
+        f"🔗 https://etherscan.io/tx/{transfer['hash']}"
+    )
+
+
+class WalletWatcher:
+    """Опрос новых блоков и уведомления подписчиков о переводах их кошельков.
+
+    Стоимость опроса зависит от числа новых блоков, а не от числа подписок:
+    на каждый блок один запрос eth_getBlockByNumber для ETH и на весь
+    диапазон один постраничный getLogs по событию Transfer каждого токена.
+    Адреса подписок отбираются уже локально.
+    """
+
+    def __init__(self, eth, db, notify, interval=POLL_INTERVAL, batch_blocks=BATCH_BLOCKS,
+                 max_lag=MAX_LAG, tokens=WATCH_TOKENS, confirmations=CONFIRMATIONS):
+        self.eth = eth
+        self.db = db
+        # notify(chat_id, text) отправляет уведомление
+        self.notify = notify
+        self.interval = interval
+        self.batch_blocks = batch_blocks
+        self.max_lag = max_lag
+        self.tokens = tokens
+        self.confirmations = confirmations
+        self.stopped = threading.Event()
+
+    def poll_once(self):
+        """Просматривает очередной диапазон блоков; возвращает число отправленных уведомлений"""
+        latest_block = self.eth.get_latest_block() - self.confirmations
+        last_block = self.db.get_watch_block()
+        subscriptions = self.db.get_subscriptions()
+        if last_block is None or not subscriptions:
+            # Без подписок смотреть нечего: начинаем с текущего блока
+            self.db.save_watch_block(latest_block)
+            return 0
+        if latest_block - last_block > self.max_lag:
+            print(f"⚠️ Подписки: отставание {latest_block - last_block} блоков, пропускаем старые")
+            metrics.inc('watch_skipped_blocks_total', latest_block - self.batch_blocks - last_block)
+            last_block = latest_block - self.batch_blocks
+        end_block = min(latest_block, last_block + self.batch_blocks)
+        if end_block <= last_block:
+            return 0
+
+        calls = {
+            block_number: lambda block_number=block_number: self.get_block(block_number)
+            for block_number in range(last_block + 1, end_block + 1)
+        }
+        for token in self.tokens:
+            calls[token] = lambda token=token: list(self.eth.iter_logs(
+                KNOWN_TOKENS[token].contract, TRANSFER_TOPIC, last_block + 1, end_block
+            ))
+        # Все вызовы обязательны: при ошибке диапазон будет просмотрен в следующий раз
+        with metrics.timer('watch_poll_seconds'):
+            results = fan_out(calls, 0, required=tuple(calls))
+
+        watched = set(subscriptions)
+        transfers = []
+        for name, result in results.items():
+            if name in self.tokens:
+                transfers.extend(scan_token_logs(name, get_token_info(self.db, name), result, watched))
+            else:
+                transfers.extend(scan_eth_block(result, watched))
+        transfers.sort(key=lambda transfer: transfer['block_number'])
+
+        sent = 0
+        for transfer in transfers:
+            # Перевод между двумя отслеживаемыми кошельками приходит подписчикам обоих
+            for wallet in dict.fromkeys((transfer['from'], transfer['to'])):
+                for chat_id in subscriptions.get(wallet, ()):
+                    try:
+                        self.notify(chat_id, format_transfer(wallet, transfer))
+                        sent += 1
+                    except Exception as e:
+                        print(f"Ошибка при отправке уведомления в чат {chat_id}: {str(e)}")
+        self.db.save_watch_block(end_block)
+        metrics.inc('watch_blocks_total', end_block - last_block)
+        metrics.inc('watch_notifications_total', sent)
+        return sent
+
+    def get_block(self, block_number):
+        """Блок с транзакциями; ошибка, если узел его еще не отдает (null)"""
+        block = self.eth.get_block(block_number)
+        if not block:
+            raise Exception(f"Блок {block_number} еще недоступен")
+        return block
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.poll_once()
+            except Exception as e:
+                print(f"Ошибка при опросе подписок: {str(e)}")
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        """Запускает опрос в фоновом потоке"""
+        thread = threading.Thread(target=self.run, name='watch', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,131 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from telebot import types
+from metrics import metrics
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Telegram доставляет обновления в несколько соединений одновременно
+    request_queue_size = 128
+
+
+class WebhookServer:
+    """HTTP endpoint для обновлений Telegram в режиме webhook.
+
+    Принятое обновление сразу подтверждается ответом 200 и уходит в пул
+    из workers потоков. Если в работе уже max_pending обновлений, сервер
+    отвечает 503, и Telegram повторит доставку позже.
+    """
+
+    def __init__(self, bot, host='0.0.0.0', port=8443, path='/webhook', secret_token=None,
+                 workers=8, max_pending=256):
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='webhook')
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.pending = 0
+        self.pending_lock = threading.Lock()
+        metrics.gauge('webhook_pending_updates', lambda: self.pending)
+        self.httpd = _HTTPServer((host, port), self._make_handler())
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def submit(self, update):
+        """Ставит обновление в пул; False, если пул переполнен"""
+        if not self.slots.acquire(blocking=False):
+            metrics.inc('webhook_updates_total', result='rejected')
+            return False
+        with self.pending_lock:
+            self.pending += 1
+        try:
+            self.pool.submit(self._process, update)
+        except RuntimeError:
+            with self.pending_lock:
+                self.pending -= 1
+            self.slots.release()
+            metrics.inc('webhook_updates_total', result='rejected')
+            return False
+        metrics.inc('webhook_updates_total', result='accepted')
+        return True
+
+    def _process(self, update):
+        try:
+            with metrics.timer('update_handle_seconds'):
+                self.bot.process_new_updates([update])
+        except Exception as e:
+            print(f"Ошибка при обработке обновления {update.update_id}: {str(e)}")
+        finally:
+            with self.pending_lock:
+                self.pending -= 1
+            self.slots.release()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                # Проверка доступности для балансировщика
+                self._reply(200)
+
+            def do_POST(self):
+                if self.path != server.path:
+                    self._reply(404)
+                    return
+                if server.secret_token and \
+                        self.headers.get('X-Telegram-Bot-Api-Secret-Token') != server.secret_token:
+                    self._reply(403)
+                    return
+                try:
+                    body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                    update = types.Update.de_json(json.loads(body))
+                except Exception:
+                    self._reply(400)
+                    return
+                self._reply(200 if server.submit(update) else 503)
+
+            def _reply(self, status):
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def serve_forever(self):
+        print(f"🌐 Webhook слушает порт {self.port}, путь {self.path}")
+        self.httpd.serve_forever()
+
+    def start(self):
+        """Запускает сервер в фоновом потоке"""
+        thread = threading.Thread(target=self.serve_forever, name='webhook-http', daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.pool.shutdown(wait=True)
+
+
+def run_webhook(bot, public_url, host='0.0.0.0', port=8443, path='/webhook', secret_token=None,
+                workers=8, max_pending=256):
+    """Регистрирует webhook в Telegram и обслуживает его до остановки процесса.
+
+    Накопившиеся за время перезапуска обновления не сбрасываются.
+    """
+    server = WebhookServer(bot, host, port, path, secret_token, workers, max_pending)
+    bot.set_webhook(
+        url=public_url.rstrip('/') + path,
+        secret_token=secret_token,
+        max_connections=min(max(workers, 1), 100),
+        drop_pending_updates=False
+    )
+    server.serve_forever()